@@ -1,7 +1,12 @@
 from django.contrib import admin
 from django.contrib import messages
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from import_export.admin import ImportExportModelAdmin
 
+from .availability import reporte_capacidad
+from .forms import ReporteCapacidadForm
 from .models import *
 from .resources import *
 
@@ -190,9 +195,50 @@ class ArticuloAdmin(ImportExportModelAdmin):
     search_fields = ['nombre', 'codigo']
     filter_horizontal = ('_categorias',)
     inlines = [ArticuloUnidadInline]
+    actions = ['ver_capacidad']
 
     resource_class = UnidadResource
 
+    def get_urls(self):
+        return [
+            path('capacidad/', self.admin_site.admin_view(self.capacidad), name='PEMA_articulo_capacidad'),
+        ] + super().get_urls()
+
+    @admin.action(description='Reporte de capacidad')
+    def ver_capacidad(self, request, queryset):
+        ids = ','.join(str(articulo_id) for articulo_id in queryset.values_list('id', flat=True))
+        return redirect(f"{reverse('admin:PEMA_articulo_capacidad')}?articulos={ids}")
+
+    def capacidad(self, request):
+        """
+        Muestra, para cada artículo y bloque del periodo, las unidades activas, las
+        reservadas y la demanda máxima, resaltando los bloques sobresuscritos.
+        """
+        datos = request.GET.copy()
+        if 'articulos' in datos:
+            datos.setlist('articulos', [i for ids in datos.getlist('articulos') for i in ids.split(',') if i])
+        form = ReporteCapacidadForm(datos if 'desde' in datos else None,
+                                    initial={'articulos': datos.getlist('articulos')})
+
+        filas = []
+        if form.is_valid():
+            desde, hasta, bloque = form.periodo()
+            articulos = form.cleaned_data['articulos'] or Articulo.objects.all()
+            nombres = dict(articulos.values_list('id', 'nombre'))
+            reporte = reporte_capacidad(list(nombres), desde, hasta, bloque)
+            for articulo_id, bloques in reporte.items():
+                for inicio, activas, reservadas, demanda in bloques:
+                    if demanda > activas or not form.cleaned_data['sobresuscritos']:
+                        filas.append((nombres[articulo_id], inicio, activas, reservadas, demanda, demanda > activas))
+
+        return TemplateResponse(request, 'admin/PEMA/articulo/capacidad.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Reporte de capacidad',
+            'form': form,
+            'filas': filas,
+        })
+
 
 class ArticuloCarritoInline(admin.TabularInline):
     """
@@ -210,7 +256,7 @@ class CarritoAdmin(admin.ModelAdmin):
     al igual que gestiona relaciones y permite la acción de ordenar artículos en carritos seleccionados.
     """
     actions = ['ordenar']
-    list_display = ('prestatario', 'materia')
+    list_display = ('prestatario', 'materia', 'actualizado')
     inlines = [ArticuloCarritoInline]
     filter_horizontal = ('_corresponsables',)
 
@@ -275,3 +321,61 @@ class CategoriaAdmin(admin.ModelAdmin):
     list_display = ('nombre',)
     search_fields = ['nombre']
     inlines = [ArticuloInline]
+
+
+@admin.register(ListaEspera)
+class ListaEsperaAdmin(admin.ModelAdmin):
+    """
+    Muestra las entradas de la lista de espera en el orden en que se atienden,
+    filtradas por estado y artículo.
+    """
+    list_display = ('prestatario', 'articulo', 'inicio', 'final', 'unidades', 'estado', 'creado')
+    list_filter = ('estado', 'articulo')
+    ordering = ('creado', 'id')
+
+
+class OrdenSerieInline(admin.TabularInline):
+    """
+    Muestra las órdenes que forman una serie.
+    """
+    model = Orden
+    fields = ('nombre', 'inicio', 'final', 'estado')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(SerieOrden)
+class SerieOrdenAdmin(admin.ModelAdmin):
+    """
+    Gestiona las series de órdenes recurrentes, mostrando sus órdenes y permitiendo
+    cancelar las que aún no se entregan.
+    """
+    list_display = ('id', 'prestatario', 'repeticiones', 'semanas', 'emision')
+    inlines = [OrdenSerieInline]
+    actions = ['cancelar']
+
+    @admin.action(description='Cancelar órdenes pendientes de la serie')
+    def cancelar(self, request, queryset):
+        for serie in queryset:
+            serie.cancelar()
+        self.message_user(request, f'{queryset.count()} serie(s) cancelada(s).', messages.SUCCESS)
+
+
+class ArticuloKitInline(admin.TabularInline):
+    """
+    Ofrece una interfaz para seleccionar los artículos de un kit y sus unidades.
+    """
+    autocomplete_fields = ['articulo']
+    model = ArticuloKit
+    extra = 1
+
+
+@admin.register(Kit)
+class KitAdmin(admin.ModelAdmin):
+    """
+    Administra los kits, permitiendo buscarlos por nombre y gestionar sus artículos.
+    """
+    list_display = ('nombre', 'descripcion')
+    search_fields = ['nombre']
+    inlines = [ArticuloKitInline]
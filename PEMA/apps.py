@@ -6,4 +6,5 @@ class PemaConfig(AppConfig):
     name = 'PEMA'
 
     def ready(self):
-        import PEMA.signals
\ No newline at end of file
+        import PEMA.checks
+        import PEMA.signals
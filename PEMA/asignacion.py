@@ -0,0 +1,80 @@
+"""
+Estrategias de asignación de unidades.
+
+Al convertir un carrito en orden se deben elegir, entre las unidades disponibles
+de un artículo, cuáles se prestan. Cada estrategia recibe el ``QuerySet`` de
+unidades disponibles y lo devuelve ordenado por preferencia, de modo que las
+unidades elegidas se obtienen con una sola consulta rebanando el resultado.
+
+La estrategia se elige con ``ASIGNACION_ESTRATEGIA`` en ``settings``.
+"""
+from django.conf import settings
+from django.db.models import DurationField, ExpressionWrapper, F, Max, Q, Sum
+
+# Estrategia usada si ``ASIGNACION_ESTRATEGIA`` no está definido
+ESTRATEGIA_DEFAULT = 'aleatoria'
+
+
+def _prestamos():
+    """
+    Filtro de las reservas de órdenes en las que la unidad realmente salió del almacén.
+    """
+    from .models import EstadoOrden
+
+    return Q(reservas__orden__estado__in=[EstadoOrden.ENTREGADA, EstadoOrden.DEVUELTA])
+
+
+def aleatoria(unidades):
+    """
+    Elige las unidades al azar.
+
+    :param unidades: Unidades disponibles.
+    :returns: Unidades en orden aleatorio.
+    """
+    return unidades.order_by('?')
+
+
+def menos_reciente(unidades):
+    """
+    Prefiere las unidades que llevan más tiempo sin prestarse; las que nunca se
+    han prestado van primero.
+
+    :param unidades: Unidades disponibles.
+    :returns: Unidades ordenadas por la fecha de su último préstamo.
+    """
+    return unidades.annotate(
+        ultimo_prestamo=Max('reservas__final', filter=_prestamos())
+    ).order_by(F('ultimo_prestamo').asc(nulls_first=True), 'id')
+
+
+def menor_uso(unidades):
+    """
+    Prefiere las unidades con menos horas de préstamo acumuladas para repartir el desgaste.
+
+    :param unidades: Unidades disponibles.
+    :returns: Unidades ordenadas por tiempo de préstamo acumulado.
+    """
+    duracion = ExpressionWrapper(F('reservas__final') - F('reservas__inicio'), output_field=DurationField())
+    return unidades.annotate(
+        uso=Sum(duracion, filter=_prestamos())
+    ).order_by(F('uso').asc(nulls_first=True), 'id')
+
+
+ESTRATEGIAS = {
+    'aleatoria': aleatoria,
+    'menos_reciente': menos_reciente,
+    'menor_uso': menor_uso,
+}
+
+
+def elegir_unidades(unidades, cantidad: int, estrategia: str = None) -> list[int]:
+    """
+    Elige con una sola consulta los ids de las unidades que se asignarán.
+
+    :param unidades: Unidades disponibles.
+    :param cantidad: Número de unidades a elegir.
+    :param estrategia: Nombre de la estrategia; por defecto ``ASIGNACION_ESTRATEGIA``.
+    :returns: Ids de las unidades elegidas; pueden ser menos que ``cantidad``.
+    """
+    estrategia = estrategia or getattr(settings, 'ASIGNACION_ESTRATEGIA', ESTRATEGIA_DEFAULT)
+    return list(ESTRATEGIAS[estrategia](unidades).values_list('id', flat=True)[:cantidad])
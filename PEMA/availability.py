@@ -0,0 +1,1117 @@
+"""
+Motor de disponibilidad en memoria.
+
+Mantiene, por cada artículo, un arreglo de intervalos ordenado por fecha de inicio
+con las reservas bloqueantes de sus unidades activas, y una matriz booleana
+unidades × bloques de 30 minutos que cubre el horizonte de préstamos. Ambas
+estructuras se construyen de forma perezosa desde ``UnidadReserva`` y se actualizan
+incrementalmente desde las señales de ``Orden``, ``Orden._unidades`` y ``Unidad``
+una vez que la transacción se confirma. Los intervalos son los de
+``UnidadReserva.inicio_con_margen`` y ``final_con_margen``, que ya incluyen el
+margen entre préstamos de cada artículo.
+
+La consulta SQL de ``Articulo.disponible`` sigue siendo la implementación de
+referencia; este motor solo se usa cuando ``DISPONIBILIDAD_EN_MEMORIA`` está activo.
+
+Delante de ambos puede activarse un caché de resultados (``DISPONIBILIDAD_CACHE``)
+sobre el framework de caché de Django, invalidado por artículo desde las mismas señales.
+Esas señales también publican los artículos modificados en ``canal_disponibilidad``
+para avisar a los catálogos abiertos.
+"""
+import heapq
+import math
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Min
+from django.utils import timezone
+
+# duración de un bloque de la matriz, igual a la separación de FiltrosForm.hora_inicio
+MINUTOS_BLOQUE = 30
+
+
+class IndiceArticulo:
+    """
+    Reservas bloqueantes de las unidades activas de un artículo.
+
+    Los intervalos se guardan ordenados por inicio; como se conoce la duración
+    máxima, una consulta solo revisa los intervalos que inician entre
+    ``inicio - duracion_maxima`` y ``final`` (O(log n + k)).
+
+    :ivar unidades: Ids de las unidades activas del artículo.
+    :ivar intervalos: Tuplas ``(inicio, final, unidad_id, orden_id)`` ordenadas.
+    :ivar ordenes: Intervalos de cada orden, para quitarlos con búsqueda binaria sin
+        recorrer todo el índice.
+    :ivar duracion_maxima: Duración del intervalo más largo del índice.
+    :ivar vence: Expiración más próxima de los apartados del índice, o None si no
+        tiene apartados; a partir de ella el índice está desactualizado.
+    :ivar creado: Momento (monotónico) en que se construyó el índice.
+    """
+
+    def __init__(self, unidades, intervalos, vence=None):
+        self.unidades = set(unidades)
+        self.intervalos = sorted(intervalos)
+        self.ordenes: dict[int, list[tuple]] = {}
+        for intervalo in self.intervalos:
+            self.ordenes.setdefault(intervalo[3], []).append(intervalo)
+        self.duracion_maxima = max((final - inicio for inicio, final, _, _ in self.intervalos), default=timedelta(0))
+        self.vence = vence
+        self.creado = time.monotonic()
+
+    def agregar(self, inicio, final, unidad_id, orden_id):
+        """
+        Agrega un intervalo manteniendo el orden.
+        """
+        intervalo = (inicio, final, unidad_id, orden_id)
+        insort(self.intervalos, intervalo)
+        self.ordenes.setdefault(orden_id, []).append(intervalo)
+        self.duracion_maxima = max(self.duracion_maxima, final - inicio)
+
+    def quitar_orden(self, orden_id):
+        """
+        Quita todos los intervalos de una orden.
+        """
+        for intervalo in self.ordenes.pop(orden_id, ()):
+            del self.intervalos[bisect_left(self.intervalos, intervalo)]
+
+    def ocupadas(self, inicio, final) -> set[int]:
+        """
+        Obtiene las unidades con una reserva que se traslapa con el rango.
+
+        :param inicio: Fecha y hora de inicio del rango.
+        :param final: Fecha y hora de finalización del rango.
+        :returns: Ids de las unidades ocupadas.
+        """
+        desde = bisect_left(self.intervalos, (inicio - self.duracion_maxima,))
+        hasta = bisect_left(self.intervalos, (final,))
+        return {
+            unidad_id
+            for reserva_inicio, reserva_final, unidad_id, _ in self.intervalos[desde:hasta]
+            if reserva_final > inicio
+        }
+
+    def disponibles(self, inicio, final) -> set[int]:
+        """
+        Obtiene las unidades activas libres en el rango.
+
+        :param inicio: Fecha y hora de inicio del rango.
+        :param final: Fecha y hora de finalización del rango.
+        :returns: Ids de las unidades disponibles.
+        """
+        return self.unidades - self.ocupadas(inicio, final)
+
+
+class MatrizDisponibilidad:
+    """
+    Ocupación de todas las unidades activas en bloques de ``MINUTOS_BLOQUE`` minutos.
+
+    Cada fila es una unidad y cada columna un bloque a partir de ``origen``. Una
+    reserva ocupa todos los bloques que toca, de modo que las reservas que no están
+    alineadas a la cuadrícula se redondean hacia afuera (nunca se reporta libre una
+    unidad ocupada).
+
+    :ivar origen: Fecha y hora del primer bloque.
+    :ivar alcance: Ids de los artículos incluidos, o None para incluir todos.
+    :ivar num_bloques: Número de bloques del horizonte.
+    :ivar filas: Fila de la matriz de cada unidad.
+    :ivar articulos: Filas de las unidades de cada artículo.
+    :ivar ordenes: Unidades reservadas por cada orden.
+    :ivar ordenes_unidad: Órdenes que reservan cada unidad, para recalcular unas
+        cuantas unidades sin recorrer todas las órdenes.
+    :ivar ocupacion: Matriz booleana unidades × bloques.
+    :ivar expiraciones: Montículo de tuplas ``(expira, unidad_id)`` de los apartados
+        marcados, para recalcular sus unidades cuando expiran.
+    :ivar creado: Momento (monotónico) en que se construyó la matriz.
+    """
+
+    def __init__(self, origen, dias: int, articulos: list[int] = None):
+        self.origen = origen
+        self.alcance = articulos
+        self.num_bloques = dias * 24 * 60 // MINUTOS_BLOQUE
+        self.filas: dict[int, int] = {}
+        self.articulos: dict[int, np.ndarray] = {}
+        self.ordenes: dict[int, set[int]] = {}
+        self.ordenes_unidad: dict[int, set[int]] = {}
+        self.ocupacion = np.zeros((0, self.num_bloques), dtype=bool)
+        self.expiraciones: list[tuple] = []
+        self.creado = time.monotonic()
+
+    @property
+    def final(self):
+        return self.origen + timedelta(minutes=self.num_bloques * MINUTOS_BLOQUE)
+
+    def bloque(self, fecha, redondear_arriba=False) -> int:
+        """
+        Obtiene el índice del bloque que contiene una fecha.
+
+        :param fecha: Fecha y hora a convertir.
+        :param redondear_arriba: Si es True se usa el primer bloque que inicia después de la fecha.
+        :returns: Índice del bloque, limitado al horizonte.
+        """
+        bloques = (fecha - self.origen).total_seconds() / (MINUTOS_BLOQUE * 60)
+        bloque = math.ceil(bloques) if redondear_arriba else math.floor(bloques)
+        return min(max(bloque, 0), self.num_bloques)
+
+    def contiene(self, inicio, final) -> bool:
+        """
+        Verifica si un rango de fechas está dentro del horizonte de la matriz.
+        """
+        return self.origen <= inicio and final <= self.final
+
+    def construir(self):
+        """
+        Carga las unidades activas y sus reservas bloqueantes dentro del horizonte.
+        """
+        from .models import Unidad
+
+        unidades = Unidad.objects.filter(estado=Unidad.Estado.ACTIVO)
+        if self.alcance is not None:
+            unidades = unidades.filter(articulo_id__in=self.alcance)
+        unidades = list(unidades.values_list('id', 'articulo_id'))
+        self.filas = {unidad_id: fila for fila, (unidad_id, _) in enumerate(unidades)}
+
+        filas_articulo: dict[int, list[int]] = {}
+        for fila, (_, articulo_id) in enumerate(unidades):
+            filas_articulo.setdefault(articulo_id, []).append(fila)
+        self.articulos = {articulo_id: np.array(filas) for articulo_id, filas in filas_articulo.items()}
+
+        self.ocupacion = np.zeros((len(unidades), self.num_bloques), dtype=bool)
+        self.ordenes = {}
+        self.ordenes_unidad = {}
+        self.expiraciones = []
+        self._marcar(self._reservas())
+
+    def _reservas(self, **filtros):
+        from .models import UnidadReserva
+
+        reservas = UnidadReserva.objects.colisiones(self.origen, self.final).filter(**filtros)
+        if self.alcance is not None:
+            reservas = reservas.filter(unidad__articulo_id__in=self.alcance)
+        return reservas.values_list('unidad_id', 'orden_id', 'inicio_con_margen', 'final_con_margen', 'expira')
+
+    def _marcar(self, reservas):
+        """
+        Marca como ocupados los bloques de las reservas usando un arreglo de diferencias.
+        """
+        filas, inicios, finales = [], [], []
+        for unidad_id, orden_id, inicio, final, expira in reservas:
+            self.ordenes.setdefault(orden_id, set()).add(unidad_id)
+            self.ordenes_unidad.setdefault(unidad_id, set()).add(orden_id)
+            if expira is not None:
+                heapq.heappush(self.expiraciones, (expira, unidad_id))
+            fila = self.filas.get(unidad_id)
+            if fila is None:
+                continue
+            filas.append(fila)
+            inicios.append(self.bloque(inicio))
+            finales.append(self.bloque(final, redondear_arriba=True))
+
+        if not filas:
+            return
+
+        afectadas, ocupadas = self._ocupar(filas, inicios, finales)
+        self.ocupacion[afectadas] |= ocupadas
+
+    def _ocupar(self, filas: list[int], inicios: list[int], finales: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Calcula la ocupación de las filas de unas reservas con un arreglo de diferencias,
+        acumulando solo las filas afectadas.
+
+        :returns: Tupla con las filas afectadas y su ocupación.
+        """
+        afectadas, posiciones = np.unique(filas, return_inverse=True)
+        diferencias = np.zeros((len(afectadas), self.num_bloques + 1), dtype=np.int32)
+        np.add.at(diferencias, (posiciones, inicios), 1)
+        np.add.at(diferencias, (posiciones, finales), -1)
+        return afectadas, np.cumsum(diferencias, axis=1)[:, :-1] > 0
+
+    def ocupacion_sin(self, excluidas) -> dict[int, np.ndarray]:
+        """
+        Recalcula la ocupación de las unidades de unas reservas como si esas reservas no
+        existieran, sin modificar la matriz.
+
+        :param excluidas: ``QuerySet`` de las reservas que no se cuentan.
+        :returns: Diccionario con la fila de cada unidad afectada y su ocupación.
+        """
+        from .models import UnidadReserva
+
+        unidades = set(excluidas.values_list('unidad_id', flat=True)) & self.filas.keys()
+        reemplazos = {self.filas[unidad_id]: np.zeros(self.num_bloques, dtype=bool) for unidad_id in unidades}
+
+        filas, inicios, finales = [], [], []
+        for unidad_id, inicio, final in UnidadReserva.objects.colisiones(self.origen, self.final).filter(
+            unidad_id__in=unidades
+        ).exclude(id__in=excluidas.values('id')).values_list('unidad_id', 'inicio_con_margen', 'final_con_margen'):
+            filas.append(self.filas[unidad_id])
+            inicios.append(self.bloque(inicio))
+            finales.append(self.bloque(final, redondear_arriba=True))
+
+        if filas:
+            for fila, ocupada in zip(*self._ocupar(filas, inicios, finales)):
+                reemplazos[int(fila)] = ocupada
+        return reemplazos
+
+    def recalcular_unidades(self, unidades: set[int]):
+        """
+        Vuelve a calcular solo las filas de las unidades indicadas.
+
+        :param unidades: Ids de las unidades a recalcular.
+        """
+        filas = [self.filas[unidad_id] for unidad_id in unidades if unidad_id in self.filas]
+        if not filas:
+            return
+
+        self.ocupacion[filas, :] = False
+        for unidad_id in unidades:
+            for orden_id in self.ordenes_unidad.pop(unidad_id, ()):
+                unidades_orden = self.ordenes.get(orden_id)
+                if unidades_orden is not None:
+                    unidades_orden.discard(unidad_id)
+                    if not unidades_orden:
+                        del self.ordenes[orden_id]
+        self._marcar(self._reservas(unidad_id__in=unidades))
+
+    def recalcular_expirados(self):
+        """
+        Recalcula las filas de las unidades con apartados que ya expiraron, aunque
+        ``liberar_expirados`` todavía no los elimine.
+        """
+        ahora = timezone.now()
+        unidades = set()
+        while self.expiraciones and self.expiraciones[0][0] <= ahora:
+            unidades.add(heapq.heappop(self.expiraciones)[1])
+        if unidades:
+            self.recalcular_unidades(unidades)
+
+    def refrescar_orden(self, orden_id: int):
+        """
+        Recalcula las filas de las unidades que tenía y que tiene ahora una orden.
+
+        :param orden_id: Id de la orden que cambió.
+        """
+        from .models import UnidadReserva
+
+        anteriores = self.ordenes.pop(orden_id, set())
+        actuales = set(UnidadReserva.objects.filter(orden_id=orden_id).values_list('unidad_id', flat=True))
+        self.recalcular_unidades(anteriores | actuales)
+
+    def libres(self, articulo_id: int, inicio, final) -> int:
+        """
+        Cuenta las unidades de un artículo sin reservas en un rango de fechas.
+
+        :param articulo_id: Id del artículo.
+        :param inicio: Fecha y hora de inicio del rango.
+        :param final: Fecha y hora de finalización del rango.
+        :returns: Número de unidades disponibles.
+        """
+        filas = self.articulos.get(articulo_id)
+        if filas is None:
+            return 0
+
+        desde, hasta = self.bloque(inicio), self.bloque(final, redondear_arriba=True)
+        return int(np.count_nonzero(~self.ocupacion[filas, desde:hasta].any(axis=1)))
+
+    def libres_por_bloque(self, articulo_id: int, inicio, final) -> np.ndarray:
+        """
+        Cuenta, para cada bloque de un rango, las unidades libres de un artículo.
+
+        :param articulo_id: Id del artículo.
+        :param inicio: Fecha y hora de inicio del rango.
+        :param final: Fecha y hora de finalización del rango.
+        :returns: Arreglo con el número de unidades libres de cada bloque.
+        """
+        desde, hasta = self.bloque(inicio), self.bloque(final, redondear_arriba=True)
+        filas = self.articulos.get(articulo_id)
+        if filas is None:
+            return np.zeros(hasta - desde, dtype=int)
+        return np.count_nonzero(~self.ocupacion[filas, desde:hasta], axis=0)
+
+    def libres_en_rangos(self, articulo_id: int, rangos: list[tuple],
+                         reemplazos: dict[int, np.ndarray] = None) -> np.ndarray:
+        """
+        Cuenta las unidades libres de un artículo en cada uno de varios rangos. Con la
+        suma acumulada de la ocupación de cada fila, los bloques ocupados de una unidad
+        en un rango se obtienen con una resta, sin recorrer el rango.
+
+        :param articulo_id: Id del artículo.
+        :param rangos: Lista de tuplas ``(inicio, final)`` dentro del horizonte.
+        :param reemplazos: Ocupación que sustituye la de algunas filas, como la que
+            devuelve ``ocupacion_sin``.
+        :returns: Arreglo con el número de unidades libres en cada rango.
+        """
+        filas = self.articulos.get(articulo_id)
+        if filas is None:
+            return np.zeros(len(rangos), dtype=int)
+
+        ocupacion = self.ocupacion[filas]
+        for posicion, fila in enumerate(filas):
+            if reemplazos and fila in reemplazos:
+                ocupacion[posicion] = reemplazos[fila]
+
+        acumulada = np.zeros((len(filas), self.num_bloques + 1), dtype=np.int32)
+        np.cumsum(ocupacion, axis=1, out=acumulada[:, 1:])
+        desde = np.array([self.bloque(inicio) for inicio, _ in rangos], dtype=int)
+        hasta = np.array([self.bloque(final, redondear_arriba=True) for _, final in rangos], dtype=int)
+        return np.count_nonzero(acumulada[:, hasta] == acumulada[:, desde], axis=0)
+
+
+class MotorDisponibilidad:
+    """
+    Conjunto de índices por artículo compartido por el proceso.
+
+    Los índices caducan después de ``DISPONIBILIDAD_EN_MEMORIA_TTL`` segundos para
+    acotar el desfase con cambios hechos por otros procesos, y en cuanto expira alguno
+    de sus apartados.
+    """
+
+    def __init__(self):
+        self._indices: dict[int, IndiceArticulo] = {}
+        self._matriz: MatrizDisponibilidad | None = None
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def activo() -> bool:
+        """
+        Verifica si las consultas de disponibilidad deben usar el motor en memoria.
+        """
+        return getattr(settings, 'DISPONIBILIDAD_EN_MEMORIA', False)
+
+    @staticmethod
+    def _ttl() -> float:
+        return getattr(settings, 'DISPONIBILIDAD_EN_MEMORIA_TTL', 60)
+
+    @staticmethod
+    def _construir(articulo_id: int) -> IndiceArticulo:
+        from .models import Unidad, UnidadReserva
+
+        unidades = Unidad.objects.filter(
+            articulo_id=articulo_id, estado=Unidad.Estado.ACTIVO
+        ).values_list('id', flat=True)
+
+        reservas = list(UnidadReserva.objects.vigentes().filter(
+            unidad__articulo_id=articulo_id, bloqueante=True
+        ).values_list('inicio_con_margen', 'final_con_margen', 'unidad_id', 'orden_id', 'expira'))
+
+        vence = min((expira for *_, expira in reservas if expira is not None), default=None)
+        return IndiceArticulo(unidades, [reserva[:4] for reserva in reservas], vence)
+
+    def indice(self, articulo_id: int) -> IndiceArticulo:
+        """
+        Obtiene el índice de un artículo, construyéndolo si no existe, caducó o
+        expiró alguno de sus apartados.
+
+        :param articulo_id: Id del artículo.
+        :returns: El índice del artículo.
+        """
+        with self._lock:
+            indice = self._indices.get(articulo_id)
+            if indice is None or time.monotonic() - indice.creado > self._ttl() \
+                    or (indice.vence is not None and indice.vence <= timezone.now()):
+                indice = self._construir(articulo_id)
+                self._indices[articulo_id] = indice
+            return indice
+
+    def matriz(self) -> MatrizDisponibilidad:
+        """
+        Obtiene la matriz de ocupación, construyéndola si no existe, caducó o el
+        horizonte ya no inicia hoy. Las filas de las unidades con apartados expirados
+        se recalculan.
+
+        :returns: La matriz de ocupación del horizonte actual.
+        """
+        with self._lock:
+            hoy = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+            matriz = self._matriz
+            if matriz is None or matriz.origen != hoy or time.monotonic() - matriz.creado > self._ttl():
+                matriz = MatrizDisponibilidad(hoy, getattr(settings, 'DISPONIBILIDAD_MATRIZ_DIAS', 180))
+                matriz.construir()
+                self._matriz = matriz
+            else:
+                matriz.recalcular_expirados()
+            return matriz
+
+    def contar(self, articulos: list[int], inicio, final) -> dict[int, int]:
+        """
+        Cuenta las unidades disponibles de varios artículos en un rango de fechas.
+        Usa la matriz de ocupación si el rango está dentro de su horizonte.
+
+        :param articulos: Ids de los artículos.
+        :param inicio: Fecha y hora de inicio del rango.
+        :param final: Fecha y hora de finalización del rango.
+        :returns: Diccionario con el id del artículo y sus unidades disponibles.
+        """
+        with self._lock:
+            matriz = self.matriz()
+            if matriz.contiene(inicio, final):
+                return {articulo_id: matriz.libres(articulo_id, inicio, final) for articulo_id in articulos}
+            return {articulo_id: len(self.disponibles(articulo_id, inicio, final)) for articulo_id in articulos}
+
+    def contar_rangos(self, articulos: list[int], rangos: list[tuple],
+                      carrito=None) -> dict[int, np.ndarray] | None:
+        """
+        Cuenta las unidades disponibles de varios artículos en cada uno de varios
+        rangos usando la matriz de ocupación.
+
+        :param articulos: Ids de los artículos.
+        :param rangos: Lista de tuplas ``(inicio, final)``.
+        :param carrito: Carrito cuyos apartados no se consideran ocupados.
+        :returns: Diccionario con el id del artículo y el número de unidades libres en
+            cada rango, o None si algún rango está fuera del horizonte de la matriz.
+        """
+        from .models import UnidadReserva
+
+        with self._lock:
+            matriz = self.matriz()
+            if not matriz.contiene(min(inicio for inicio, _ in rangos), max(final for _, final in rangos)):
+                return None
+
+            reemplazos = None
+            if carrito is not None:
+                reemplazos = matriz.ocupacion_sin(UnidadReserva.objects.filter(carrito=carrito))
+            return {articulo_id: matriz.libres_en_rangos(articulo_id, rangos, reemplazos) for articulo_id in articulos}
+
+    def disponibles(self, articulo_id: int, inicio, final) -> set[int]:
+        """
+        Obtiene las unidades disponibles de un artículo en un rango de fechas.
+
+        :param articulo_id: Id del artículo.
+        :param inicio: Fecha y hora de inicio del rango.
+        :param final: Fecha y hora de finalización del rango.
+        :returns: Ids de las unidades disponibles.
+        """
+        with self._lock:
+            return self.indice(articulo_id).disponibles(inicio, final)
+
+    def refrescar_orden(self, orden_id: int):
+        """
+        Vuelve a leer las reservas de una orden y las aplica a los índices cargados.
+
+        :param orden_id: Id de la orden que cambió.
+        """
+        from .models import UnidadReserva
+
+        with self._lock:
+            if self._matriz is not None:
+                self._matriz.refrescar_orden(orden_id)
+
+            if not self._indices:
+                return
+
+            for indice in self._indices.values():
+                indice.quitar_orden(orden_id)
+
+            reservas = UnidadReserva.objects.filter(orden_id=orden_id, bloqueante=True).values_list(
+                'inicio_con_margen', 'final_con_margen', 'unidad_id', 'unidad__articulo_id'
+            )
+            for inicio, final, unidad_id, articulo_id in reservas:
+                indice = self._indices.get(articulo_id)
+                if indice is not None:
+                    indice.agregar(inicio, final, unidad_id, orden_id)
+
+    def refrescar_unidades(self, articulos: set[int], unidades: set[int]):
+        """
+        Vuelve a leer las reservas de unidades cuyos apartados cambiaron: recalcula sus
+        filas de la matriz y descarta los índices de sus artículos.
+
+        :param articulos: Ids de los artículos de las unidades.
+        :param unidades: Ids de las unidades.
+        """
+        with self._lock:
+            if self._matriz is not None:
+                self._matriz.recalcular_unidades(unidades)
+            for articulo_id in articulos:
+                self._indices.pop(articulo_id, None)
+
+    def invalidar(self, articulo_id: int = None):
+        """
+        Descarta el índice de un artículo (o todos) para reconstruirlo en la siguiente consulta.
+
+        :param articulo_id: Id del artículo. Si es None se descartan todos los índices.
+        """
+        with self._lock:
+            # la matriz agrupa todas las unidades, cualquier cambio de unidades la invalida
+            self._matriz = None
+            if articulo_id is None:
+                self._indices.clear()
+            else:
+                self._indices.pop(articulo_id, None)
+
+
+motor = MotorDisponibilidad()
+
+
+class CacheDisponibilidad:
+    """
+    Caché de las unidades disponibles de cada artículo por rango de fechas, sobre el
+    framework de caché de Django (``DISPONIBILIDAD_CACHE_ALIAS``).
+
+    Cada artículo tiene un número de versión que forma parte de sus llaves; las
+    señales lo incrementan cuando cambian sus reservas o unidades, de modo que solo
+    se descartan las entradas de los artículos afectados. Una entrada no dura más que
+    el apartado más próximo a expirar del rango. Los aciertos y fallos se cuentan en
+    el mismo caché para que sean visibles entre procesos.
+    """
+
+    PREFIJO = 'disponibilidad'
+
+    @staticmethod
+    def activo() -> bool:
+        """
+        Verifica si las consultas de disponibilidad deben pasar por el caché.
+        """
+        return getattr(settings, 'DISPONIBILIDAD_CACHE', False)
+
+    @staticmethod
+    def _cache():
+        return caches[getattr(settings, 'DISPONIBILIDAD_CACHE_ALIAS', 'default')]
+
+    def _llave_version(self, articulo_id: int) -> str:
+        return f"{self.PREFIJO}:version:{articulo_id}"
+
+    def _llave(self, articulo_id: int, version: int, inicio, final) -> str:
+        return f"{self.PREFIJO}:{articulo_id}:{version}:{int(inicio.timestamp())}:{int(final.timestamp())}"
+
+    def _incrementar(self, llave: str, cantidad: int = 1):
+        cache = self._cache()
+        cache.add(llave, 0, timeout=None)
+        try:
+            cache.incr(llave, cantidad)
+        except ValueError:
+            # la llave expiró entre add e incr
+            cache.set(llave, cantidad, timeout=None)
+
+    def obtener(self, articulos: list[int], inicio, final, calcular) -> dict[int, list[int]]:
+        """
+        Obtiene las unidades disponibles de varios artículos; los que no están en el
+        caché se calculan juntos con ``calcular`` y se guardan.
+
+        :param articulos: Ids de los artículos.
+        :param inicio: Fecha y hora de inicio del rango.
+        :param final: Fecha y hora de finalización del rango.
+        :param calcular: Función que recibe los ids faltantes y devuelve un diccionario
+            con el id del artículo y los ids de sus unidades disponibles.
+        :returns: Diccionario con el id del artículo y los ids de sus unidades disponibles.
+        """
+        cache = self._cache()
+        versiones = cache.get_many([self._llave_version(articulo_id) for articulo_id in articulos])
+        llaves = {
+            articulo_id: self._llave(articulo_id, versiones.get(self._llave_version(articulo_id), 0), inicio, final)
+            for articulo_id in articulos
+        }
+
+        encontrados = cache.get_many(list(llaves.values()))
+        resultado = {articulo_id: encontrados[llave] for articulo_id, llave in llaves.items() if llave in encontrados}
+        faltantes = [articulo_id for articulo_id in articulos if articulo_id not in resultado]
+
+        if resultado:
+            self._incrementar(f"{self.PREFIJO}:aciertos", len(resultado))
+        if faltantes:
+            self._incrementar(f"{self.PREFIJO}:fallos", len(faltantes))
+            calculados = calcular(faltantes)
+            nuevos = {articulo_id: sorted(calculados.get(articulo_id, [])) for articulo_id in faltantes}
+
+            por_duracion: dict[int, dict] = {}
+            for articulo_id, duracion in self._duraciones(faltantes, inicio, final).items():
+                if duracion > 0:
+                    por_duracion.setdefault(duracion, {})[llaves[articulo_id]] = nuevos[articulo_id]
+            for duracion, entradas in por_duracion.items():
+                cache.set_many(entradas, timeout=duracion)
+            resultado.update(nuevos)
+
+        return resultado
+
+    @staticmethod
+    def _duraciones(articulos: list[int], inicio, final) -> dict[int, int]:
+        """
+        Calcula cuántos segundos puede guardarse la disponibilidad de cada artículo:
+        ``DISPONIBILIDAD_CACHE_TTL`` o menos si algún apartado del rango expira antes.
+        """
+        from .models import UnidadReserva
+
+        ttl = getattr(settings, 'DISPONIBILIDAD_CACHE_TTL', 300)
+        duraciones = dict.fromkeys(articulos, ttl)
+        ahora = timezone.now()
+        for articulo_id, vence in UnidadReserva.objects.colisiones(inicio, final).filter(
+            unidad__articulo_id__in=articulos, expira__isnull=False
+        ).values('unidad__articulo_id').annotate(vence=Min('expira')).values_list('unidad__articulo_id', 'vence'):
+            duraciones[articulo_id] = min(ttl, int((vence - ahora).total_seconds()))
+        return duraciones
+
+    def invalidar(self, articulos):
+        """
+        Descarta las entradas de los artículos dados incrementando su versión.
+
+        :param articulos: Ids de los artículos.
+        """
+        for articulo_id in set(articulos):
+            self._incrementar(self._llave_version(articulo_id))
+
+    def estadisticas(self) -> dict[str, int]:
+        """
+        Obtiene los aciertos y fallos acumulados del caché.
+
+        :returns: Diccionario con ``aciertos`` y ``fallos``.
+        """
+        valores = self._cache().get_many([f"{self.PREFIJO}:aciertos", f"{self.PREFIJO}:fallos"])
+        return {
+            'aciertos': valores.get(f"{self.PREFIJO}:aciertos", 0),
+            'fallos': valores.get(f"{self.PREFIJO}:fallos", 0),
+        }
+
+    def reiniciar_estadisticas(self):
+        """
+        Reinicia los contadores de aciertos y fallos.
+        """
+        self._cache().delete_many([f"{self.PREFIJO}:aciertos", f"{self.PREFIJO}:fallos"])
+
+
+cache_disponibilidad = CacheDisponibilidad()
+
+
+class SuscripcionDisponibilidad:
+    """
+    Interés de un cliente en la disponibilidad de ciertos artículos durante un rango
+    de fechas. Los artículos notificados se acumulan hasta que el cliente los consume,
+    de modo que varios cambios seguidos producen un solo recálculo.
+
+    :ivar articulos: Ids de los artículos de interés.
+    :ivar inicio: Inicio del rango de interés.
+    :ivar final: Final del rango de interés.
+    """
+
+    def __init__(self, articulos, inicio, final):
+        self.articulos = set(articulos)
+        self.inicio = inicio
+        self.final = final
+        self._pendientes: set[int] = set()
+        self._condicion = threading.Condition()
+
+    def notificar(self, articulos: set[int]):
+        """
+        Marca artículos como modificados y despierta al cliente.
+
+        :param articulos: Ids de los artículos que cambiaron.
+        """
+        with self._condicion:
+            self._pendientes |= articulos
+            self._condicion.notify_all()
+
+    def esperar(self, segundos: float) -> set[int]:
+        """
+        Espera a que cambie alguno de los artículos de interés.
+
+        :param segundos: Tiempo máximo de espera.
+        :returns: Ids de los artículos que cambiaron; vacío si se agotó el tiempo.
+        """
+        with self._condicion:
+            if not self._pendientes:
+                self._condicion.wait(segundos)
+            pendientes, self._pendientes = self._pendientes, set()
+        return pendientes
+
+
+class CanalDisponibilidad:
+    """
+    Publicación y suscripción en memoria de los cambios de disponibilidad. Las señales
+    publican los artículos cuyas reservas o unidades cambiaron, una vez que la
+    transacción se confirma, y cada suscripción recibe solo los que le interesan.
+
+    Los suscriptores deben estar en el mismo proceso que publica, por lo que con
+    varios procesos cada cliente solo recibe los cambios hechos en el suyo.
+    """
+
+    def __init__(self):
+        self._suscripciones: set[SuscripcionDisponibilidad] = set()
+        self._candado = threading.Lock()
+
+    def suscribir(self, articulos, inicio, final) -> SuscripcionDisponibilidad:
+        """
+        Registra el interés en unos artículos durante un rango de fechas.
+
+        :param articulos: Ids de los artículos.
+        :param inicio: Inicio del rango.
+        :param final: Final del rango.
+        :returns: La suscripción, que debe cancelarse al terminar.
+        """
+        suscripcion = SuscripcionDisponibilidad(articulos, inicio, final)
+        with self._candado:
+            self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion: SuscripcionDisponibilidad):
+        """
+        Elimina una suscripción.
+
+        :param suscripcion: La suscripción que se cancela.
+        """
+        with self._candado:
+            self._suscripciones.discard(suscripcion)
+
+    def hay_suscripciones(self) -> bool:
+        """
+        Verifica si algún cliente de este proceso espera cambios.
+        """
+        return bool(self._suscripciones)
+
+    def publicar(self, articulos, inicio=None, final=None):
+        """
+        Notifica a las suscripciones interesadas en alguno de los artículos y cuyo rango
+        se traslapa con el del cambio.
+
+        :param articulos: Ids de los artículos que cambiaron.
+        :param inicio: Inicio del rango afectado, o None si afecta a cualquier fecha.
+        :param final: Final del rango afectado.
+        """
+        articulos = set(articulos)
+        with self._candado:
+            suscripciones = list(self._suscripciones)
+
+        for suscripcion in suscripciones:
+            relevantes = suscripcion.articulos & articulos
+            if relevantes and (inicio is None or (inicio < suscripcion.final and final > suscripcion.inicio)):
+                suscripcion.notificar(relevantes)
+
+
+canal_disponibilidad = CanalDisponibilidad()
+
+
+def mapa_disponibilidad(articulos: list[int], origen, dias: int) -> dict[int, list[int]]:
+    """
+    Calcula las unidades libres de cada artículo en cada bloque de un periodo.
+
+    Se resuelve con una sola pasada sobre las reservas del periodo: usa la matriz
+    del motor en memoria si está activo y cubre el periodo, o construye una matriz
+    solo con los artículos solicitados.
+
+    :param articulos: Ids de los artículos.
+    :param origen: Fecha y hora del primer bloque.
+    :param dias: Días que cubre el mapa.
+    :returns: Diccionario con el id del artículo y las unidades libres por bloque.
+    """
+    final = origen + timedelta(days=dias)
+
+    matriz = motor.matriz() if motor.activo() else None
+    if matriz is None or not matriz.contiene(origen, final):
+        matriz = MatrizDisponibilidad(origen, dias, articulos)
+        matriz.construir()
+
+    return {
+        articulo_id: matriz.libres_por_bloque(articulo_id, origen, final).tolist()
+        for articulo_id in articulos
+    }
+
+
+def horarios_permitidos(duracion: timedelta, desde: date, dias: int):
+    """
+    Genera, en orden, los rangos de préstamo que cumplen las reglas de ``FiltrosForm``:
+    inicio entre semana con tres días de anticipación en la cuadrícula de
+    ``hora_inicio``, y devolución entre semana dentro del horario de atención.
+
+    :param duracion: Duración del préstamo.
+    :param desde: Primer día a considerar.
+    :param dias: Número de días a considerar.
+    :returns: Generador de tuplas ``(inicio, final)``.
+    """
+    from .forms import FiltrosForm
+
+    horas = sorted(hora for hora, _ in FiltrosForm.base_fields['hora_inicio'].choices)
+    for dia in range(dias):
+        fecha = desde + timedelta(days=dia)
+        if not FiltrosForm.inicio_permitido(fecha):
+            continue
+        for hora in horas:
+            inicio = timezone.make_aware(datetime.combine(fecha, hora))
+            final = inicio + duracion
+            if FiltrosForm.final_permitido(final):
+                yield inicio, final
+
+
+def _inicios_bloqueados(intervalos, duracion: timedelta) -> list[tuple]:
+    """
+    Convierte las reservas de una unidad en los rangos de inicios que bloquean.
+
+    Un préstamo que inicia en ``s`` choca con la reserva ``[a, b)`` si
+    ``a - duracion < s < b``; los rangos de una misma unidad se unen para contar
+    cada unidad una sola vez.
+
+    :param intervalos: Tuplas ``(inicio, final)`` de las reservas de la unidad.
+    :param duracion: Duración del préstamo buscado.
+    :returns: Rangos abiertos ``(desde, hasta)`` disjuntos y ordenados.
+    """
+    rangos = []
+    for inicio, final in sorted(intervalos):
+        desde = inicio - duracion
+        if rangos and desde < rangos[-1][1]:
+            rangos[-1] = (rangos[-1][0], max(rangos[-1][1], final))
+        else:
+            rangos.append((desde, final))
+    return rangos
+
+
+def buscar_ventanas(solicitud: dict[int, int], duracion: timedelta, cantidad: int = 5,
+                    desde: date = None, dias: int = None, carrito=None) -> list[tuple]:
+    """
+    Busca los primeros rangos de préstamo en los que todas las cantidades solicitadas
+    están disponibles al mismo tiempo.
+
+    Si el motor en memoria está activo y su matriz cubre los candidatos, se cuentan
+    las unidades libres de todos los candidatos sobre la matriz sin consultar la base
+    de datos. Si no, hace un barrido sobre los inicios candidatos y los rangos de
+    inicio que bloquea cada reserva, en lugar de consultar la disponibilidad de cada
+    candidato.
+
+    :param solicitud: Diccionario con el id del artículo y las unidades requeridas.
+    :param duracion: Duración del préstamo.
+    :param cantidad: Número máximo de rangos a devolver.
+    :param desde: Primer día a considerar (hoy si es None).
+    :param dias: Días a considerar (``DISPONIBILIDAD_BUSQUEDA_DIAS`` si es None).
+    :param carrito: Carrito cuyos apartados no se consideran ocupados.
+    :returns: Lista de tuplas ``(inicio, final)`` ordenada por inicio.
+    """
+    from .models import Unidad, UnidadReserva
+
+    desde = desde or timezone.localdate()
+    dias = dias or getattr(settings, 'DISPONIBILIDAD_BUSQUEDA_DIAS', 60)
+    candidatos = list(horarios_permitidos(duracion, desde, dias))
+    if not candidatos or not solicitud:
+        return []
+
+    libres = motor.contar_rangos(list(solicitud), candidatos, carrito) if motor.activo() else None
+    if libres is not None:
+        suficientes = np.logical_and.reduce([libres[articulo_id] >= unidades
+                                             for articulo_id, unidades in solicitud.items()])
+        return [candidatos[i] for i in np.flatnonzero(suficientes)[:cantidad]]
+
+    totales = dict.fromkeys(solicitud, 0)
+    for articulo_id in Unidad.objects.filter(
+        articulo_id__in=solicitud, estado=Unidad.Estado.ACTIVO
+    ).values_list('articulo_id', flat=True):
+        totales[articulo_id] += 1
+
+    if any(totales[articulo_id] < unidades for articulo_id, unidades in solicitud.items()):
+        return []
+
+    reservas = UnidadReserva.objects.colisiones(candidatos[0][0], candidatos[-1][1]).filter(
+        unidad__articulo_id__in=solicitud, unidad__estado=Unidad.Estado.ACTIVO
+    )
+    if carrito is not None:
+        reservas = reservas.exclude(carrito=carrito)
+
+    reservas_unidad: dict[tuple, list] = {}
+    for articulo_id, unidad_id, inicio, final in reservas.values_list(
+        'unidad__articulo_id', 'unidad_id', 'inicio_con_margen', 'final_con_margen'
+    ):
+        reservas_unidad.setdefault((articulo_id, unidad_id), []).append((inicio, final))
+
+    # eventos de cada artículo: donde empieza (exclusivo) y termina cada rango bloqueado
+    aperturas = {articulo_id: [] for articulo_id in solicitud}
+    cierres = {articulo_id: [] for articulo_id in solicitud}
+    for (articulo_id, _), intervalos in reservas_unidad.items():
+        for inicio_bloqueo, final_bloqueo in _inicios_bloqueados(intervalos, duracion):
+            aperturas[articulo_id].append(inicio_bloqueo)
+            cierres[articulo_id].append(final_bloqueo)
+
+    for articulo_id in solicitud:
+        aperturas[articulo_id].sort()
+        cierres[articulo_id].sort()
+
+    abiertas = dict.fromkeys(solicitud, 0)
+    cerradas = dict.fromkeys(solicitud, 0)
+    ventanas = []
+    for inicio, final in candidatos:
+        disponible = True
+        for articulo_id, unidades in solicitud.items():
+            while abiertas[articulo_id] < len(aperturas[articulo_id]) and aperturas[articulo_id][abiertas[articulo_id]] < inicio:
+                abiertas[articulo_id] += 1
+            while cerradas[articulo_id] < len(cierres[articulo_id]) and cierres[articulo_id][cerradas[articulo_id]] <= inicio:
+                cerradas[articulo_id] += 1
+
+            ocupadas = abiertas[articulo_id] - cerradas[articulo_id]
+            if totales[articulo_id] - ocupadas < unidades:
+                disponible = False
+
+        if disponible:
+            ventanas.append((inicio, final))
+            if len(ventanas) == cantidad:
+                break
+
+    return ventanas
+
+
+def asignar_serie(solicitud: dict[int, int], ocurrencias: list[tuple], carrito=None) -> tuple[list, list]:
+    """
+    Asigna unidades a todas las ocurrencias de una serie de préstamos con una sola
+    consulta de reservas y un solo barrido ordenado sobre ellas.
+
+    Las ocurrencias deben estar ordenadas y no traslaparse entre sí, de modo que una
+    reserva que termina antes de una ocurrencia ya no afecta a las siguientes. Se
+    prefieren las unidades libres en todas las ocurrencias para que la serie use el
+    mismo equipo cada vez.
+
+    :param solicitud: Diccionario con el id del artículo y las unidades requeridas.
+    :param ocurrencias: Lista ordenada de tuplas ``(inicio, final)``.
+    :param carrito: Carrito cuyos apartados no se consideran ocupados.
+    :returns: Tupla con la asignación de cada ocurrencia (diccionario con el id del
+        artículo y los ids de sus unidades) y la lista de ``(inicio, articulo_id)``
+        de las ocurrencias sin unidades suficientes.
+    """
+    from .models import Unidad, UnidadReserva
+
+    if not ocurrencias or not solicitud:
+        return [{} for _ in ocurrencias], []
+
+    activas = {articulo_id: [] for articulo_id in solicitud}
+    for articulo_id, unidad_id in Unidad.objects.filter(
+        articulo_id__in=solicitud, estado=Unidad.Estado.ACTIVO
+    ).order_by('id').values_list('articulo_id', 'id'):
+        activas[articulo_id].append(unidad_id)
+
+    reservas = UnidadReserva.objects.colisiones(ocurrencias[0][0], ocurrencias[-1][1]).filter(
+        unidad__articulo_id__in=solicitud
+    )
+    if carrito is not None:
+        reservas = reservas.exclude(carrito=carrito)
+    reservas = list(reservas.order_by('inicio_con_margen').values_list(
+        'inicio_con_margen', 'final_con_margen', 'unidad_id'
+    ))
+
+    # barrido: ``vigentes`` son las reservas que ya empezaron y aún no terminan
+    ocupadas = []
+    siguiente = 0
+    vigentes = []
+    for inicio, final in ocurrencias:
+        while siguiente < len(reservas) and reservas[siguiente][0] < final:
+            vigentes.append(reservas[siguiente])
+            siguiente += 1
+        vigentes = [reserva for reserva in vigentes if reserva[1] > inicio]
+        ocupadas.append({unidad_id for _, _, unidad_id in vigentes})
+
+    siempre_libres = {unidad_id for unidades in activas.values() for unidad_id in unidades}
+    siempre_libres.difference_update(*ocupadas)
+
+    asignaciones, conflictos = [], []
+    for (inicio, _), ocupadas_ocurrencia in zip(ocurrencias, ocupadas):
+        asignacion = {}
+        for articulo_id, unidades in solicitud.items():
+            libres = [unidad_id for unidad_id in activas[articulo_id] if unidad_id not in ocupadas_ocurrencia]
+            libres.sort(key=lambda unidad_id: unidad_id not in siempre_libres)
+            if len(libres) < unidades:
+                conflictos.append((inicio, articulo_id))
+            asignacion[articulo_id] = libres[:unidades]
+        asignaciones.append(asignacion)
+
+    return asignaciones, conflictos
+
+
+def reporte_capacidad(articulos: list[int], desde: datetime, hasta: datetime,
+                      bloque: timedelta = timedelta(days=1)) -> dict[int, list[tuple]]:
+    """
+    Calcula, por artículo y por bloque de tiempo, las unidades activas, las unidades
+    reservadas y la demanda simultánea máxima (reservas bloqueantes más unidades
+    solicitadas en la lista de espera).
+
+    Las reservas se obtienen con una sola consulta y cada artículo se resuelve con
+    un barrido ordenado de sus eventos de inicio y fin junto con los bloques, de modo
+    que el costo no depende de cuántos bloques cubre cada reserva.
+
+    :param articulos: Ids de los artículos.
+    :param desde: Inicio del periodo.
+    :param hasta: Final del periodo.
+    :param bloque: Duración de cada bloque del reporte.
+    :returns: Diccionario con el id del artículo y una lista de tuplas
+        ``(inicio_bloque, activas, reservadas, demanda_maxima)``.
+    """
+    from .models import ListaEspera, Unidad, UnidadReserva
+
+    bloques = []
+    inicio = desde
+    while inicio < hasta:
+        bloques.append(inicio)
+        inicio += bloque
+
+    activas = dict.fromkeys(articulos, 0)
+    for articulo_id in Unidad.objects.filter(
+        articulo_id__in=articulos, estado=Unidad.Estado.ACTIVO
+    ).values_list('articulo_id', flat=True):
+        activas[articulo_id] += 1
+
+    # eventos (fecha, tipo, unidad, demanda); en la misma fecha los finales (0) van antes que los inicios (1)
+    eventos = {articulo_id: [] for articulo_id in articulos}
+    for articulo_id, unidad_id, inicio, final in UnidadReserva.objects.colisiones(desde, hasta).filter(
+        unidad__articulo_id__in=articulos
+    ).values_list('unidad__articulo_id', 'unidad_id', 'inicio_con_margen', 'final_con_margen'):
+        eventos[articulo_id].append((inicio, 1, unidad_id, 1))
+        eventos[articulo_id].append((final, 0, unidad_id, -1))
+
+    for articulo_id, inicio, final, unidades in ListaEspera.objects.filter(
+        estado=ListaEspera.Estado.ESPERANDO, articulo_id__in=articulos, inicio__lt=hasta, final__gt=desde
+    ).values_list('articulo_id', 'inicio', 'final', 'unidades'):
+        eventos[articulo_id].append((inicio, 1, None, unidades))
+        eventos[articulo_id].append((final, 0, None, -unidades))
+
+    reporte = {}
+    for articulo_id in articulos:
+        ordenados = sorted(eventos[articulo_id], key=lambda evento: evento[:2])
+        siguiente = 0
+        demanda = 0
+        reservadas = Counter()
+
+        def aplicar(evento):
+            nonlocal demanda
+            _, tipo, unidad_id, cambio = evento
+            demanda += cambio
+            if unidad_id is not None:
+                reservadas[unidad_id] += 1 if tipo else -1
+                if not reservadas[unidad_id]:
+                    del reservadas[unidad_id]
+
+        filas = []
+        for inicio_bloque in bloques:
+            while siguiente < len(ordenados) and ordenados[siguiente][0] <= inicio_bloque:
+                aplicar(ordenados[siguiente])
+                siguiente += 1
+
+            maxima = demanda
+            unidades = set(reservadas)
+            while siguiente < len(ordenados) and ordenados[siguiente][0] < inicio_bloque + bloque:
+                aplicar(ordenados[siguiente])
+                if ordenados[siguiente][1]:
+                    maxima = max(maxima, demanda)
+                    if ordenados[siguiente][2] is not None:
+                        unidades.add(ordenados[siguiente][2])
+                siguiente += 1
+
+            filas.append((inicio_bloque, activas[articulo_id], len(unidades), maxima))
+        reporte[articulo_id] = filas
+
+    return reporte
+
+
+def traslapes_por_unidad(intervalos):
+    """
+    Encuentra todos los pares de intervalos de una misma unidad que se traslapan con
+    un barrido. Los intervalos deben llegar ordenados por unidad y fecha de inicio
+    (el ordenamiento lo hace la base de datos); solo se guardan en memoria los
+    intervalos de la unidad actual que siguen abiertos.
+
+    :param intervalos: Iterable de tuplas ``(unidad_id, orden_id, inicio, final)``.
+    :returns: Generador de tuplas ``(unidad_id, orden_a, orden_b, inicio, final)`` con
+        las órdenes que se traslapan y el rango del traslape.
+    """
+    unidad_actual = None
+    abiertos = []
+    for unidad_id, orden_id, inicio, final in intervalos:
+        if unidad_id != unidad_actual:
+            unidad_actual = unidad_id
+            abiertos = []
+
+        abiertos = [abierto for abierto in abiertos if abierto[2] > inicio]
+        for otra_orden, otro_inicio, otro_final in abiertos:
+            yield unidad_id, otra_orden, orden_id, inicio, min(final, otro_final)
+        abiertos.append((orden_id, inicio, final))
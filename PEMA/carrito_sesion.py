@@ -0,0 +1,390 @@
+from django.conf import settings
+from django.db.models.query import QuerySet
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+from .models import Articulo, ArticuloCarrito, Carrito, CarritoBase, ListaEspera, Materia, Prestatario
+
+
+def carrito_en_sesion() -> bool:
+    """
+    Indica si los carritos se guardan como borradores en la sesión (``CARRITO_EN_SESION``).
+    """
+    return getattr(settings, 'CARRITO_EN_SESION', False)
+
+
+def obtener_carrito(request) -> 'Carrito | CarritoSesion | None':
+    """
+    Obtiene el carrito del usuario de la petición, de la sesión o de la base de datos
+    según ``CARRITO_EN_SESION``.
+
+    :param request: La petición del usuario.
+    :returns: El carrito o None si el usuario no tiene uno.
+    """
+    if carrito_en_sesion():
+        return CarritoSesion.desde_sesion(request)
+    return Carrito.objects.filter(prestatario=request.user).first()
+
+
+def obtener_carrito_o_404(request) -> 'Carrito | CarritoSesion':
+    """
+    Igual que ``obtener_carrito`` pero lanza ``Http404`` si el usuario no tiene carrito.
+    """
+    carrito = obtener_carrito(request)
+    if carrito is None:
+        raise Http404("No hay un carrito activo.")
+    return carrito
+
+
+class CarritoSesion(CarritoBase):
+    """
+    Borrador de un carrito guardado en la sesión del usuario. Armar el carrito no
+    escribe en la base de datos: ``Carrito`` y ``ArticuloCarrito`` se crean solo al
+    ordenar, dentro de la misma transacción que crea la orden. Los borradores no
+    apartan unidades; la disponibilidad se verifica de nuevo al ordenar.
+
+    Para que el borrador no se guarde en la tabla de sesiones ``SESSION_ENGINE`` debe
+    usar cookies firmadas o el caché; ``PEMA.checks`` lo verifica.
+
+    :ivar request: La petición con la sesión y el usuario dueño del borrador.
+    :ivar datos: Datos del borrador tal como se guardan en la sesión.
+    """
+
+    CLAVE = 'carrito'
+    CAMPOS = ('nombre', 'lugar', 'descripcion_lugar', 'descripcion')
+
+    def __init__(self, request, datos: dict):
+        self.request = request
+        self.datos = datos
+        self._materia = None
+
+    @classmethod
+    def desde_sesion(cls, request) -> 'CarritoSesion | None':
+        """
+        Obtiene el borrador guardado en la sesión.
+
+        :param request: La petición del usuario.
+        :returns: El borrador o None si la sesión no tiene uno.
+        """
+        datos = request.session.get(cls.CLAVE)
+        if datos is None:
+            return None
+        return cls(request, datos)
+
+    @classmethod
+    def desde_carrito(cls, request, carrito: Carrito) -> 'CarritoSesion':
+        """
+        Crea un borrador con los datos de un carrito sin guardar, por ejemplo el de
+        ``FiltrosForm``. El borrador no se guarda en la sesión hasta llamar ``save``.
+
+        :param request: La petición del usuario.
+        :param carrito: Carrito con el nombre, lugar, materia y horario del préstamo.
+        :returns: El borrador.
+        """
+        datos = {campo: getattr(carrito, campo) for campo in cls.CAMPOS}
+        datos.update(materia=carrito.materia_id, articulos=[], corresponsables=[])
+        borrador = cls(request, datos)
+        borrador.inicio = carrito.inicio
+        borrador.final = carrito.final
+        return borrador
+
+    @property
+    def prestatario(self) -> Prestatario:
+        return Prestatario.get_user(self.request.user)
+
+    @property
+    def materia(self) -> Materia:
+        if self._materia is None:
+            self._materia = Materia.objects.get(pk=self.datos['materia'])
+        return self._materia
+
+    @property
+    def inicio(self):
+        return parse_datetime(self.datos['inicio'])
+
+    @inicio.setter
+    def inicio(self, valor):
+        self.datos['inicio'] = valor.isoformat()
+
+    @property
+    def final(self):
+        return parse_datetime(self.datos['final'])
+
+    @final.setter
+    def final(self, valor):
+        self.datos['final'] = valor.isoformat()
+
+    def __getattr__(self, nombre):
+        if nombre in self.CAMPOS:
+            return self.datos[nombre]
+        raise AttributeError(nombre)
+
+    def save(self):
+        """
+        Guarda el borrador en la sesión.
+        """
+        self.request.session[self.CLAVE] = self.datos
+        self.request.session.modified = True
+
+    def eliminar(self):
+        """
+        Elimina el borrador de la sesión.
+        """
+        self.request.session.pop(self.CLAVE, None)
+
+    def solicitud(self) -> dict[int, int]:
+        """
+        Obtiene las unidades pedidas de cada artículo del borrador.
+
+        :returns: Diccionario con el id del artículo y sus unidades.
+        """
+        return {articulo_id: unidades for articulo_id, unidades in self.datos['articulos']}
+
+    def lineas(self) -> list[ArticuloCarrito]:
+        """
+        Crea ``ArticuloCarrito`` sin guardar para los artículos del borrador.
+
+        :returns: Lista de ``ArticuloCarrito``.
+        """
+        solicitud = self.solicitud()
+        articulos = Articulo.objects.in_bulk(solicitud)
+        return [
+            ArticuloCarrito(articulo=articulos[articulo_id], unidades=unidades)
+            for articulo_id, unidades in solicitud.items() if articulo_id in articulos
+        ]
+
+    def articulos(self) -> QuerySet[Articulo]:
+        """
+        Obtiene los artículos del borrador.
+
+        :returns: Lista de artículos en el borrador.
+        """
+        return Articulo.objects.filter(id__in=list(self.solicitud()))
+
+    def lineas_verificadas(self) -> list[ArticuloCarrito]:
+        """
+        Igual que ``lineas`` pero anotadas con ``disponibles``.
+
+        :returns: Lista de ``ArticuloCarrito``.
+        """
+        solicitud = self.solicitud()
+        articulos = {
+            articulo.id: articulo for articulo in
+            Articulo.objects.filter(id__in=list(solicitud)).anotar_disponibles(self.inicio, self.final,
+                                                                               prestatario=self.request.user)
+        }
+        lineas = []
+        for articulo_id, unidades in solicitud.items():
+            if articulo_id in articulos:
+                linea = ArticuloCarrito(articulo=articulos[articulo_id], unidades=unidades)
+                linea.disponibles = articulos[articulo_id].num_unidades
+                lineas.append(linea)
+        return lineas
+
+    def carrito_apartados(self) -> None:
+        """
+        Los borradores no apartan unidades.
+
+        :returns: Siempre None.
+        """
+        return None
+
+    def existe(self, articulo: Articulo) -> bool:
+        """
+        Verifica si el artículo dado ya existe en el carrito.
+
+        :param articulo: El artículo que se está verificando.
+        :returns: True si el artículo existe en el carrito, False de lo contrario.
+        """
+        return articulo.id in self.solicitud()
+
+    def agregar(self, articulo: Articulo, unidades: int):
+        """
+        Agrega un artículo al carrito.
+
+        :param articulo: El artículo que se va a agregar.
+        :param unidades: Unidades que se van a agregar del artículo.
+        """
+        solicitud = self.solicitud()
+        solicitud[articulo.id] = solicitud.get(articulo.id, 0) + unidades
+        self.datos['articulos'] = [list(linea) for linea in solicitud.items()]
+
+    def eliminar_articulo(self, articulo: Articulo, unidades: int = None):
+        """
+        Elimina un artículo del carrito o reduce su cantidad.
+
+        :param articulo: El artículo que se va a eliminar.
+        :param unidades: Unidades que se van a eliminar del artículo. Si es None, se elimina el artículo completamente.
+        """
+        solicitud = self.solicitud()
+        if unidades is None or unidades >= solicitud.get(articulo.id, 0):
+            solicitud.pop(articulo.id, None)
+        else:
+            solicitud[articulo.id] -= unidades
+        self.datos['articulos'] = [list(linea) for linea in solicitud.items()]
+
+    def apartar(self, articulo: Articulo, unidades: int) -> int:
+        """
+        Los borradores no apartan unidades: solo se consulta cuántas de las unidades
+        pedidas están disponibles en el horario del carrito, contando las que la lista
+        de espera le ofreció al usuario.
+
+        :param articulo: El artículo del que se piden unidades.
+        :param unidades: Número de unidades pedidas.
+        :returns: Número de unidades pedidas que están disponibles.
+        """
+        disponibles = Articulo.objects.filter(id=articulo.id).disponibilidad(self.inicio, self.final)
+        ofrecidas = ListaEspera.ofrecidas(self.request.user, self.inicio, self.final)
+        return min(unidades, disponibles.get(articulo.id, 0) + ofrecidas.get(articulo.id, 0))
+
+    def liberar_apartados(self) -> int:
+        """
+        Los borradores no apartan unidades.
+
+        :returns: Siempre 0.
+        """
+        return 0
+
+    def agregar_kit(self, kit, cantidad: int = 1) -> bool:
+        """
+        Agrega al carrito todos los artículos de un kit si todos tienen unidades
+        suficientes en el horario del carrito.
+
+        :param kit: El kit que se va a agregar.
+        :param cantidad: Número de kits.
+        :returns: True si se agregó el kit completo, False en caso contrario.
+        """
+        componentes = list(kit.articulos_kit().select_related('articulo'))
+        if not componentes:
+            return False
+
+        solicitud = self.solicitud()
+        disponibles = Articulo.objects.filter(id__in=[componente.articulo_id for componente in componentes]) \
+            .disponibilidad(self.inicio, self.final)
+        for componente in componentes:
+            requeridas = solicitud.get(componente.articulo_id, 0) + componente.unidades * cantidad
+            if disponibles.get(componente.articulo_id, 0) < requeridas:
+                return False
+
+        for componente in componentes:
+            self.agregar(componente.articulo, componente.unidades * cantidad)
+        self.save()
+        return True
+
+    def esperar(self, articulo: Articulo) -> ListaEspera:
+        """
+        Registra al dueño del carrito en la lista de espera de un artículo, con el
+        horario y las unidades del carrito.
+
+        :param articulo: El artículo que se quiere esperar.
+        :returns: La entrada de la lista de espera.
+        """
+        entrada, _ = ListaEspera.objects.get_or_create(
+            prestatario=self.request.user, articulo=articulo, inicio=self.inicio, final=self.final,
+            estado=ListaEspera.Estado.ESPERANDO, defaults={'unidades': self.solicitud()[articulo.id]}
+        )
+        return entrada
+
+    def corresponsables(self) -> QuerySet[Prestatario]:
+        """
+        Obtiene la lista de corresponsables del carrito.
+
+        :returns: Lista de corresponsables del carrito.
+        """
+        return Prestatario.objects.filter(id__in=self.datos['corresponsables'])
+
+    def agregar_corresponsable(self, prestatario: Prestatario):
+        """
+        Agrega un corresponsable al carrito.
+
+        :param prestatario: El prestatario que se quiere agregar como corresponsable.
+        """
+        if prestatario.id not in self.datos['corresponsables']:
+            self.datos['corresponsables'].append(prestatario.id)
+
+    def establecer_corresponsables(self, prestatarios):
+        """
+        Reemplaza los corresponsables del carrito.
+
+        :param prestatarios: Los prestatarios que serán corresponsables.
+        """
+        self.datos['corresponsables'] = [prestatario.id for prestatario in prestatarios]
+
+    def instancia(self) -> Carrito:
+        """
+        Crea un ``Carrito`` sin guardar con los datos del borrador.
+
+        :returns: El carrito.
+        """
+        return Carrito(prestatario=self.request.user, materia_id=self.datos['materia'], inicio=self.inicio,
+                       final=self.final, **{campo: self.datos[campo] for campo in self.CAMPOS})
+
+    def materializar(self, carrito: Carrito):
+        """
+        Guarda en la base de datos un carrito creado con ``instancia`` junto con sus
+        artículos y corresponsables. Debe ejecutarse dentro de una transacción.
+
+        Un usuario tiene un solo carrito: si ya tiene uno en la base de datos, por
+        ejemplo de antes de activar ``CARRITO_EN_SESION``, se elimina y se liberan sus
+        apartados. Las unidades que la lista de espera le ofreció al usuario para los
+        artículos del borrador se liberan para que la orden pueda tomarlas.
+
+        :param carrito: El carrito que se va a guardar.
+        """
+        anterior = Carrito.objects.filter(prestatario=carrito.prestatario_id).first()
+        if anterior is not None:
+            anterior.eliminar()
+
+        # si un intento anterior se revirtió el carrito conserva el id de la fila que ya no existe
+        carrito.pk = None
+        carrito._state.adding = True
+        carrito.save()
+
+        ArticuloCarrito.objects.bulk_create([
+            ArticuloCarrito(propietario=carrito, articulo_id=articulo_id, unidades=unidades)
+            for articulo_id, unidades in self.solicitud().items()
+        ])
+        for articulo in self.articulos():
+            ListaEspera.atender_ofertas(carrito, articulo)
+        if self.datos['corresponsables']:
+            carrito._corresponsables.add(*self.datos['corresponsables'])
+
+    def ordenar(self) -> bool:
+        """
+        Convierte el borrador en una orden (transacción). El carrito se guarda en la
+        base de datos dentro de la transacción de ``Carrito.ordenar``.
+
+        :returns: True si la transacción fue exitosa, False en caso contrario.
+        """
+        carrito = self.instancia()
+
+        def ordenar():
+            self.materializar(carrito)
+            carrito._ordenar()
+
+        return self._terminar(carrito._con_reintentos(ordenar))
+
+    def ordenar_serie(self, repeticiones: int, semanas: int = 1) -> bool:
+        """
+        Convierte el borrador en una serie de órdenes (transacción), como
+        ``Carrito.ordenar_serie``.
+
+        :param repeticiones: Número de órdenes de la serie.
+        :param semanas: Semanas entre una orden y la siguiente.
+        :returns: True si la transacción fue exitosa, False en caso contrario.
+        """
+        carrito = self.instancia()
+
+        def ordenar():
+            self.materializar(carrito)
+            carrito._ordenar_serie(repeticiones, semanas)
+
+        return self._terminar(carrito._con_reintentos(ordenar))
+
+    def _terminar(self, ordenado: bool) -> bool:
+        """
+        Elimina el borrador de la sesión si se creó la orden.
+        """
+        if ordenado:
+            self.eliminar()
+        return ordenado
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+from django.db import DatabaseError
+
+# motores de sesión que escriben cada cambio de la sesión en la base de datos
+SESIONES_EN_BASE_DE_DATOS = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+@register()
+def revisar_carrito_en_sesion(app_configs, **kwargs):
+    """
+    Los borradores de ``CARRITO_EN_SESION`` existen para que armar un carrito no
+    escriba en la base de datos; con un motor de sesiones de base de datos cada
+    cambio al borrador sería una escritura en la tabla de sesiones.
+    """
+    if getattr(settings, 'CARRITO_EN_SESION', False) and settings.SESSION_ENGINE in SESIONES_EN_BASE_DE_DATOS:
+        return [Error(
+            f"CARRITO_EN_SESION requiere un SESSION_ENGINE que no use la base de datos, "
+            f"pero se usa '{settings.SESSION_ENGINE}'.",
+            hint="Usa 'django.contrib.sessions.backends.signed_cookies' o "
+                 "'django.contrib.sessions.backends.cache'.",
+            id='PEMA.E001',
+        )]
+    return []
+
+
+@register(Tags.database)
+def revisar_indice_de_reservas(app_configs, databases=None, **kwargs):
+    """
+    La disponibilidad solo consulta el índice ``UnidadReserva``; en una base de datos
+    con órdenes bloqueantes anteriores al índice todas sus unidades se reportarían
+    disponibles hasta reconstruirlo.
+    """
+    from .models import ESTADOS_BLOQUEANTES, Orden, UnidadReserva
+
+    errores = []
+    for alias in databases or []:
+        try:
+            sin_indice = Orden.objects.using(alias).filter(
+                estado__in=ESTADOS_BLOQUEANTES, _unidades__isnull=False
+            ).exists() and not UnidadReserva.objects.using(alias).filter(orden__isnull=False).exists()
+        except DatabaseError:
+            # las tablas todavía no existen
+            continue
+
+        if sin_indice:
+            errores.append(Warning(
+                f"Hay órdenes que apartan unidades pero el índice de reservas de '{alias}' está vacío.",
+                hint="Ejecuta 'python manage.py reconstruir_reservas'.",
+                id='PEMA.W001',
+            ))
+    return errores
@@ -8,8 +8,8 @@ from django.core.validators import MaxLengthValidator
 from django.utils.timezone import make_aware
 from phonenumber_field.formfields import PhoneNumberField
 
-from .models import Carrito, Perfil, Prestatario, Ubicacion, CorresponsableOrden
-from .models import Orden, EstadoOrden
+from .models import Articulo, Carrito, Perfil, Prestatario, Ubicacion, CorresponsableOrden
+from .models import Orden, EstadoOrden, Unidad
 
 
 class CambiarEstadoCorresponsableOrdenForm(forms.ModelForm):
@@ -82,7 +82,7 @@ class UserLoginForm(AuthenticationForm):
 class CorresponsableForm(forms.ModelForm):
     corresponsables = forms.ModelMultipleChoiceField(
         queryset=Prestatario.objects.none(),
-        widget=forms.CheckboxSelectMultiple,
+        widget=forms.MultipleHiddenInput,
         required=False,
         label="Corresponsables"
     )
@@ -101,7 +101,8 @@ class CorresponsableForm(forms.ModelForm):
         if materia and carrito:
             alumnos = materia.alumnos()
             self.fields['corresponsables'].queryset = alumnos
-            self.fields['corresponsables'].initial = carrito._corresponsables.all()
+            if 'corresponsables' not in self.initial:
+                self.fields['corresponsables'].initial = carrito._corresponsables.all()
 
 
 # Forms para Filtro (asigna los datos al modelo Carrito, primera parte seccion del carrito)
@@ -172,6 +173,36 @@ class FiltrosForm(forms.ModelForm):
         (Ubicacion.EXTERNO, "Fuera del Campus"),
     ))
 
+    @staticmethod
+    def entre_semana(fecha: date) -> bool:
+        """
+        Verifica que una fecha sea de lunes a viernes.
+
+        :param fecha: Fecha a verificar.
+        :returns: True si la fecha es entre semana, False en caso contrario.
+        """
+        return fecha.weekday() < 5
+
+    @classmethod
+    def inicio_permitido(cls, inicio: date) -> bool:
+        """
+        Verifica que la fecha de inicio sea entre semana y con tres días de anticipación.
+
+        :param inicio: Fecha de inicio del préstamo.
+        :returns: True si la fecha es válida, False en caso contrario.
+        """
+        return cls.entre_semana(inicio) and inicio >= (date.today() + timedelta(days=3))
+
+    @classmethod
+    def final_permitido(cls, final: datetime) -> bool:
+        """
+        Verifica que la fecha final sea entre semana y dentro del horario de atención.
+
+        :param final: Fecha y hora de devolución del préstamo.
+        :returns: True si la fecha es válida, False en caso contrario.
+        """
+        return cls.entre_semana(final.date()) and 9 <= final.hour <= 20
+
     def clean_hora_inicio(self):
         """
         Limpia y valida la hora de inicio capturada por el usuario, este regresa str entonces convierte a objeto time
@@ -187,10 +218,10 @@ class FiltrosForm(forms.ModelForm):
         :return: Objeto datetime
         """
         inicio = self.cleaned_data.get('inicio')
-        if inicio.date().weekday() >= 5:
+        if not self.entre_semana(inicio.date()):
             raise forms.ValidationError("Elige fecha de inicio de préstamo entre semana.")
 
-        if inicio.date() < (date.today() + timedelta(days=3)):
+        if not self.inicio_permitido(inicio.date()):
             raise forms.ValidationError("Elige una fecha tres días a partir de hoy.")
 
         # print(f'clean inicio {inicio}')
@@ -215,11 +246,95 @@ class FiltrosForm(forms.ModelForm):
         fecha_inicio = datetime.combine(inicio, hora_inicio)
         fecha_final = make_aware(fecha_inicio + timedelta(hours=tiempo_duracion))
 
-        if fecha_final.date().weekday() >= 5:
+        if not self.entre_semana(fecha_final.date()):
             raise (forms.ValidationError("La fecha final del préstamo es en fin de semana. Intente de nuevo."))
 
-        if fecha_final.hour > 20 or fecha_final.hour < 9:
+        if not self.final_permitido(fecha_final):
             raise (forms.ValidationError(
                 "La fecha final del préstamo es fuera del horario de atención. Intente de nuevo."))
 
         return cleaned_data
+
+
+class ReporteCapacidadForm(forms.Form):
+    """
+    Periodo, tamaño de bloque y artículos del reporte de capacidad.
+    """
+
+    BLOQUES = {
+        'dia': timedelta(days=1),
+        'hora': timedelta(hours=1),
+    }
+
+    desde = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+    hasta = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+    bloque = forms.ChoiceField(choices=(('dia', 'Por día'), ('hora', 'Por hora')), initial='dia')
+    articulos = forms.ModelMultipleChoiceField(queryset=Articulo.objects.all(), required=False,
+                                               help_text='Si no se selecciona ninguno se incluyen todos.')
+    sobresuscritos = forms.BooleanField(required=False, label='Solo bloques sobresuscritos')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        desde, hasta = cleaned_data.get('desde'), cleaned_data.get('hasta')
+        if desde and hasta and hasta < desde:
+            raise forms.ValidationError("La fecha final debe ser posterior a la fecha inicial.")
+        return cleaned_data
+
+    def periodo(self) -> tuple[datetime, datetime, timedelta]:
+        """
+        Convierte los datos del formulario en el rango que recibe ``reporte_capacidad``;
+        la fecha final se incluye completa.
+
+        :returns: Tupla ``(desde, hasta, bloque)``.
+        """
+        desde = make_aware(datetime.combine(self.cleaned_data['desde'], time()))
+        hasta = make_aware(datetime.combine(self.cleaned_data['hasta'] + timedelta(days=1), time()))
+        return desde, hasta, self.BLOQUES[self.cleaned_data['bloque']]
+
+
+class CalendarioUnidadesForm(forms.Form):
+    """
+    Unidades y ventana de tiempo del calendario de ocupación. Se eligen las unidades por
+    número de control, por artículo o por ambos.
+    """
+
+    VISTAS = {
+        'dia': timedelta(days=1),
+        'semana': timedelta(weeks=1),
+    }
+
+    num_control = forms.CharField(required=False, max_length=250, label='Número de control')
+    articulo = forms.ModelChoiceField(queryset=Articulo.objects.order_by('nombre'), required=False)
+    desde = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    vista = forms.ChoiceField(choices=(('semana', 'Semana'), ('dia', 'Día')), required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('num_control') and not cleaned_data.get('articulo'):
+            raise forms.ValidationError("Indique un número de control o un artículo.")
+        cleaned_data['vista'] = cleaned_data.get('vista') or 'semana'
+        cleaned_data['desde'] = cleaned_data.get('desde') or date.today()
+        return cleaned_data
+
+    def unidades(self):
+        """
+        :returns: Las unidades seleccionadas, ordenadas por artículo y número de control.
+        """
+        unidades = Unidad.objects.select_related('articulo').order_by('articulo__nombre', 'num_control')
+        if self.cleaned_data['num_control']:
+            unidades = unidades.filter(num_control=self.cleaned_data['num_control'])
+        if self.cleaned_data['articulo']:
+            unidades = unidades.filter(articulo=self.cleaned_data['articulo'])
+        return unidades
+
+    def periodo(self) -> tuple[date, date]:
+        """
+        Ventana del calendario; la vista semanal empieza en lunes.
+
+        :returns: Tupla ``(primer_dia, dia_siguiente_al_ultimo)``.
+        """
+        desde = self.cleaned_data['desde']
+        if self.cleaned_data['vista'] == 'semana':
+            desde -= timedelta(days=desde.weekday())
+        return desde, desde + self.VISTAS[self.cleaned_data['vista']]
+
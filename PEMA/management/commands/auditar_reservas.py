@@ -0,0 +1,49 @@
+import csv
+
+from django.core.management.base import BaseCommand
+
+from PEMA.availability import traslapes_por_unidad
+from PEMA.models import ESTADOS_BLOQUEANTES, Orden
+
+
+class Command(BaseCommand):
+    help = 'Busca unidades asignadas a dos órdenes bloqueantes cuyos horarios se traslapan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--csv', metavar='ARCHIVO',
+                            help='Escribe los traslapes en un archivo CSV ("-" para la salida estándar).')
+        parser.add_argument('--lote', type=int, default=2000, help='Filas leídas por consulta.')
+
+    def handle(self, *args, **options):
+        intervalos = Orden._unidades.through.objects.filter(
+            orden__estado__in=ESTADOS_BLOQUEANTES
+        ).order_by('unidad_id', 'orden__inicio', 'orden_id').values_list(
+            'unidad_id', 'orden_id', 'orden__inicio', 'orden__final'
+        ).iterator(chunk_size=options['lote'])
+
+        archivo = None
+        salida = None
+        if options['csv'] == '-':
+            salida = csv.writer(self.stdout, lineterminator='\n')
+        elif options['csv']:
+            archivo = open(options['csv'], 'w', newline='', encoding='utf-8')
+            salida = csv.writer(archivo)
+
+        total = 0
+        try:
+            if salida:
+                salida.writerow(['unidad', 'orden_a', 'orden_b', 'inicio', 'final'])
+
+            for unidad_id, orden_a, orden_b, inicio, final in traslapes_por_unidad(intervalos):
+                total += 1
+                if salida:
+                    salida.writerow([unidad_id, orden_a, orden_b, inicio.isoformat(), final.isoformat()])
+                else:
+                    self.stdout.write(f'Unidad {unidad_id}: órdenes {orden_a} y {orden_b} se traslapan '
+                                      f'de {inicio} a {final}')
+        finally:
+            if archivo:
+                archivo.close()
+
+        estilo = self.style.WARNING if total else self.style.SUCCESS
+        self.stderr.write(estilo(f'Se encontraron {total} traslapes.'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from PEMA.availability import cache_disponibilidad
+
+
+class Command(BaseCommand):
+    help = 'Muestra los aciertos y fallos del caché de disponibilidad'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reiniciar', action='store_true', help='Reinicia los contadores después de mostrarlos.')
+
+    def handle(self, *args, **options):
+        estadisticas = cache_disponibilidad.estadisticas()
+        total = estadisticas['aciertos'] + estadisticas['fallos']
+        tasa = estadisticas['aciertos'] / total if total else 0
+
+        self.stdout.write(f"Aciertos: {estadisticas['aciertos']}")
+        self.stdout.write(f"Fallos: {estadisticas['fallos']}")
+        self.stdout.write(f"Tasa de aciertos: {tasa:.1%}")
+
+        if options['reiniciar']:
+            cache_disponibilidad.reiniciar_estadisticas()
+            self.stdout.write(self.style.SUCCESS('Se reiniciaron los contadores.'))
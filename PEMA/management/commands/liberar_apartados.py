@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from PEMA.models import UnidadReserva
+
+
+class Command(BaseCommand):
+    help = 'Libera las unidades apartadas por carritos cuyo apartado ya expiró'
+
+    def handle(self, *args, **options):
+        total = UnidadReserva.liberar_expirados()
+        self.stdout.write(self.style.SUCCESS(f'Se liberaron {total} apartados.'))
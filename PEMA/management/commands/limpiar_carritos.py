@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from PEMA.models import Carrito
+
+
+class Command(BaseCommand):
+    help = 'Elimina los carritos abandonados (sin cambios en CARRITO_TTL segundos) y todo lo que contienen'
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        eliminados = Carrito.eliminar_expirados()
+        duracion = time.monotonic() - inicio
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Se eliminaron {eliminados['carritos']} carritos, {eliminados['articulos']} artículos, "
+            f"{eliminados['corresponsables']} corresponsables y {eliminados['apartados']} apartados "
+            f"en {duracion:.2f} s."
+        ))
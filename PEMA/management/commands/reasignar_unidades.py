@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from PEMA.models import Unidad
+
+
+class Command(BaseCommand):
+    help = 'Sustituye las unidades inactivas asignadas a órdenes futuras por unidades libres del mismo artículo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notificar', action='store_true',
+                            help='Envía un correo a los coordinadores con las órdenes que no se pudieron corregir')
+
+    def handle(self, *args, **options):
+        reasignadas, pendientes = Unidad.reasignar_ordenes()
+
+        for orden_id, anterior, nueva in reasignadas:
+            self.stdout.write(f'Orden {orden_id}: unidad {anterior} -> {nueva}')
+        for orden_id, unidad_id in pendientes:
+            self.stdout.write(self.style.WARNING(f'Orden {orden_id}: sin unidad libre para sustituir {unidad_id}'))
+
+        if options['notificar']:
+            Unidad.notificar_pendientes(pendientes)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Se reasignaron {len(reasignadas)} unidades; {len(pendientes)} quedaron pendientes.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from PEMA.models import UnidadReserva
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de reservas de unidades a partir de las órdenes existentes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Reservas insertadas por consulta.')
+
+    def handle(self, *args, **options):
+        total = UnidadReserva.reconstruir(lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f'Se reconstruyeron {total} reservas.'))
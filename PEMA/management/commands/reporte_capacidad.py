@@ -0,0 +1,48 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from PEMA.availability import reporte_capacidad
+from PEMA.forms import ReporteCapacidadForm
+from PEMA.models import Articulo
+
+
+class Command(BaseCommand):
+    help = 'Muestra por artículo y bloque las unidades activas, las reservadas y la demanda máxima de un periodo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('desde', help='Primer día del periodo (AAAA-MM-DD).')
+        parser.add_argument('hasta', help='Último día del periodo (AAAA-MM-DD).')
+        parser.add_argument('--bloque', choices=list(ReporteCapacidadForm.BLOQUES), default='dia',
+                            help='Tamaño de cada bloque del reporte.')
+        parser.add_argument('--articulo', type=int, action='append', default=[],
+                            help='Id de un artículo a incluir; se puede repetir. Por defecto todos.')
+        parser.add_argument('--sobresuscritos', action='store_true',
+                            help='Muestra solo los bloques en los que la demanda supera las unidades activas.')
+
+    def handle(self, *args, **options):
+        form = ReporteCapacidadForm({
+            'desde': options['desde'],
+            'hasta': options['hasta'],
+            'bloque': options['bloque'],
+            'articulos': options['articulo'],
+        })
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+
+        desde, hasta, bloque = form.periodo()
+        articulos = form.cleaned_data['articulos'] or Articulo.objects.all()
+        nombres = dict(articulos.values_list('id', 'nombre'))
+
+        salida = csv.writer(self.stdout, lineterminator='\n')
+        salida.writerow(['articulo', 'bloque', 'activas', 'reservadas', 'demanda_maxima'])
+        sobresuscritos = 0
+        for articulo_id, bloques in reporte_capacidad(list(nombres), desde, hasta, bloque).items():
+            for inicio, activas, reservadas, demanda in bloques:
+                if demanda > activas:
+                    sobresuscritos += 1
+                elif options['sobresuscritos']:
+                    continue
+                salida.writerow([nombres[articulo_id], f'{inicio:%Y-%m-%d %H:%M}', activas, reservadas, demanda])
+
+        self.stderr.write(self.style.SUCCESS(f'{sobresuscritos} bloques sobresuscritos.'))
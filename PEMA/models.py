@@ -1,3 +1,7 @@
+import logging
+import random
+import time
+from datetime import timedelta
 from typing import Any
 
 from django.contrib.auth.models import Group
@@ -5,8 +9,9 @@ from django.contrib.auth.models import Permission
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.core.mail import send_mail
-from django.db import models, transaction
-from django.db.models import Q
+from django.core.validators import MinValueValidator
+from django.db import OperationalError, connection, models, transaction
+from django.db.models import Exists, ExpressionWrapper, F, OuterRef, Q, Value
 from django.db.models.query import QuerySet
 from django.template.loader import render_to_string
 from django.urls import reverse
@@ -15,6 +20,11 @@ from django.utils.translation import gettext_lazy as _
 from phonenumber_field.modelfields import PhoneNumberField
 from django.conf import settings
 
+from .asignacion import elegir_unidades
+from .availability import asignar_serie, buscar_ventanas, cache_disponibilidad, canal_disponibilidad, motor
+
+logger = logging.getLogger(__name__)
+
 
 class Prestatario(User):
     """
@@ -475,6 +485,20 @@ class Materia(models.Model):
         """
         return self._alumnos.all()
 
+    def buscar_alumnos(self, texto: str, limite: int = 20) -> QuerySet['User']:
+        """
+        Busca alumnos de la materia cuya matrícula, nombre o apellido empieza con un
+        texto. La búsqueda parte de los alumnos de la materia (índice de la relación
+        por materia), no de todos los usuarios.
+
+        :param texto: Inicio de la matrícula, nombre o apellido.
+        :param limite: Número máximo de resultados.
+        :returns: Alumnos que coinciden, ordenados por nombre.
+        """
+        return self._alumnos.filter(
+            Q(username__startswith=texto) | Q(first_name__istartswith=texto) | Q(last_name__istartswith=texto)
+        ).order_by('first_name', 'last_name', 'username')[:limite]
+
     def maestros(self) -> QuerySet['Maestro']:
         """
         Obtiene la lista de profesores asociados a la materia.
@@ -533,13 +557,116 @@ class Articulo(models.Model):
     :param codigo: Identificador del artículo.
     :param descripcion: Descripción breve del artículo.
     :param imagen: Imagen del artículo.
+    :param margen_previo: Tiempo de preparación que necesita una unidad antes de prestarse.
+    :param margen_posterior: Tiempo de revisión y carga que necesita una unidad al devolverse.
     """
 
+    class ArticuloQuerySet(models.QuerySet):
+
+        def con_disponibles(self, inicio, final) -> QuerySet['Articulo']:
+            """
+            Anota en cada artículo el número de unidades disponibles en un rango
+            de fechas (``num_unidades``), usando una sola consulta agregada.
+
+            :param inicio: Fecha y hora de inicio del rango.
+            :param final: Fecha y hora de finalización del rango.
+            :returns: Los artículos anotados con ``num_unidades``.
+            """
+            unidades_reservadas = UnidadReserva.objects.colisiones(inicio, final).values('unidad_id')
+
+            return self.annotate(num_unidades=models.Count(
+                'unidad',
+                filter=Q(unidad__estado=Unidad.Estado.ACTIVO) & ~Q(unidad__id__in=unidades_reservadas),
+                distinct=True
+            ))
+
+        def disponibilidad(self, inicio, final) -> dict[int, int]:
+            """
+            Obtiene el número de unidades disponibles de cada artículo en un rango de fechas.
+
+            :param inicio: Fecha y hora de inicio del rango.
+            :param final: Fecha y hora de finalización del rango.
+            :returns: Diccionario con el id del artículo y sus unidades disponibles.
+            """
+            if cache_disponibilidad.activo() or motor.activo():
+                return self._contar_disponibles(list(self.values_list('id', flat=True)), inicio, final)
+            return dict(self.con_disponibles(inicio, final).values_list('id', 'num_unidades'))
+
+        def anotar_disponibles(self, inicio, final, prestatario: User = None) -> list['Articulo']:
+            """
+            Igual que ``con_disponibles`` pero los conteos pasan por el caché de
+            disponibilidad o el motor en memoria cuando están activos, como en
+            ``disponibilidad``. Evalúa el QuerySet.
+
+            :param inicio: Fecha y hora de inicio del rango.
+            :param final: Fecha y hora de finalización del rango.
+            :param prestatario: Si se indica, las unidades que la lista de espera le
+                ofreció en ese horario cuentan como disponibles.
+            :returns: Lista de artículos con ``num_unidades``.
+            """
+            if not cache_disponibilidad.activo() and not motor.activo():
+                articulos = list(self.con_disponibles(inicio, final))
+            else:
+                articulos = list(self)
+                disponibles = self._contar_disponibles([articulo.id for articulo in articulos], inicio, final)
+                for articulo in articulos:
+                    articulo.num_unidades = disponibles.get(articulo.id, 0)
+
+            if prestatario is not None:
+                ofrecidas = ListaEspera.ofrecidas(prestatario, inicio, final)
+                for articulo in articulos:
+                    articulo.num_unidades += ofrecidas.get(articulo.id, 0)
+            return articulos
+
+        @staticmethod
+        def _contar_disponibles(articulos: list[int], inicio, final) -> dict[int, int]:
+            if cache_disponibilidad.activo():
+                disponibles = cache_disponibilidad.obtener(
+                    articulos, inicio, final,
+                    lambda faltantes: Articulo.objects.filter(id__in=faltantes).unidades_disponibles(inicio, final)
+                )
+                return {articulo_id: len(unidades) for articulo_id, unidades in disponibles.items()}
+            return motor.contar(articulos, inicio, final)
+
+        def unidades_disponibles(self, inicio, final) -> dict[int, list[int]]:
+            """
+            Obtiene los ids de las unidades disponibles de cada artículo en un rango de
+            fechas, sin pasar por el caché.
+
+            :param inicio: Fecha y hora de inicio del rango.
+            :param final: Fecha y hora de finalización del rango.
+            :returns: Diccionario con el id del artículo y los ids de sus unidades disponibles.
+            """
+            articulos = list(self.values_list('id', flat=True))
+            if motor.activo():
+                return {articulo_id: list(motor.disponibles(articulo_id, inicio, final)) for articulo_id in articulos}
+
+            disponibles = {articulo_id: [] for articulo_id in articulos}
+            unidades = Unidad.objects.filter(articulo__in=articulos, estado=Unidad.Estado.ACTIVO) \
+                .exclude(id__in=UnidadReserva.objects.colisiones(inicio, final).values('unidad_id')) \
+                .values_list('articulo_id', 'id')
+            for articulo_id, unidad_id in unidades:
+                disponibles[articulo_id].append(unidad_id)
+            return disponibles
+
+    objects = ArticuloQuerySet.as_manager()
+
     imagen = models.ImageField(default='default.png')
     nombre = models.CharField(blank=False, null=False, max_length=250, unique=True)
     codigo = models.CharField(blank=True, null=False, max_length=250)
     descripcion = models.TextField(null=True, blank=True, max_length=250)
     _categorias = models.ManyToManyField(to='Categoria', blank=True)
+    margen_previo = models.DurationField(default=timedelta(0), verbose_name='Margen antes del préstamo')
+    margen_posterior = models.DurationField(default=timedelta(0), verbose_name='Margen después del préstamo')
+
+    def margen(self) -> timedelta:
+        """
+        Obtiene la separación mínima entre dos préstamos de una misma unidad del
+        artículo: la revisión del préstamo anterior más la preparación del siguiente.
+
+        :returns: Margen total entre préstamos.
+        """
+        return self.margen_previo + self.margen_posterior
 
     def crear_unidad(self, num_control: str, num_serie: str) -> tuple['Unidad', bool]:
         """
@@ -559,35 +686,27 @@ class Articulo(models.Model):
         :param final: Fecha y hora de finalización del rango.
         :returns: Unidades disponibles en el rango especificado.
         """
+        if cache_disponibilidad.activo():
+            disponibles = cache_disponibilidad.obtener(
+                [self.id], inicio, final,
+                lambda faltantes: Articulo.objects.filter(id__in=faltantes).unidades_disponibles(inicio, final)
+            )
+            return self.unidades().filter(id__in=disponibles[self.id])
+        if motor.activo():
+            return self.unidades().filter(id__in=motor.disponibles(self.id, inicio, final))
+        return self.disponible_sql(inicio, final)
 
-        """ print('Unidades:')
-        print(self.unidades())
-        print('estados:')
-        for u in self.unidades():
-            print(u.estado)
-            print(Unidad.Estado.ACTIVO)
-        print('Unidades activas:')
-        print(self.unidades().filter(estado=Unidad.Estado.ACTIVO)) """
+    def disponible_sql(self, inicio, final) -> QuerySet['Unidad']:
+        """
+        Obtiene las unidades disponibles consultando directamente la base de datos.
+        Es la implementación de referencia del motor de disponibilidad en memoria.
 
-        ordenes_reservadas = Orden.objects.filter(
-            estado__in=[EstadoOrden.RESERVADA, EstadoOrden.APROBADA, EstadoOrden.ENTREGADA],
-            _unidades__in=self.unidades().filter(estado=Unidad.Estado.ACTIVO)
-        )
-        # print('Ordenes reservadas:')
-        # print(ordenes_reservadas)
-        colisiones = ordenes_reservadas.filter(
-            Q(inicio=inicio) |
-            Q(final=final) |
-            Q(inicio__lt=inicio, final__gt=inicio) |
-            Q(inicio__lt=final, final__gt=final) |
-            Q(inicio__gt=inicio, final__lt=final)
-        )
-        # print('colisiones')
-        # print(colisiones)
-        unidades_reservadas = Unidad.objects.filter(orden__in=colisiones)
-        # print('Unidades reservadas:')
-        # print(unidades_reservadas)
-        return self.unidades().exclude(id__in=unidades_reservadas)
+        :param inicio: Fecha y hora de inicio del rango.
+        :param final: Fecha y hora de finalización del rango.
+        :returns: Unidades disponibles en el rango especificado.
+        """
+        unidades_reservadas = UnidadReserva.objects.colisiones(inicio, final).values('unidad_id')
+        return self.unidades().filter(estado=Unidad.Estado.ACTIVO).exclude(id__in=unidades_reservadas)
 
     def categorias(self) -> QuerySet['Categoria']:
         """
@@ -648,6 +767,101 @@ class Unidad(models.Model):
         """
         return Orden.objects.filter(unidadorden__unidad=self)
 
+    @classmethod
+    def reasignar_ordenes(cls, unidades: QuerySet['Unidad'] = None) -> tuple[list, list]:
+        """
+        Sustituye las unidades inactivas de las órdenes futuras (pendientes o aprobadas)
+        por unidades activas libres del mismo artículo.
+
+        Las reservas afectadas se obtienen con una sola consulta y la disponibilidad de
+        todos los artículos involucrados se carga de una vez en índices de intervalos,
+        que se actualizan con cada sustitución para no asignar la misma unidad dos veces.
+
+        :param unidades: Unidades inactivas a sustituir. Si es None, todas las inactivas.
+        :returns: Tupla con la lista de sustituciones ``(orden_id, unidad_anterior, unidad_nueva)``
+            y la lista de ``(orden_id, unidad_id)`` que no se pudieron sustituir.
+        """
+        from .availability import IndiceArticulo
+
+        unidades = cls.objects.all() if unidades is None else unidades
+        afectadas = list(UnidadReserva.objects.filter(
+            orden__isnull=False,
+            orden__estado__in=[EstadoOrden.RESERVADA, EstadoOrden.APROBADA],
+            orden__inicio__gt=timezone.now(),
+            unidad__in=unidades.filter(estado=cls.Estado.INACTIVO),
+        ).values_list('orden_id', 'unidad_id', 'unidad__articulo_id', 'inicio', 'final').order_by('inicio', 'orden_id'))
+
+        if not afectadas:
+            return [], []
+
+        reasignadas, pendientes = [], []
+        with transaction.atomic():
+            articulos = {articulo_id for _, _, articulo_id, _, _ in afectadas}
+            activas = {articulo_id: [] for articulo_id in articulos}
+            for unidad_id, articulo_id in cls.objects.select_for_update().filter(
+                articulo__in=articulos, estado=cls.Estado.ACTIVO
+            ).order_by('id').values_list('id', 'articulo_id'):
+                activas[articulo_id].append(unidad_id)
+
+            intervalos = {articulo_id: [] for articulo_id in articulos}
+            for articulo_id, *intervalo in UnidadReserva.objects.colisiones(
+                min(inicio for _, _, _, inicio, _ in afectadas), max(final for _, _, _, _, final in afectadas)
+            ).filter(unidad__articulo__in=articulos).values_list(
+                'unidad__articulo_id', 'inicio_con_margen', 'final_con_margen', 'unidad_id', 'orden_id'
+            ):
+                intervalos[articulo_id].append(tuple(intervalo))
+
+            indices = {articulo_id: IndiceArticulo(activas[articulo_id], intervalos[articulo_id])
+                       for articulo_id in articulos}
+            margenes = dict(Articulo.objects.filter(id__in=articulos).values_list(
+                'id', F('margen_previo') + F('margen_posterior')))
+
+            cambios: dict[int, tuple[list, list]] = {}
+            for orden_id, unidad_id, articulo_id, inicio, final in afectadas:
+                libres = indices[articulo_id].disponibles(inicio, final)
+                if not libres:
+                    pendientes.append((orden_id, unidad_id))
+                    continue
+
+                nueva = min(libres)
+                indices[articulo_id].agregar(inicio - margenes[articulo_id], final + margenes[articulo_id],
+                                             nueva, orden_id)
+                reasignadas.append((orden_id, unidad_id, nueva))
+                quitar, agregar = cambios.setdefault(orden_id, ([], []))
+                quitar.append(unidad_id)
+                agregar.append(nueva)
+
+            for orden in Orden.objects.filter(id__in=cambios):
+                quitar, agregar = cambios[orden.id]
+                orden._unidades.remove(*quitar)
+                orden._unidades.add(*agregar)
+
+        return reasignadas, pendientes
+
+    @staticmethod
+    def notificar_pendientes(pendientes: list):
+        """
+        Envía un correo a los coordinadores con las órdenes que conservan unidades inactivas
+        porque no hubo unidades libres para sustituirlas.
+
+        :param pendientes: Lista de ``(orden_id, unidad_id)`` que regresa ``reasignar_ordenes``.
+        """
+        if not pendientes:
+            return
+
+        unidades = Unidad.objects.in_bulk({unidad_id for _, unidad_id in pendientes})
+        ordenes = Orden.objects.in_bulk({orden_id for orden_id, _ in pendientes})
+        send_mail(
+            'Órdenes con unidades inactivas sin reasignar',
+            render_to_string(
+                template_name="emails/reasignacion_pendiente.html",
+                context={'pendientes': [(ordenes[orden_id], unidades[unidad_id]) for orden_id, unidad_id in pendientes]}
+            ),
+            settings.EMAIL_HOST_USER,
+            [c.email for c in Coordinador.objects.all()],
+            fail_silently=False,
+        )
+
     def __str__(self):
         return f"{self.articulo}"
 
@@ -671,6 +885,10 @@ class EstadoOrden(models.TextChoices):
     DEVUELTA = "DE", _("Devuelta")
 
 
+# Estados en los que una orden aparta sus unidades
+ESTADOS_BLOQUEANTES = [EstadoOrden.RESERVADA, EstadoOrden.APROBADA, EstadoOrden.ENTREGADA]
+
+
 class Ubicacion(models.TextChoices):
     """
     Opciones para el lugar de la orden.
@@ -679,6 +897,36 @@ class Ubicacion(models.TextChoices):
     EXTERNO = "EX", _("Fuera del Campus")
 
 
+class SerieOrden(models.Model):
+    """
+    Agrupa las órdenes de un préstamo recurrente, por ejemplo el equipo de una clase
+    que se repite cada semana del semestre.
+
+    :ivar prestatario: Usuario que solicitó la serie.
+    :ivar repeticiones: Número de órdenes de la serie.
+    :ivar semanas: Semanas entre una orden y la siguiente.
+    :ivar emision: Fecha de emisión de la serie.
+    """
+
+    class Meta:
+        verbose_name_plural = "Series de Órdenes"
+
+    prestatario = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    repeticiones = models.PositiveIntegerField()
+    semanas = models.PositiveIntegerField(default=1)
+    emision = models.DateTimeField(auto_now_add=True)
+
+    def cancelar(self):
+        """
+        Cancela las órdenes de la serie que aún no se entregan.
+        """
+        for orden in self.ordenes.filter(estado__in=[EstadoOrden.RESERVADA, EstadoOrden.APROBADA]):
+            orden.cancelar()
+
+    def __str__(self):
+        return f"Serie {self.id} ({self.repeticiones} órdenes)"
+
+
 class Orden(models.Model):
     """
     Representa una orden de unidades de artículos definidos en el Carrito.
@@ -694,12 +942,35 @@ class Orden(models.Model):
     :ivar final: Fecha de devolución de la orden.
     :ivar descripcion: Información adicional de la orden.
     :ivar emision: Fecha de emisión de la orden.
+    :ivar serie: Serie recurrente a la que pertenece la orden, si aplica.
     """
 
     class Meta:
         ordering = ("emision",)
         verbose_name_plural = "Órdenes"
 
+    class OrdenQuerySet(models.QuerySet):
+
+        def bloqueantes(self) -> QuerySet['Orden']:
+            """
+            Filtra las órdenes que apartan sus unidades (reservadas, aprobadas o entregadas).
+
+            :returns: Órdenes que impiden prestar sus unidades.
+            """
+            return self.filter(estado__in=ESTADOS_BLOQUEANTES)
+
+        def colisiones(self, inicio, final) -> QuerySet['Orden']:
+            """
+            Filtra las órdenes bloqueantes que se traslapan con un rango de fechas.
+
+            :param inicio: Fecha y hora de inicio del rango.
+            :param final: Fecha y hora de finalización del rango.
+            :returns: Órdenes que colisionan con el rango especificado.
+            """
+            return self.bloqueantes().filter(inicio__lt=final, final__gt=inicio)
+
+    objects = OrdenQuerySet.as_manager()
+
     nombre = models.CharField(blank=False, null=False, max_length=250, verbose_name='Nombre Producción')
     prestatario = models.ForeignKey(to=User, on_delete=models.CASCADE, verbose_name='Emisor')
     materia = models.ForeignKey(to=Materia, on_delete=models.DO_NOTHING)
@@ -716,11 +987,27 @@ class Orden(models.Model):
                                               verbose_name='Participantes')
     _unidades = models.ManyToManyField(to=Unidad, blank=True, verbose_name='Equipo Solicitado')
     emision = models.DateTimeField(auto_now_add=True)
+    serie = models.ForeignKey(to=SerieOrden, on_delete=models.SET_NULL, null=True, blank=True,
+                              related_name='ordenes')
 
     def save(self, *args, **kwargs):
         self.tipo = self.__tipo_de_orden()
         super().save(*args, **kwargs)
 
+    @classmethod
+    def crear_en_bloque(cls, ordenes: list['Orden']) -> list['Orden']:
+        """
+        Inserta varias órdenes con una sola consulta. ``bulk_create`` no llama a
+        ``save`` ni envía señales, por lo que el tipo de orden se calcula aquí y los
+        corresponsables y unidades deben agregarse por separado.
+
+        :param ordenes: Órdenes sin guardar.
+        :returns: Las órdenes guardadas, con su id.
+        """
+        for orden in ordenes:
+            orden.tipo = orden.__tipo_de_orden()
+        return cls.objects.bulk_create(ordenes)
+
     def __tipo_de_orden(self):
         delta = self.final - self.inicio
         if self.lugar == Ubicacion.EXTERNO or (delta.total_seconds() / (60 * 60)) > 8:
@@ -929,7 +1216,609 @@ class Orden(models.Model):
         return f"({self.get_estado_display()}) {self.prestatario}"
 
 
-class Carrito(models.Model):
+class UnidadReserva(models.Model):
+    """
+    Índice desnormalizado de las unidades que aparta cada orden. Se mantiene
+    sincronizado con ``Orden`` y ``Orden._unidades`` mediante señales y permite
+    resolver las colisiones con una sola búsqueda por rango indexada.
+
+    También guarda los apartados temporales de los carritos: reservas sin orden que
+    bloquean la unidad hasta su fecha de expiración.
+
+    :ivar unidad: Unidad apartada.
+    :ivar orden: Orden que aparta la unidad, o None si es un apartado de un carrito.
+    :ivar carrito: Carrito que aparta la unidad mientras se arma, o None si es de una orden.
+    :ivar espera: Entrada de la lista de espera a la que se ofreció la unidad, si aplica.
+    :ivar inicio: Fecha de inicio de la orden.
+    :ivar final: Fecha de devolución de la orden.
+    :ivar bloqueante: Indica si el estado de la orden impide prestar la unidad.
+    :ivar margen: Margen entre préstamos del artículo de la unidad.
+    :ivar inicio_con_margen: Inicio de la reserva menos el margen; las colisiones se
+        calculan con este rango para que no se traslapen los márgenes de dos préstamos.
+    :ivar final_con_margen: Final de la reserva más el margen.
+    :ivar expira: Fecha en que caduca el apartado, None para las reservas de órdenes.
+    :ivar actualizado: Fecha de la última modificación de la reserva.
+    """
+
+    class Meta:
+        verbose_name_plural = "Reservas de Unidades"
+        unique_together = ('unidad', 'orden')
+        indexes = [
+            models.Index(fields=['unidad', 'bloqueante', 'inicio_con_margen', 'final_con_margen']),
+            models.Index(fields=['bloqueante', 'inicio_con_margen', 'final_con_margen']),
+            models.Index(fields=['expira']),
+            models.Index(fields=['unidad', 'final', 'inicio']),
+        ]
+
+    class UnidadReservaQuerySet(models.QuerySet):
+
+        def colisiones(self, inicio, final) -> QuerySet['UnidadReserva']:
+            """
+            Filtra las reservas bloqueantes que, con su margen entre préstamos, se
+            traslapan con un rango de fechas.
+
+            :param inicio: Fecha y hora de inicio del rango.
+            :param final: Fecha y hora de finalización del rango.
+            :returns: Reservas que colisionan con el rango especificado.
+            """
+            return self.vigentes().filter(bloqueante=True, inicio_con_margen__lt=final, final_con_margen__gt=inicio)
+
+        def vigentes(self) -> QuerySet['UnidadReserva']:
+            """
+            Excluye los apartados de carritos que ya expiraron.
+
+            :returns: Reservas de órdenes y apartados vigentes.
+            """
+            return self.filter(Q(expira__isnull=True) | Q(expira__gt=timezone.now()))
+
+        def en_rango(self, inicio, final) -> QuerySet['UnidadReserva']:
+            """
+            Filtra las reservas (de cualquier estado, sin margen) que se traslapan con un
+            rango de fechas. Con el índice por unidad y final solo se recorren las
+            reservas que terminan después del inicio del rango, no todo el historial.
+
+            :param inicio: Fecha y hora de inicio del rango.
+            :param final: Fecha y hora de finalización del rango.
+            :returns: Reservas que se traslapan con el rango.
+            """
+            return self.filter(final__gt=inicio, inicio__lt=final)
+
+        def expirados(self) -> QuerySet['UnidadReserva']:
+            """
+            Filtra los apartados de carritos que ya expiraron.
+
+            :returns: Apartados expirados.
+            """
+            return self.filter(expira__lte=timezone.now())
+
+    objects = UnidadReservaQuerySet.as_manager()
+
+    unidad = models.ForeignKey(to=Unidad, on_delete=models.CASCADE, related_name='reservas')
+    orden = models.ForeignKey(to=Orden, on_delete=models.CASCADE, related_name='reservas', null=True, blank=True)
+    carrito = models.ForeignKey(to='Carrito', on_delete=models.CASCADE, related_name='apartados', null=True,
+                                blank=True)
+    espera = models.ForeignKey(to='ListaEspera', on_delete=models.CASCADE, related_name='apartados', null=True,
+                               blank=True)
+    inicio = models.DateTimeField(null=False)
+    final = models.DateTimeField(null=False)
+    bloqueante = models.BooleanField(default=True)
+    margen = models.DurationField(default=timedelta(0))
+    inicio_con_margen = models.DateTimeField(null=False)
+    final_con_margen = models.DateTimeField(null=False)
+    expira = models.DateTimeField(null=True, blank=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def desde_orden(cls, orden: 'Orden', unidad_id: int, margen: timedelta = timedelta(0)) -> 'UnidadReserva':
+        """
+        Construye (sin guardar) la reserva de una unidad para una orden.
+
+        :param orden: La orden que aparta la unidad.
+        :param unidad_id: Id de la unidad apartada.
+        :param margen: Margen entre préstamos del artículo de la unidad.
+        :returns: La reserva sin guardar.
+        """
+        return cls(unidad_id=unidad_id, orden=orden, inicio=orden.inicio, final=orden.final,
+                   bloqueante=orden.estado in ESTADOS_BLOQUEANTES, margen=margen,
+                   inicio_con_margen=orden.inicio - margen, final_con_margen=orden.final + margen)
+
+    @staticmethod
+    def margenes(unidades) -> dict[int, timedelta]:
+        """
+        Obtiene el margen entre préstamos de varias unidades con una sola consulta.
+
+        :param unidades: Ids de las unidades.
+        :returns: Diccionario con el id de la unidad y el margen de su artículo.
+        """
+        return {
+            unidad_id: previo + posterior
+            for unidad_id, previo, posterior in Unidad.objects.filter(id__in=unidades).values_list(
+                'id', 'articulo__margen_previo', 'articulo__margen_posterior'
+            )
+        }
+
+    @classmethod
+    def actualizar_margen(cls, articulo: 'Articulo') -> int:
+        """
+        Aplica el margen actual de un artículo a las reservas de sus unidades que
+        tienen un margen distinto.
+
+        :param articulo: El artículo cuyo margen cambió.
+        :returns: Número de reservas actualizadas.
+        """
+        margen = articulo.margen()
+        return cls.objects.filter(unidad__articulo=articulo).exclude(margen=margen).update(
+            margen=margen,
+            inicio_con_margen=F('inicio') - margen,
+            final_con_margen=F('final') + margen,
+            actualizado=timezone.now()
+        )
+
+    @classmethod
+    def sincronizar_orden(cls, orden: 'Orden'):
+        """
+        Actualiza las reservas de una orden con sus fechas y estado actuales.
+
+        :param orden: La orden que se modificó.
+        """
+        cls.objects.filter(orden=orden).update(
+            inicio=orden.inicio,
+            final=orden.final,
+            inicio_con_margen=ExpressionWrapper(Value(orden.inicio) - F('margen'), output_field=models.DateTimeField()),
+            final_con_margen=ExpressionWrapper(Value(orden.final) + F('margen'), output_field=models.DateTimeField()),
+            bloqueante=orden.estado in ESTADOS_BLOQUEANTES,
+            actualizado=timezone.now()
+        )
+
+    @classmethod
+    def reconstruir(cls, lote: int = 1000) -> int:
+        """
+        Reconstruye todas las reservas a partir de ``Orden._unidades``.
+
+        :param lote: Número de reservas insertadas por consulta.
+        :returns: Número de reservas creadas.
+        """
+        relaciones = Orden._unidades.through.objects.values_list(
+            'unidad_id', 'orden_id', 'orden__inicio', 'orden__final', 'orden__estado',
+            'unidad__articulo__margen_previo', 'unidad__articulo__margen_posterior'
+        ).order_by('id')
+
+        total = 0
+        with transaction.atomic():
+            cls.objects.filter(orden__isnull=False).delete()
+
+            reservas = []
+            for unidad_id, orden_id, inicio, final, estado, previo, posterior in relaciones.iterator(chunk_size=lote):
+                margen = previo + posterior
+                reservas.append(cls(unidad_id=unidad_id, orden_id=orden_id, inicio=inicio, final=final,
+                                    bloqueante=estado in ESTADOS_BLOQUEANTES, margen=margen,
+                                    inicio_con_margen=inicio - margen, final_con_margen=final + margen))
+                if len(reservas) >= lote:
+                    total += len(cls.objects.bulk_create(reservas))
+                    reservas = []
+
+            total += len(cls.objects.bulk_create(reservas))
+        return total
+
+    @classmethod
+    def liberar(cls, apartados: QuerySet['UnidadReserva']) -> int:
+        """
+        Elimina en bloque un conjunto de apartados y, al confirmar la transacción,
+        actualiza el motor y el caché de disponibilidad de sus unidades.
+
+        :param apartados: Apartados que se van a eliminar.
+        :returns: Número de apartados eliminados.
+        """
+        unidades = dict(apartados.values_list('unidad_id', 'unidad__articulo_id'))
+        if not unidades:
+            return 0
+
+        total, _ = apartados.delete()
+        cls._avisar_cambio(unidades)
+        return total
+
+    @classmethod
+    def liberar_expirados(cls) -> int:
+        """
+        Elimina todos los apartados expirados. Las ofertas de la lista de espera que no
+        se aprovecharon expiran y las unidades liberadas se ofrecen a la siguiente
+        entrada de la lista.
+
+        :returns: Número de apartados eliminados.
+        """
+        with transaction.atomic():
+            expirados = cls.objects.expirados()
+            liberados = set(expirados.values_list('unidad__articulo_id', 'inicio', 'final'))
+            ListaEspera.objects.filter(apartados__in=expirados).update(estado=ListaEspera.Estado.EXPIRADA)
+
+            total = cls.liberar(expirados)
+            for articulo_id, inicio, final in liberados:
+                transaction.on_commit(lambda articulo_id=articulo_id, inicio=inicio, final=final:
+                                      ListaEspera.atender([articulo_id], inicio, final))
+        return total
+
+    @staticmethod
+    def _avisar_cambio(unidades: dict[int, int]):
+        """
+        Actualiza el motor en memoria y el caché después de cambiar apartados y avisa a
+        los catálogos abiertos.
+
+        :param unidades: Diccionario con el id de la unidad y el id de su artículo.
+        """
+        if not unidades:
+            return
+
+        articulos = set(unidades.values())
+
+        def avisar():
+            motor.refrescar_unidades(articulos, set(unidades))
+            if cache_disponibilidad.activo():
+                cache_disponibilidad.invalidar(articulos)
+            canal_disponibilidad.publicar(articulos)
+
+        transaction.on_commit(avisar)
+
+    def __str__(self):
+        return f"{self.unidad} ({self.inicio} - {self.final})"
+
+
+class ListaEspera(models.Model):
+    """
+    Registro de un prestatario interesado en unidades de un artículo que no estaban
+    disponibles. Cuando se liberan unidades que se traslapan con su horario, se le
+    apartan por ``LISTA_ESPERA_TTL`` segundos y se le notifica por correo, en el
+    orden en que se registraron.
+
+    :ivar prestatario: Usuario interesado.
+    :ivar articulo: Artículo que se espera.
+    :ivar inicio: Fecha de inicio del préstamo deseado.
+    :ivar final: Fecha de devolución del préstamo deseado.
+    :ivar unidades: Unidades que se necesitan.
+    :ivar estado: Estado de la entrada.
+    :ivar creado: Fecha de registro, determina el turno.
+    :ivar ofrecida: Fecha en que se apartaron las unidades.
+    """
+
+    class Estado(models.TextChoices):
+        ESPERANDO = "ES", _("Esperando")
+        OFRECIDA = "OF", _("Ofrecida")
+        ATENDIDA = "AT", _("Atendida")
+        EXPIRADA = "EX", _("Expirada")
+        CANCELADA = "CN", _("Cancelada")
+
+    class Meta:
+        verbose_name_plural = "Lista de Espera"
+        indexes = [
+            models.Index(fields=['articulo', 'estado', 'inicio', 'final']),
+        ]
+
+    prestatario = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='lista_espera')
+    articulo = models.ForeignKey(to=Articulo, on_delete=models.CASCADE, related_name='lista_espera')
+    inicio = models.DateTimeField(null=False)
+    final = models.DateTimeField(null=False)
+    unidades = models.PositiveIntegerField(default=1)
+    estado = models.CharField(max_length=2, choices=Estado.choices, default=Estado.ESPERANDO)
+    creado = models.DateTimeField(auto_now_add=True)
+    ofrecida = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def atender(cls, articulos, inicio, final) -> int:
+        """
+        Ofrece las unidades liberadas de un rango de fechas a la lista de espera. Solo
+        revisa las entradas en espera de los artículos dados que se traslapan con el
+        rango, en orden de registro.
+
+        :param articulos: Ids de los artículos con unidades liberadas.
+        :param inicio: Fecha y hora de inicio del rango liberado.
+        :param final: Fecha y hora de finalización del rango liberado.
+        :returns: Número de entradas a las que se les ofrecieron unidades.
+        """
+        entradas = cls.objects.filter(
+            articulo__in=articulos, estado=cls.Estado.ESPERANDO, inicio__lt=final, final__gt=inicio
+        ).select_related('articulo', 'prestatario').order_by('creado', 'id')
+
+        return sum(1 for entrada in entradas if entrada.ofrecer())
+
+    def ofrecer(self) -> bool:
+        """
+        Aparta las unidades de la entrada si todas están disponibles y notifica al prestatario.
+
+        :returns: True si se apartaron las unidades, False en caso contrario.
+        """
+        expira = timezone.now() + timedelta(seconds=getattr(settings, 'LISTA_ESPERA_TTL', 24 * 60 * 60))
+
+        with transaction.atomic():
+            list(self.articulo.unidades().select_for_update().order_by('id').values_list('id', flat=True))
+            elegidas = elegir_unidades(self.articulo.disponible_sql(self.inicio, self.final), self.unidades)
+            if len(elegidas) < self.unidades:
+                return False
+
+            margen = self.articulo.margen()
+            UnidadReserva.objects.bulk_create([
+                UnidadReserva(unidad_id=unidad_id, espera=self, inicio=self.inicio, final=self.final,
+                              margen=margen, inicio_con_margen=self.inicio - margen,
+                              final_con_margen=self.final + margen, expira=expira)
+                for unidad_id in elegidas
+            ])
+            UnidadReserva._avisar_cambio({unidad_id: self.articulo_id for unidad_id in elegidas})
+
+            self.estado = self.Estado.OFRECIDA
+            self.ofrecida = timezone.now()
+            self.save()
+            transaction.on_commit(lambda: self.notificar(expira), robust=True)
+
+        return True
+
+    def notificar(self, expira):
+        """
+        Envía un correo al prestatario avisando que sus unidades están apartadas.
+
+        :param expira: Fecha en que expira el apartado.
+        """
+        send_mail(
+            f'Hay unidades disponibles de "{self.articulo.nombre}"',
+            render_to_string(
+                template_name="emails/lista_espera.html",
+                context={'host': settings.URL_BASE_PARA_EMAILS, 'entrada': self, 'expira': expira}
+            ),
+            settings.EMAIL_HOST_USER,
+            [self.prestatario.email],
+            fail_silently=False,
+        )
+
+    @classmethod
+    def ofrecidas(cls, prestatario: User, inicio, final) -> dict[int, int]:
+        """
+        Cuenta, por artículo, las unidades ofrecidas a un prestatario que cubren un
+        horario. Son las que ``atender_ofertas`` le libera al apartarlas en su carrito.
+
+        :param prestatario: Prestatario de las entradas.
+        :param inicio: Fecha y hora de inicio del horario.
+        :param final: Fecha y hora de finalización del horario.
+        :returns: Diccionario con el id del artículo y sus unidades ofrecidas.
+        """
+        apartados = UnidadReserva.objects.vigentes().filter(
+            espera__prestatario=prestatario, espera__estado=cls.Estado.OFRECIDA,
+            espera__inicio__lte=inicio, espera__final__gte=final,
+        )
+        return dict(apartados.values('espera__articulo_id')
+                    .annotate(num=models.Count('unidad_id', distinct=True))
+                    .values_list('espera__articulo_id', 'num'))
+
+    @classmethod
+    def atender_ofertas(cls, carrito: 'Carrito', articulo: 'Articulo'):
+        """
+        Libera las unidades ofrecidas al dueño de un carrito que cubren el horario del
+        carrito, para que el carrito pueda apartarlas, y marca sus entradas como atendidas.
+
+        :param carrito: Carrito que aparta el artículo.
+        :param articulo: Artículo que se aparta.
+        """
+        entradas = cls.objects.filter(prestatario=carrito.prestatario, articulo=articulo,
+                                      estado=cls.Estado.OFRECIDA,
+                                      inicio__lte=carrito.inicio, final__gte=carrito.final)
+        UnidadReserva.liberar(UnidadReserva.objects.filter(espera__in=entradas))
+        entradas.update(estado=cls.Estado.ATENDIDA)
+
+    def __str__(self):
+        return f"{self.prestatario} - {self.articulo} ({self.inicio} - {self.final})"
+
+
+class ConflictoReserva(Exception):
+    """
+    Otra transacción reservó alguna de las unidades asignadas a la orden.
+    """
+
+
+class CarritoNoOrdenable(Exception):
+    """
+    El carrito no se puede convertir en orden: está vacío o alguno de sus artículos no
+    tiene unidades suficientes en su horario.
+    """
+
+
+class VerificacionCarrito:
+    """
+    Disponibilidad de todos los artículos de un carrito, calculada una sola vez para
+    mostrar el carrito y para ordenarlo.
+
+    :ivar lineas: ``ArticuloCarrito`` del carrito con su artículo cargado, anotados con
+        ``disponibles`` (unidades que puede usar el carrito, incluidas las que tiene
+        apartadas) y ``faltantes`` (unidades pedidas que no están disponibles).
+    """
+
+    def __init__(self, lineas: list['ArticuloCarrito']):
+        self.lineas = lineas
+        for linea in lineas:
+            linea.faltantes = max(0, linea.unidades - linea.disponibles)
+
+    def faltantes(self) -> list['ArticuloCarrito']:
+        """
+        Obtiene los artículos con menos unidades disponibles que las pedidas.
+
+        :returns: Lista de ``ArticuloCarrito``.
+        """
+        return [linea for linea in self.lineas if linea.faltantes]
+
+    def no_disponibles(self) -> list['ArticuloCarrito']:
+        """
+        Obtiene los artículos que no tienen ninguna unidad disponible.
+
+        :returns: Lista de ``ArticuloCarrito``.
+        """
+        return [linea for linea in self.lineas if linea.disponibles == 0]
+
+    def numero_unidades(self) -> int:
+        """
+        Obtiene el número total de unidades pedidas.
+
+        :returns: Número total de unidades en el carrito.
+        """
+        return sum(linea.unidades for linea in self.lineas)
+
+    def vacio(self) -> bool:
+        """
+        Verifica si el carrito está vacío.
+
+        :returns: True si el carrito está vacío, False en caso contrario.
+        """
+        return not self.lineas
+
+
+class CarritoBase:
+    """
+    Consultas comunes a los carritos guardados en la base de datos (``Carrito``) y a
+    los borradores guardados en la sesión (``PEMA.carrito_sesion.CarritoSesion``).
+
+    Las subclases tienen ``materia``, ``inicio`` y ``final`` e implementan:
+
+    - ``solicitud()``: diccionario con el id de cada artículo y sus unidades pedidas.
+    - ``lineas()``: lista de ``ArticuloCarrito`` con su artículo ya cargado.
+    - ``articulos()``: ``QuerySet`` con los artículos del carrito.
+    - ``lineas_verificadas()``: como ``lineas`` pero anotadas con ``disponibles``, las
+      unidades que puede usar el carrito en su horario, calculadas en una sola consulta
+      a la base de datos.
+    - ``carrito_apartados()``: el ``Carrito`` dueño de los apartados, cuyas reservas no
+      cuentan como ocupadas para este carrito, o None si el carrito no aparta unidades.
+    """
+
+    def vacio(self) -> bool:
+        """
+        Verifica si el carrito está vacío.
+
+        :returns: True si el carrito está vacío, False en caso contrario.
+        """
+        return not self.solicitud()
+
+    def numero_articulos(self) -> int:
+        """
+        Obtiene el número de artículos en el carrito.
+
+        :returns: Número de artículos en el carrito.
+        """
+        return len(self.solicitud())
+
+    def numero_total_unidades(self) -> int:
+        """
+        Devuelve el número total de unidades en el carrito.
+
+        :returns: Número total de unidades en el carrito.
+        """
+        return sum(self.solicitud().values())
+
+    def numero_unidades(self) -> int:
+        """
+        Obtiene el número total de unidades en el carrito.
+
+        :returns: Número total de unidades en el carrito.
+        """
+        return sum(self.solicitud().values())
+
+    def verificar(self) -> VerificacionCarrito:
+        """
+        Verifica en una sola consulta, para cada artículo del carrito, las unidades
+        pedidas contra las disponibles en el horario del carrito.
+
+        :returns: La verificación del carrito.
+        """
+        return VerificacionCarrito(self.lineas_verificadas())
+
+    def articulos_no_disponibles(self) -> list['ArticuloCarrito']:
+        """
+        Obtiene los artículos del carrito que no tienen unidades disponibles en el
+        horario del carrito, con una sola consulta de disponibilidad.
+
+        :returns: Lista de ``ArticuloCarrito`` no disponibles.
+        """
+        return self.verificar().no_disponibles()
+
+    def sustitutos(self, articulos: list['Articulo'], cantidad: int = 3) -> dict[int, list['Articulo']]:
+        """
+        Sugiere, para cada artículo dado, artículos de sus mismas categorías que están
+        en la materia del carrito, no están ya en el carrito y tienen unidades
+        disponibles en su horario. La disponibilidad de todos los candidatos se
+        resuelve en una sola consulta.
+
+        :param articulos: Artículos que se quieren sustituir.
+        :param cantidad: Número máximo de sugerencias por artículo.
+        :returns: Diccionario con el id del artículo y la lista de sugerencias.
+        """
+        sustitutos = {articulo.id: [] for articulo in articulos}
+        Relacion = Articulo._categorias.through
+
+        categorias = {}
+        for articulo_id, categoria_id in Relacion.objects.filter(articulo__in=sustitutos) \
+                .values_list('articulo_id', 'categoria_id'):
+            categorias.setdefault(categoria_id, []).append(articulo_id)
+
+        if not categorias:
+            return sustitutos
+
+        candidatos = {
+            articulo.id: articulo for articulo in self.materia.articulos()
+            .filter(_categorias__in=categorias)
+            .exclude(id__in=self.articulos().values('id'))
+            .distinct()
+            .anotar_disponibles(self.inicio, self.final)
+            if articulo.num_unidades > 0
+        }
+
+        relaciones = Relacion.objects.filter(articulo__in=candidatos, categoria__in=categorias) \
+            .values_list('articulo_id', 'categoria_id')
+        for candidato_id, categoria_id in sorted(relaciones, key=lambda relacion: candidatos[relacion[0]].nombre):
+            for articulo_id in categorias[categoria_id]:
+                sugerencias = sustitutos[articulo_id]
+                if len(sugerencias) < cantidad and candidatos[candidato_id] not in sugerencias:
+                    sugerencias.append(candidatos[candidato_id])
+
+        return sustitutos
+
+    def ventanas_disponibles(self, cantidad: int = 5) -> list[tuple]:
+        """
+        Busca los primeros horarios, con la misma duración del carrito y a partir del
+        día elegido, en los que todos sus artículos están disponibles. Las unidades que
+        el carrito ya apartó cuentan como disponibles.
+
+        :param cantidad: Número máximo de horarios a devolver.
+        :returns: Lista de tuplas ``(inicio, final)``.
+        """
+        solicitud = self.solicitud()
+        desde = max(timezone.localdate(), timezone.localdate(self.inicio))
+        return buscar_ventanas(solicitud, self.final - self.inicio, cantidad, desde=desde,
+                               carrito=self.carrito_apartados())
+
+    def ocurrencias(self, repeticiones: int, semanas: int = 1) -> list[tuple]:
+        """
+        Obtiene los horarios de una serie semanal que empieza en el horario del carrito.
+        Las ocurrencias conservan la hora local del carrito aunque cambie el horario de verano.
+
+        :param repeticiones: Número de ocurrencias.
+        :param semanas: Semanas entre una ocurrencia y la siguiente.
+        :returns: Lista de tuplas ``(inicio, final)`` ordenada por inicio.
+        """
+        inicio = timezone.localtime(self.inicio).replace(tzinfo=None)
+        duracion = self.final - self.inicio
+        ocurrencias = []
+        for i in range(repeticiones):
+            inicio_ocurrencia = timezone.make_aware(inicio + timedelta(weeks=i * semanas))
+            ocurrencias.append((inicio_ocurrencia, inicio_ocurrencia + duracion))
+        return ocurrencias
+
+    def conflictos_serie(self, repeticiones: int, semanas: int = 1) -> list[tuple]:
+        """
+        Obtiene las ocurrencias de una serie en las que algún artículo del carrito no
+        tiene unidades suficientes, sin crear ninguna orden.
+
+        :param repeticiones: Número de ocurrencias.
+        :param semanas: Semanas entre una ocurrencia y la siguiente.
+        :returns: Lista de tuplas ``(inicio, articulo_id)``.
+        """
+        _, conflictos = asignar_serie(self.solicitud(), self.ocurrencias(repeticiones, semanas),
+                                      carrito=self.carrito_apartados())
+        return conflictos
+
+
+class Carrito(CarritoBase, models.Model):
     """
     Representa un carrito de compras utilizado para seleccionar artículos
     del catálogo. El carrito puede convertirse en una Orden.
@@ -938,8 +1827,25 @@ class Carrito(models.Model):
     :ivar materia: Materia a la que está ligado el equipo del carrito.
     :ivar inicio: Fecha de inicio del préstamo.
     :ivar final: Fecha de devolución del préstamo.
+    :ivar actualizado: Fecha del último cambio del carrito; el carrito expira
+        ``CARRITO_TTL`` segundos después.
     """
 
+    class CarritoQuerySet(models.QuerySet):
+
+        def expirados(self) -> QuerySet['Carrito']:
+            """
+            Filtra los carritos que no han cambiado en los últimos ``CARRITO_TTL`` segundos.
+            Guardar el carrito y los métodos que cambian sus artículos, apartados o
+            corresponsables actualizan ``actualizado`` (``Carrito.tocar``).
+
+            :returns: Carritos expirados.
+            """
+            limite = timezone.now() - timedelta(seconds=getattr(settings, 'CARRITO_TTL', 24 * 60 * 60))
+            return self.filter(actualizado__lt=limite)
+
+    objects = CarritoQuerySet.as_manager()
+
     nombre = models.CharField(blank=False, null=False, max_length=250, verbose_name='Nombre Producción')
     prestatario = models.OneToOneField(to=User, on_delete=models.CASCADE)
     lugar = models.CharField(default=Ubicacion.CAMPUS, choices=Ubicacion.choices, max_length=2,
@@ -951,6 +1857,33 @@ class Carrito(models.Model):
     final = models.DateTimeField(default=timezone.now, null=False)
     _articulos = models.ManyToManyField(to='Articulo', through='ArticuloCarrito', blank=True)
     _corresponsables = models.ManyToManyField(to=User, blank=True, related_name='corresponsables_carrito')
+    actualizado = models.DateTimeField(auto_now=True, db_index=True)
+
+    @classmethod
+    def eliminar_expirados(cls) -> dict[str, int]:
+        """
+        Elimina los carritos expirados con sus artículos, corresponsables y apartados
+        usando una eliminación en bloque por tabla. Las unidades apartadas que se
+        liberan se ofrecen a la lista de espera.
+
+        :returns: Número de filas eliminadas de cada tipo: ``carritos``, ``articulos``,
+            ``corresponsables`` y ``apartados``.
+        """
+        with transaction.atomic():
+            expirados = cls.objects.expirados().values('id')
+            apartados = UnidadReserva.objects.filter(carrito__in=expirados)
+            liberados = set(apartados.values_list('unidad__articulo_id', 'inicio', 'final'))
+
+            eliminados = {'apartados': UnidadReserva.liberar(apartados)}
+            eliminados['articulos'], _ = ArticuloCarrito.objects.filter(propietario__in=expirados).delete()
+            eliminados['corresponsables'], _ = cls._corresponsables.through.objects \
+                .filter(carrito__in=expirados).delete()
+            eliminados['carritos'], _ = cls.objects.filter(id__in=expirados).delete()
+
+            for articulo_id, inicio, final in liberados:
+                transaction.on_commit(lambda articulo_id=articulo_id, inicio=inicio, final=final:
+                                      ListaEspera.atender([articulo_id], inicio, final))
+        return eliminados
 
     def eliminar_articulo(self, articulo: 'Articulo', unidades: int = None):
         """
@@ -962,9 +1895,16 @@ class Carrito(models.Model):
         articulo_carrito = ArticuloCarrito.objects.get(propietario=self, articulo=articulo)
         if unidades is None or unidades >= articulo_carrito.unidades:
             articulo_carrito.delete()
+            restantes = 0
         else:
             articulo_carrito.unidades -= unidades
             articulo_carrito.save()
+            restantes = articulo_carrito.unidades
+
+        # Liberar los apartados que sobran
+        apartados = self.apartados.filter(unidad__articulo=articulo).order_by('id').values_list('id', flat=True)
+        UnidadReserva.liberar(self.apartados.filter(id__in=list(apartados[restantes:])))
+        self.tocar()
 
     def agregar(self, articulo: 'Articulo', unidades: int):
         """
@@ -972,6 +1912,7 @@ class Carrito(models.Model):
 
         :param articulo: El artículo que se va a agregar.
         :param unidades: Unidades que se van a agregar del artículo.
+        :returns: La línea del artículo en el carrito.
         """
         articulo_carrito, created = ArticuloCarrito.objects.get_or_create(propietario=self, articulo=articulo)
         if not created:
@@ -979,6 +1920,43 @@ class Carrito(models.Model):
         else:
             articulo_carrito.unidades = unidades
         articulo_carrito.save()
+        self.tocar()
+        return articulo_carrito
+
+    def agregar_kit(self, kit: 'Kit', cantidad: int = 1) -> bool:
+        """
+        Agrega al carrito todos los artículos de un kit y aparta sus unidades en una
+        sola transacción. Si alguno de los artículos no tiene unidades suficientes no
+        se agrega ni se aparta nada.
+
+        :param kit: El kit que se va a agregar.
+        :param cantidad: Número de kits.
+        :returns: True si se agregó el kit completo, False en caso contrario.
+        """
+        componentes = list(kit.articulos_kit().select_related('articulo'))
+        if not componentes:
+            return False
+
+        try:
+            with transaction.atomic():
+                for componente in componentes:
+                    # se apartan todas las unidades de la línea, no solo las del kit
+                    requeridas = self.agregar(componente.articulo, componente.unidades * cantidad).unidades
+                    if self.apartar(componente.articulo, requeridas) < requeridas:
+                        raise ConflictoReserva()
+        except ConflictoReserva:
+            return False
+
+        return True
+
+    def tocar(self):
+        """
+        Marca el carrito como usado en este momento sin guardar sus demás campos, para
+        que ``eliminar_expirados`` no lo elimine mientras se sigue armando. Lo llaman
+        los métodos que cambian los artículos, apartados o corresponsables.
+        """
+        self.actualizado = timezone.now()
+        Carrito.objects.filter(pk=self.pk).update(actualizado=self.actualizado)
 
     def articulos_carrito(self) -> QuerySet['ArticuloCarrito']:
         """
@@ -988,35 +1966,114 @@ class Carrito(models.Model):
         """
         return ArticuloCarrito.objects.filter(propietario=self)
 
+    def solicitud(self) -> dict[int, int]:
+        """
+        Obtiene las unidades pedidas de cada artículo del carrito.
+
+        :returns: Diccionario con el id del artículo y sus unidades.
+        """
+        return dict(self.articulos_carrito().values_list('articulo_id', 'unidades'))
+
+    def lineas(self) -> list['ArticuloCarrito']:
+        """
+        Obtiene los artículos del carrito con su artículo ya cargado.
+
+        :returns: Lista de ``ArticuloCarrito``.
+        """
+        return list(self.articulos_carrito().select_related('articulo'))
+
+    def lineas_verificadas(self) -> list['ArticuloCarrito']:
+        """
+        Obtiene los artículos del carrito anotados con ``disponibles`` en una sola
+        consulta a la base de datos (no al motor en memoria, que puede no conocer aún
+        las reservas de otros procesos).
+
+        :returns: Lista de ``ArticuloCarrito``.
+        """
+        # las unidades apartadas por este mismo carrito también están disponibles para él
+        reservadas = UnidadReserva.objects.colisiones(self.inicio, self.final).exclude(carrito=self) \
+            .values('unidad_id')
+        return list(self.articulos_carrito().select_related('articulo').annotate(disponibles=models.Count(
+            'articulo__unidad',
+            filter=Q(articulo__unidad__estado=Unidad.Estado.ACTIVO) & ~Q(articulo__unidad__id__in=reservadas),
+            distinct=True
+        )).order_by('id'))
+
+    def carrito_apartados(self) -> 'Carrito':
+        """
+        Los apartados del carrito son suyos.
+
+        :returns: El mismo carrito.
+        """
+        return self
+
     def eliminar(self):
         """
-        Elimina el carrito.
+        Elimina el carrito y libera sus apartados.
         """
+        self.liberar_apartados()
         self.delete()
 
-    def vacio(self) -> bool:
+    def apartar(self, articulo: 'Articulo', unidades: int) -> int:
         """
-        Verifica si el carrito está vacío.
+        Aparta unidades de un artículo en el horario del carrito para que no se asignen
+        a otra orden mientras el carrito se arma. Los apartados expiran después de
+        ``APARTADOS_TTL`` segundos; apartar renueva la expiración de todos los
+        apartados del carrito. Si la base de datos está ocupada no se aparta nada, la
+        disponibilidad se verifica de nuevo al ordenar.
 
-        :returns: True si el carrito está vacío, False en caso contrario.
+        :param articulo: El artículo del que se apartan unidades.
+        :param unidades: Número de unidades que se quieren apartar.
+        :returns: Número de unidades apartadas.
         """
-        return self.articulos().count() == 0
+        expira = timezone.now() + timedelta(seconds=getattr(settings, 'APARTADOS_TTL', 600))
 
-    def numero_articulos(self) -> int:
+        try:
+            with transaction.atomic():
+                UnidadReserva.liberar(self.apartados.filter(unidad__articulo=articulo))
+                ListaEspera.atender_ofertas(self, articulo)
+
+                list(articulo.unidades().select_for_update().order_by('id').values_list('id', flat=True))
+                elegidas = elegir_unidades(articulo.disponible_sql(self.inicio, self.final), unidades)
+
+                margen = articulo.margen()
+                UnidadReserva.objects.bulk_create([
+                    UnidadReserva(unidad_id=unidad_id, carrito=self, inicio=self.inicio, final=self.final,
+                                  margen=margen, inicio_con_margen=self.inicio - margen,
+                                  final_con_margen=self.final + margen, expira=expira)
+                    for unidad_id in elegidas
+                ])
+                self.apartados.update(expira=expira)
+                UnidadReserva._avisar_cambio({unidad_id: articulo.id for unidad_id in elegidas})
+                self.tocar()
+        except OperationalError:
+            return 0
+
+        return len(elegidas)
+
+    def esperar(self, articulo: 'Articulo') -> 'ListaEspera':
         """
-        Obtiene el número de artículos en el carrito.
+        Registra al dueño del carrito en la lista de espera de un artículo, con el
+        horario y las unidades del carrito.
 
-        :returns: Número de artículos en el carrito.
+        :param articulo: El artículo que se quiere esperar.
+        :returns: La entrada de la lista de espera.
         """
-        return ArticuloCarrito.objects.filter(propietario=self).count()
+        articulo_carrito = ArticuloCarrito.objects.get(propietario=self, articulo=articulo)
+        entrada, _ = ListaEspera.objects.get_or_create(
+            prestatario=self.prestatario, articulo=articulo, inicio=self.inicio, final=self.final,
+            estado=ListaEspera.Estado.ESPERANDO, defaults={'unidades': articulo_carrito.unidades}
+        )
+        self.tocar()
+        return entrada
 
-    def numero_total_unidades(self) -> int:
+    def liberar_apartados(self) -> int:
         """
-        Devuelve el número total de unidades en el carrito.
+        Libera todas las unidades apartadas por el carrito.
 
-        :returns: Número total de unidades en el carrito.
+        :returns: Número de apartados liberados.
         """
-        return sum(articulo_carrito.unidades for articulo_carrito in ArticuloCarrito.objects.filter(propietario=self))
+        return UnidadReserva.liberar(self.apartados.all())
 
     def articulos(self) -> QuerySet['Articulo']:
         """
@@ -1044,39 +2101,197 @@ class Carrito(models.Model):
         )
         return orden
 
+    INTENTOS_ORDENAR = 5
+
     def ordenar(self) -> bool:
         """
         Convierte el carrito en una orden (transacción).
 
+        La transacción se reintenta si la base de datos está bloqueada por otra
+        compra (SQLite) o si otra transacción reservó las mismas unidades.
+
         :returns: True si la transacción fue exitosa, False en caso contrario.
         """
-        try:
-            with transaction.atomic():
-                orden = self.crear_orden_desde_carrito()
-                orden.save()
+        return self._con_reintentos(self._ordenar)
 
-                for corresponsable in self._corresponsables.all():
-                    orden.agregar_corresponsable(corresponsable)
+    def ordenar_serie(self, repeticiones: int, semanas: int = 1) -> bool:
+        """
+        Convierte el carrito en una serie de órdenes que se repiten cada cierto número
+        de semanas a partir del horario del carrito (transacción). Si alguna ocurrencia
+        no tiene unidades suficientes no se crea ninguna orden.
 
-                if self.vacio():
-                    raise Exception("No selecciono ningún artículo")
+        :param repeticiones: Número de órdenes de la serie.
+        :param semanas: Semanas entre una orden y la siguiente.
+        :returns: True si la transacción fue exitosa, False en caso contrario.
+        """
+        return self._con_reintentos(lambda: self._ordenar_serie(repeticiones, semanas))
 
-                for articulo_carrito in self.articulos_carrito():
-                    unidades = articulo_carrito.articulo.disponible(self.inicio, self.final)
-                    len_unidades = len(unidades)
+    def _con_reintentos(self, operacion) -> bool:
+        """
+        Ejecuta una operación dentro de una transacción, reintentándola si la base de
+        datos está bloqueada por otra compra (SQLite) o si otra transacción reservó las
+        mismas unidades.
 
-                    if len_unidades < articulo_carrito.unidades:
-                        raise Exception("No hay suficientes unidades disponibles")
+        :param operacion: Función sin argumentos que crea las órdenes.
+        :returns: True si la transacción fue exitosa, False en caso contrario.
+        """
+        for intento in range(self.INTENTOS_ORDENAR):
+            try:
+                with transaction.atomic():
+                    operacion()
+            except (OperationalError, ConflictoReserva):
+                time.sleep(random.uniform(0, 0.01 * 2 ** intento))
+            except CarritoNoOrdenable as e:
+                logger.info("La transacción ha sido cancelada: %s", e)
+                return False
+            except Exception:
+                logger.exception("Error inesperado al ordenar el carrito %s", self.pk)
+                raise
+            else:
+                return True
+
+        logger.warning("La transacción ha sido cancelada: las unidades están siendo reservadas por otra orden")
+        return False
 
-                    unidades.order_by('?')
-                    for i in range(0, articulo_carrito.unidades):
-                        orden.agregar_unidad(unidades[i])
+    @staticmethod
+    def _bloquear_unidades(articulos):
+        """
+        Bloquea las unidades de unos artículos hasta el final de la transacción.
+        SQLite ignora ``select_for_update``; ahí una escritura sin efecto sobre las
+        unidades toma el candado de escritura de la base de datos.
 
-                self.delete()
-        except Exception as e:
-            print(f"Hubo un error, la transacción ha sido cancelada. {str(e)}")
-            return False
-        return True
+        :param articulos: Ids de los artículos o ``QuerySet`` que los obtiene.
+        """
+        unidades = Unidad.objects.filter(articulo__in=articulos)
+        if connection.vendor == 'sqlite':
+            unidades.update(articulo=F('articulo'))
+        else:
+            list(unidades.select_for_update().order_by('id').values_list('id', flat=True))
+
+    def _ordenar(self):
+        """
+        Crea la orden y le asigna las unidades. Debe ejecutarse dentro de una transacción.
+
+        Las unidades de los artículos del carrito se bloquean en orden de id antes de
+        consultar la disponibilidad, así dos compras que compiten por ellas se ejecutan
+        una después de la otra. La orden se crea solo después de verificar la
+        disponibilidad. Al final se verifica contra ``UnidadReserva`` que ninguna unidad
+        quedó reservada dos veces.
+
+        :raises CarritoNoOrdenable: Si el carrito está vacío o no hay unidades suficientes.
+        :raises ConflictoReserva: Si otra transacción reservó alguna de las unidades.
+        """
+        self._bloquear_unidades(self.articulos_carrito().values('articulo_id'))
+
+        verificacion = self.verificar()
+        if verificacion.vacio():
+            raise CarritoNoOrdenable("No selecciono ningún artículo")
+        if verificacion.faltantes():
+            raise CarritoNoOrdenable("No hay suficientes unidades disponibles")
+        articulos_carrito = verificacion.lineas
+
+        # Los apartados vigentes del carrito se convierten en la asignación de la orden
+        apartadas = {}
+        for articulo_id, unidad_id in self.apartados.vigentes().values_list('unidad__articulo_id', 'unidad_id'):
+            apartadas.setdefault(articulo_id, []).append(unidad_id)
+        UnidadReserva.liberar(self.apartados.all())
+
+        unidades = []
+        for articulo_carrito in articulos_carrito:
+            # Se consulta la base de datos y no el motor en memoria, que puede no
+            # conocer aún las reservas de otros procesos.
+            propias = apartadas.get(articulo_carrito.articulo_id, [])[:articulo_carrito.unidades]
+            elegidas = propias + elegir_unidades(
+                articulo_carrito.articulo.disponible_sql(self.inicio, self.final).exclude(id__in=propias),
+                articulo_carrito.unidades - len(propias)
+            )
+
+            if len(elegidas) < articulo_carrito.unidades:
+                raise CarritoNoOrdenable("No hay suficientes unidades disponibles")
+
+            unidades.extend(elegidas)
+
+        orden = self.crear_orden_desde_carrito()
+
+        for corresponsable in self._corresponsables.all():
+            orden.agregar_corresponsable(corresponsable)
+
+        # Una sola inserción para todas las unidades; m2m_changed mantiene UnidadReserva.
+        orden._unidades.add(*unidades)
+
+        if UnidadReserva.objects.colisiones(self.inicio, self.final) \
+                .filter(unidad__in=orden.unidades()).exclude(orden=orden).exists():
+            raise ConflictoReserva()
+
+        self.delete()
+
+    def _ordenar_serie(self, repeticiones: int, semanas: int):
+        """
+        Crea la serie con todas sus órdenes, corresponsables, unidades y reservas
+        usando inserciones en bloque. Debe ejecutarse dentro de una transacción.
+
+        Los conflictos de todas las ocurrencias se resuelven juntos con
+        ``asignar_serie``; al final se verifica contra ``UnidadReserva`` que ninguna
+        unidad de la serie quedó reservada dos veces.
+        """
+        if repeticiones < 1:
+            raise CarritoNoOrdenable("La serie debe tener al menos una orden")
+
+        if self.vacio():
+            raise CarritoNoOrdenable("No selecciono ningún artículo")
+
+        solicitud = self.solicitud()
+        self._bloquear_unidades(solicitud)
+
+        ocurrencias = self.ocurrencias(repeticiones, semanas)
+        asignaciones, conflictos = asignar_serie(solicitud, ocurrencias, carrito=self)
+        if conflictos:
+            raise CarritoNoOrdenable(f"No hay suficientes unidades disponibles el {conflictos[0][0]}")
+
+        UnidadReserva.liberar(self.apartados.all())
+
+        serie = SerieOrden.objects.create(prestatario=self.prestatario, repeticiones=repeticiones, semanas=semanas)
+        ordenes = Orden.crear_en_bloque([
+            Orden(nombre=self.nombre, prestatario=self.prestatario, lugar=self.lugar,
+                  descripcion_lugar=self.descripcion_lugar, materia=self.materia, inicio=inicio, final=final,
+                  descripcion=self.descripcion, serie=serie)
+            for inicio, final in ocurrencias
+        ])
+
+        corresponsables = [self.prestatario_id]
+        corresponsables += self._corresponsables.exclude(id=self.prestatario_id).values_list('id', flat=True)
+        CorresponsableOrden.objects.bulk_create([
+            CorresponsableOrden(orden=orden, autorizador_id=autorizador_id)
+            for orden in ordenes for autorizador_id in corresponsables
+        ])
+
+        margenes = {articulo.id: articulo.margen() for articulo in Articulo.objects.filter(id__in=solicitud)}
+        relaciones, reservas, unidades = [], [], {}
+        for orden, asignacion in zip(ordenes, asignaciones):
+            for articulo_id, elegidas in asignacion.items():
+                for unidad_id in elegidas:
+                    relaciones.append(Orden._unidades.through(orden_id=orden.id, unidad_id=unidad_id))
+                    reservas.append(UnidadReserva.desde_orden(orden, unidad_id, margenes[articulo_id]))
+                    unidades[unidad_id] = articulo_id
+
+        # bulk_create no envía m2m_changed: las reservas, el motor y el caché se actualizan aquí
+        Orden._unidades.through.objects.bulk_create(relaciones)
+        UnidadReserva.objects.bulk_create(reservas)
+        UnidadReserva._avisar_cambio(unidades)
+
+        traslapes = UnidadReserva.objects.vigentes().filter(
+            bloqueante=True, unidad=OuterRef('unidad'),
+            inicio_con_margen__lt=OuterRef('final'), final_con_margen__gt=OuterRef('inicio')
+        ).exclude(orden__serie=serie)
+        if UnidadReserva.objects.filter(orden__serie=serie).filter(Exists(traslapes)).exists():
+            raise ConflictoReserva()
+
+        def notificar():
+            for orden in ordenes:
+                orden.notificar_corresponsables()
+
+        transaction.on_commit(notificar, robust=True)
+        self.delete()
 
     def corresponsables(self) -> QuerySet['Prestatario']:
         """
@@ -1093,14 +2308,17 @@ class Carrito(models.Model):
         :param prestatario: El prestatario que se quiere agregar como corresponsable.
         """
         self._corresponsables.add(prestatario)
+        self.tocar()
 
-    def numero_unidades(self) -> int:
+    def establecer_corresponsables(self, prestatarios):
         """
-        Obtiene el número total de unidades en el carrito.
+        Reemplaza los corresponsables del carrito.
 
-        :returns: Número total de unidades en el carrito.
+        :param prestatarios: Los prestatarios que serán corresponsables.
         """
-        return sum(articulo_carrito.unidades for articulo_carrito in ArticuloCarrito.objects.filter(propietario=self))
+        # set() solo elimina e inserta la diferencia, cada una en una sola consulta
+        self._corresponsables.set(prestatarios)
+        self.tocar()
 
     def existe(self, articulo):
         """
@@ -1172,6 +2390,88 @@ class Categoria(models.Model):
         return f"{self.nombre}"
 
 
+class Kit(models.Model):
+    """
+    Conjunto de artículos que se prestan juntos, por ejemplo cámara, lente, tripié
+    y baterías.
+
+    :ivar nombre: Nombre del kit.
+    :ivar descripcion: Descripción breve del kit.
+    :ivar imagen: Imagen del kit.
+    """
+
+    class KitQuerySet(models.QuerySet):
+
+        def para_materia(self, materia: 'Materia') -> QuerySet['Kit']:
+            """
+            Filtra los kits cuyos artículos están todos disponibles para una materia.
+
+            :param materia: La materia del préstamo.
+            :returns: Kits que se pueden prestar en la materia.
+            """
+            return self.filter(_articulos__isnull=False).exclude(
+                _articulos__in=Articulo.objects.exclude(materia=materia)
+            ).distinct()
+
+        def disponibilidad(self, inicio, final) -> dict[int, int]:
+            """
+            Obtiene cuántas veces se puede prestar completo cada kit en un rango de
+            fechas: el mínimo, entre sus artículos, de las unidades disponibles entre
+            las unidades que requiere el kit. La disponibilidad de todos los artículos
+            se obtiene con una sola consulta.
+
+            :param inicio: Fecha y hora de inicio del rango.
+            :param final: Fecha y hora de finalización del rango.
+            :returns: Diccionario con el id del kit y el número de kits disponibles.
+            """
+            componentes = list(ArticuloKit.objects.filter(kit__in=self).values_list('kit_id', 'articulo_id', 'unidades'))
+            disponibles = Articulo.objects.filter(id__in={articulo_id for _, articulo_id, _ in componentes}) \
+                .disponibilidad(inicio, final)
+
+            kits = {}
+            for kit_id, articulo_id, unidades in componentes:
+                completos = disponibles.get(articulo_id, 0) // unidades
+                kits[kit_id] = min(kits.get(kit_id, completos), completos)
+            return {kit_id: kits.get(kit_id, 0) for kit_id in self.values_list('id', flat=True)}
+
+    objects = KitQuerySet.as_manager()
+
+    nombre = models.CharField(unique=True, max_length=250)
+    descripcion = models.TextField(null=True, blank=True, max_length=250)
+    imagen = models.ImageField(default='default.png')
+    _articulos = models.ManyToManyField(to=Articulo, through='ArticuloKit', blank=True)
+
+    def articulos_kit(self) -> QuerySet['ArticuloKit']:
+        """
+        Obtiene los artículos del kit con las unidades que requiere de cada uno.
+
+        :returns: Lista de artículos del kit.
+        """
+        return ArticuloKit.objects.filter(kit=self)
+
+    def agregar(self, articulo: 'Articulo', unidades: int = 1):
+        """
+        Agrega un artículo al kit o cambia las unidades que requiere.
+
+        :param articulo: El artículo que se quiere agregar.
+        :param unidades: Unidades del artículo que incluye el kit.
+        """
+        ArticuloKit.objects.update_or_create(kit=self, articulo=articulo, defaults={'unidades': unidades})
+
+    def disponible(self, inicio, final) -> int:
+        """
+        Obtiene cuántas veces se puede prestar completo el kit en un rango de fechas.
+
+        :param inicio: Fecha y hora de inicio del rango.
+        :param final: Fecha y hora de finalización del rango.
+        :returns: Número de kits disponibles.
+        """
+        return Kit.objects.filter(id=self.id).disponibilidad(inicio, final)[self.id]
+
+    def __str__(self):
+        return f"{self.nombre}"
+
+
 class Entrega(models.Model):
     """
     Representa una entrega de equipo al prestatario.
@@ -1284,3 +2584,27 @@ class ArticuloCarrito(models.Model):
 
     def __str__(self):
         return f"({self.unidades}) {self.articulo}"
+
+
+class ArticuloKit(models.Model):
+    """
+    Relación entre un Artículo y un Kit.
+
+    :ivar kit: Kit que incluye el artículo.
+    :ivar articulo: Artículo incluido en el kit.
+    :ivar unidades: Número de unidades del artículo que incluye el kit.
+    """
+
+    class Meta:
+        unique_together = ('kit', 'articulo')
+        constraints = [
+            # Kit.objects.disponibilidad divide entre las unidades de cada componente
+            models.CheckConstraint(check=Q(unidades__gte=1), name='articulokit_unidades_gte_1'),
+        ]
+
+    kit = models.ForeignKey(to=Kit, on_delete=models.CASCADE)
+    articulo = models.ForeignKey(to=Articulo, on_delete=models.CASCADE)
+    unidades = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1)])
+
+    def __str__(self):
+        return f"({self.unidades}) {self.articulo}"
@@ -1,11 +1,18 @@
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, m2m_changed
+from django.db import transaction
+from django.db.models.signals import post_save, m2m_changed, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
 
+from PEMA.availability import cache_disponibilidad, canal_disponibilidad, motor
+
+from PEMA.models import Articulo
 from PEMA.models import AutorizacionEstado, Devolucion, Entrega
 from PEMA.models import CorresponsableOrden
+from PEMA.models import ESTADOS_BLOQUEANTES, ListaEspera
 from PEMA.models import Orden
 from PEMA.models import Perfil
+from PEMA.models import Unidad
+from PEMA.models import UnidadReserva
 
 
 # sender: The model class which the signal was called with.
@@ -25,14 +32,296 @@ def user_post_save(sender, instance, created, **kwargs):
     Perfil.objects.create(usuario=instance)
 
 
+@receiver(pre_save, sender=Orden)
+@receiver(pre_save, sender=Unidad)
+def guardar_estado_anterior(sender, instance, **kwargs):
+    """
+    Guarda en ``_estado_anterior`` el estado que la instancia tiene en la base de datos
+    antes de guardarse (None si es nueva), para que los receptores de ``post_save``
+    actúen solo cuando el estado cambia.
+    """
+    if instance._state.adding:
+        instance._estado_anterior = None
+    else:
+        instance._estado_anterior = sender.objects.filter(pk=instance.pk).values_list('estado', flat=True).first()
+
+
 @receiver(post_save, sender=Orden)
 def orden_after_create(sender, instance, created, **kwargs):
-
-    # TODO: falta documentación
+    """
+    Agrega al prestatario como corresponsable de su orden nueva y avisa a los
+    corresponsables cuando la transacción se confirma, así una compra que se revierte
+    o se reintenta no envía correos.
+    """
 
     if created:
         instance.agregar_corresponsable(instance.prestatario)
-        instance.notificar_corresponsables()
+        transaction.on_commit(instance.notificar_corresponsables, robust=True)
+
+
+def invalidar_cache_disponibilidad(articulos):
+    """
+    Descarta del caché de disponibilidad los artículos dados cuando la transacción se confirma.
+
+    :param articulos: Ids de los artículos o ``QuerySet`` que los obtiene.
+    """
+    if not cache_disponibilidad.activo():
+        return
+
+    articulos = set(articulos)
+    transaction.on_commit(lambda: cache_disponibilidad.invalidar(articulos))
+
+
+def publicar_disponibilidad(articulos, inicio=None, final=None):
+    """
+    Avisa a los catálogos abiertos que cambió la disponibilidad de unos artículos
+    cuando la transacción se confirma.
+
+    :param articulos: Ids de los artículos o ``QuerySet`` que los obtiene.
+    :param inicio: Inicio del rango afectado, o None si afecta a cualquier fecha.
+    :param final: Final del rango afectado.
+    """
+    if not canal_disponibilidad.hay_suscripciones():
+        return
+
+    articulos = set(articulos)
+    transaction.on_commit(lambda: canal_disponibilidad.publicar(articulos, inicio, final))
+
+
+@receiver(post_save, sender=Orden)
+def orden_actualizar_reservas(sender, instance, created, **kwargs):
+    """
+    Mantiene las reservas de las unidades de la orden al día con sus fechas y estado.
+    Una orden recién creada aún no tiene unidades, por lo que no hay nada que actualizar.
+    """
+
+    if created:
+        return
+
+    UnidadReserva.sincronizar_orden(instance)
+    transaction.on_commit(lambda: motor.refrescar_orden(instance.pk))
+    invalidar_cache_disponibilidad(instance.unidades().values_list('articulo_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Orden._unidades.through)
+def orden_unidades_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Crea o elimina las reservas cuando se agregan o quitan unidades de una orden.
+    Funciona desde ambos lados de la relación (``orden._unidades`` y ``unidad.orden_set``).
+    """
+
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if action == 'post_add':
+        if reverse:
+            margen = instance.articulo.margen()
+            ordenes = Orden.objects.filter(pk__in=pk_set)
+            reservas = [UnidadReserva.desde_orden(orden, instance.pk, margen) for orden in ordenes]
+        else:
+            margenes = UnidadReserva.margenes(pk_set)
+            reservas = [UnidadReserva.desde_orden(instance, unidad_id, margenes[unidad_id]) for unidad_id in pk_set]
+        UnidadReserva.objects.bulk_create(reservas, ignore_conflicts=True)
+
+    elif action == 'post_remove':
+        if reverse:
+            UnidadReserva.objects.filter(unidad=instance, orden_id__in=pk_set).delete()
+        else:
+            UnidadReserva.objects.filter(orden=instance, unidad_id__in=pk_set).delete()
+
+    elif action == 'post_clear':
+        if reverse:
+            UnidadReserva.objects.filter(unidad=instance).delete()
+            transaction.on_commit(lambda: motor.invalidar(instance.articulo_id))
+            return
+        UnidadReserva.objects.filter(orden=instance).delete()
+
+    # actualizar el motor en memoria solo cuando los cambios son definitivos
+    for orden_id in (pk_set if reverse else [instance.pk]):
+        transaction.on_commit(lambda orden_id=orden_id: motor.refrescar_orden(orden_id))
+
+
+@receiver(m2m_changed, sender=Orden._unidades.through)
+def orden_unidades_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Descarta del caché de disponibilidad los artículos cuyas unidades se agregan o
+    quitan de una orden. Al vaciar una orden las unidades se obtienen antes de quitarlas.
+    """
+
+    if not cache_disponibilidad.activo():
+        return
+
+    if reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        invalidar_cache_disponibilidad([instance.articulo_id])
+    elif action in ('post_add', 'post_remove'):
+        invalidar_cache_disponibilidad(Unidad.objects.filter(pk__in=pk_set).values_list('articulo_id', flat=True))
+    elif action == 'pre_clear':
+        invalidar_cache_disponibilidad(instance.unidades().values_list('articulo_id', flat=True))
+
+
+@receiver(pre_delete, sender=Orden)
+def orden_cache_deleted(sender, instance, **kwargs):
+    """
+    Descarta del caché de disponibilidad los artículos de una orden que se va a eliminar.
+    """
+
+    invalidar_cache_disponibilidad(instance.unidades().values_list('articulo_id', flat=True))
+
+
+@receiver(post_save, sender=Orden)
+def orden_publicar_disponibilidad(sender, instance, created, **kwargs):
+    """
+    Avisa a los catálogos abiertos cuando cambia el estado o las fechas de una orden.
+    Como las fechas anteriores ya no se conocen, el cambio afecta a cualquier rango.
+    """
+
+    if not created:
+        publicar_disponibilidad(instance.unidades().values_list('articulo_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Orden._unidades.through)
+def orden_unidades_publicar(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Avisa a los catálogos abiertos cuando se agregan o quitan unidades de una orden.
+    """
+
+    if reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        publicar_disponibilidad([instance.articulo_id])
+    elif action in ('post_add', 'post_remove'):
+        publicar_disponibilidad(Unidad.objects.filter(pk__in=pk_set).values_list('articulo_id', flat=True),
+                                instance.inicio, instance.final)
+    elif action == 'pre_clear':
+        publicar_disponibilidad(instance.unidades().values_list('articulo_id', flat=True),
+                                instance.inicio, instance.final)
+
+
+@receiver(pre_delete, sender=Orden)
+def orden_publicar_deleted(sender, instance, **kwargs):
+    """
+    Avisa a los catálogos abiertos cuando se elimina una orden que apartaba unidades.
+    """
+
+    if instance.estado in ESTADOS_BLOQUEANTES:
+        publicar_disponibilidad(instance.unidades().values_list('articulo_id', flat=True),
+                                instance.inicio, instance.final)
+
+
+def atender_lista_espera(articulos, inicio, final):
+    """
+    Ofrece a la lista de espera las unidades liberadas cuando la transacción se confirma.
+
+    :param articulos: Ids de los artículos o ``QuerySet`` que los obtiene.
+    :param inicio: Fecha y hora de inicio del rango liberado.
+    :param final: Fecha y hora de finalización del rango liberado.
+    """
+    articulos = set(articulos)
+    if articulos:
+        transaction.on_commit(lambda: ListaEspera.atender(articulos, inicio, final), robust=True)
+
+
+@receiver(post_save, sender=Orden)
+def orden_liberada(sender, instance, created, **kwargs):
+    """
+    Cuando una orden deja de apartar sus unidades (cancelada, rechazada o devuelta),
+    las ofrece a la lista de espera. Guardar una orden que ya no las apartaba no hace nada.
+    """
+
+    if created or instance.estado in ESTADOS_BLOQUEANTES or instance._estado_anterior not in ESTADOS_BLOQUEANTES:
+        return
+
+    atender_lista_espera(instance.unidades().values_list('articulo_id', flat=True), instance.inicio, instance.final)
+
+
+@receiver(m2m_changed, sender=Orden._unidades.through)
+def orden_unidades_liberadas(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Ofrece a la lista de espera las unidades que se quitan de una orden que las apartaba.
+    """
+
+    if reverse:
+        if action == 'post_remove':
+            ordenes = Orden.objects.filter(pk__in=pk_set)
+        elif action == 'pre_clear':
+            ordenes = instance.orden_set.all()
+        else:
+            return
+
+        for orden in ordenes.filter(estado__in=ESTADOS_BLOQUEANTES):
+            atender_lista_espera([instance.articulo_id], orden.inicio, orden.final)
+        return
+
+    if instance.estado not in ESTADOS_BLOQUEANTES:
+        return
+
+    if action == 'post_remove':
+        atender_lista_espera(Unidad.objects.filter(pk__in=pk_set).values_list('articulo_id', flat=True),
+                             instance.inicio, instance.final)
+    elif action == 'pre_clear':
+        atender_lista_espera(instance.unidades().values_list('articulo_id', flat=True),
+                             instance.inicio, instance.final)
+
+
+@receiver(pre_delete, sender=Orden)
+def orden_lista_espera_deleted(sender, instance, **kwargs):
+    """
+    Ofrece a la lista de espera las unidades de una orden bloqueante que se va a eliminar.
+    """
+
+    if instance.estado in ESTADOS_BLOQUEANTES:
+        atender_lista_espera(instance.unidades().values_list('articulo_id', flat=True),
+                             instance.inicio, instance.final)
+
+
+@receiver(post_delete, sender=Orden)
+def orden_deleted(sender, instance, **kwargs):
+    """
+    Quita del motor de disponibilidad las reservas de una orden eliminada.
+    """
+    transaction.on_commit(lambda: motor.refrescar_orden(instance.pk))
+
+
+@receiver(post_save, sender=Articulo)
+def articulo_margen_changed(sender, instance, created, **kwargs):
+    """
+    Aplica el margen entre préstamos del artículo a las reservas de sus unidades y
+    descarta su índice y caché de disponibilidad si alguna cambió, avisando a los catálogos abiertos.
+    """
+
+    if created or not UnidadReserva.actualizar_margen(instance):
+        return
+
+    transaction.on_commit(lambda: motor.invalidar(instance.id))
+    invalidar_cache_disponibilidad([instance.id])
+    publicar_disponibilidad([instance.id])
+
+
+@receiver(post_save, sender=Unidad)
+@receiver(post_delete, sender=Unidad)
+def unidad_changed(sender, instance, **kwargs):
+    """
+    Descarta el índice y el caché de disponibilidad del artículo cuando una unidad
+    cambia de estado, se crea o se elimina, y avisa a los catálogos abiertos.
+    """
+    transaction.on_commit(lambda: motor.invalidar(instance.articulo_id))
+    invalidar_cache_disponibilidad([instance.articulo_id])
+    publicar_disponibilidad([instance.articulo_id])
+
+
+@receiver(post_save, sender=Unidad)
+def unidad_desactivada(sender, instance, **kwargs):
+    """
+    Al desactivar una unidad, la sustituye en las órdenes futuras que la tenían asignada
+    y avisa a los coordinadores de las órdenes que no se pudieron corregir. Guardar una
+    unidad que ya estaba inactiva no hace nada.
+    """
+    if instance.estado != Unidad.Estado.INACTIVO or instance._estado_anterior != Unidad.Estado.ACTIVO:
+        return
+
+    def reasignar():
+        _, pendientes = Unidad.reasignar_ordenes(Unidad.objects.filter(id=instance.id))
+        Unidad.notificar_pendientes(pendientes)
+
+    transaction.on_commit(reasignar)
 
 
 @receiver(post_save, sender=CorresponsableOrden)
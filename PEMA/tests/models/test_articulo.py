@@ -7,6 +7,7 @@ from PEMA.models import Articulo, Prestatario, EstadoOrden
 from PEMA.models import Categoria
 from PEMA.models import Materia
 from PEMA.models import Orden
+from PEMA.models import Unidad
 
 
 class TestArticulo(TestCase):
@@ -146,4 +147,31 @@ class TestArticulo(TestCase):
         print(qs5)
         print('qs6')
         print(qs6)
-        
\ No newline at end of file
+        
+
+    def test_con_disponibles(self):
+        self.orden1.agregar_unidad(self.unidad1)
+        self.orden2.agregar_unidad(self.unidad2)
+        self.orden3.agregar_unidad(self.unidad3)
+        self.orden5.agregar_unidad(self.unidad5)
+        self.orden6.agregar_unidad(self.unidad6)
+
+        rangos = [(0, 5), (-1, 2), (-1, 1), (2, 4), (1, 4)]
+        for inicio, final in rangos:
+            inicio, final = self.generar_fechas(inicio), self.generar_fechas(final)
+
+            with self.assertNumQueries(1):
+                disponibilidad = self.materia1.articulos().disponibilidad(inicio, final)
+
+            for articulo in [self.articulo1, self.articulo2]:
+                self.assertEqual(disponibilidad[articulo.id], articulo.disponible(inicio, final).count())
+
+    def test_disponible_unidad_inactiva(self):
+        self.unidad7.estado = Unidad.Estado.INACTIVO
+        self.unidad7.save()
+
+        inicio, final = self.generar_fechas(0), self.generar_fechas(5)
+        self.assertNotIn(self.unidad7, self.articulo2.disponible(inicio, final))
+
+        articulo = Articulo.objects.con_disponibles(inicio, final).get(id=self.articulo2.id)
+        self.assertEqual(articulo.num_unidades, 3)
@@ -1,9 +1,15 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from io import StringIO
 
-from django.test import TestCase
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.utils.timezone import make_aware
 
-from PEMA.models import Prestatario, Materia, Carrito, Articulo, Orden
+from PEMA.models import Prestatario, Materia, Carrito, Articulo, Orden, Categoria, UnidadReserva
 
 
 class TestCarrito(TestCase):
@@ -103,3 +109,196 @@ class TestCarrito(TestCase):
         otro_articulo = Articulo.objects.create(nombre="Otro artículo de prueba", codigo="0000-0001")
         carrito.agregar(articulo=otro_articulo, unidades=3)
         self.assertEqual(carrito.numero_total_unidades(), 5)
+
+    def test_ordenar_consultas_constantes(self):
+        for i in range(6):
+            self.articulo.crear_unidad(f"control-{i}", f"serie-{i}")
+
+        consultas = []
+        for dia, unidades in ((16, 1), (17, 5)):
+            carrito = Carrito.objects.create(prestatario=self.user, materia=self.materia,
+                                             inicio=make_aware(datetime(2024, 3, dia, 12)),
+                                             final=make_aware(datetime(2024, 3, dia, 18)))
+            carrito.agregar(articulo=self.articulo, unidades=unidades)
+
+            with CaptureQueriesContext(connection) as contexto:
+                self.assertTrue(carrito.ordenar())
+            consultas.append(len(contexto))
+
+        self.assertEqual(consultas[0], consultas[1])
+        self.assertEqual(Orden.objects.last().unidades().count(), 5)
+
+    def test_sustitutos(self):
+        carrito = Carrito.objects.create(prestatario=self.user, materia=self.materia,
+                                         inicio=make_aware(datetime(2024, 3, 16, 12)),
+                                         final=make_aware(datetime(2024, 3, 16, 18)))
+        camaras = Categoria.objects.create(nombre="Camaras")
+        camaras.agregar(self.articulo)
+        self.materia.agregar_articulo(self.articulo)
+        carrito.agregar(articulo=self.articulo, unidades=1)
+
+        disponible = Articulo.objects.create(nombre="Camara disponible", codigo="0000-0001")
+        sin_unidades = Articulo.objects.create(nombre="Camara sin unidades", codigo="0000-0002")
+        otra_materia = Articulo.objects.create(nombre="Camara de otra materia", codigo="0000-0003")
+        otra_categoria = Articulo.objects.create(nombre="Tripie", codigo="0000-0004")
+        for articulo in (disponible, sin_unidades, otra_categoria):
+            self.materia.agregar_articulo(articulo)
+        for articulo in (disponible, sin_unidades, otra_materia):
+            camaras.agregar(articulo)
+        for articulo in (disponible, otra_materia, otra_categoria):
+            articulo.crear_unidad(articulo.codigo, articulo.codigo)
+
+        no_disponibles = carrito.articulos_no_disponibles()
+        self.assertEqual([articulo_carrito.articulo for articulo_carrito in no_disponibles], [self.articulo])
+
+        with self.assertNumQueries(3):
+            sustitutos = carrito.sustitutos([self.articulo])
+        self.assertEqual(sustitutos, {self.articulo.id: [disponible]})
+
+    def test_apartar(self):
+        inicio, final = make_aware(datetime(2024, 3, 16, 12)), make_aware(datetime(2024, 3, 16, 18))
+        carrito = Carrito.objects.create(prestatario=self.user, materia=self.materia, inicio=inicio, final=final)
+        otro = Carrito.objects.create(prestatario=Prestatario.objects.create(username="otro"),
+                                      materia=self.materia, inicio=inicio, final=final)
+        unidad, _ = self.articulo.crear_unidad("num_control", "num_serie")
+
+        carrito.agregar(articulo=self.articulo, unidades=1)
+        self.assertEqual(carrito.apartar(self.articulo, 1), 1)
+        self.assertEqual(self.articulo.disponible(inicio, final).count(), 0)
+        self.assertEqual(carrito.articulos_no_disponibles(), [])
+
+        # otro carrito no puede apartar ni ordenar la unidad apartada
+        otro.agregar(articulo=self.articulo, unidades=1)
+        self.assertEqual(otro.apartar(self.articulo, 1), 0)
+        self.assertFalse(otro.ordenar())
+
+        # el apartado se convierte en la asignación de la orden
+        self.assertTrue(carrito.ordenar())
+        self.assertEqual(list(Orden.objects.get().unidades()), [unidad])
+        self.assertFalse(UnidadReserva.objects.filter(orden__isnull=True).exists())
+
+    def test_apartados_expirados(self):
+        inicio, final = make_aware(datetime(2024, 3, 16, 12)), make_aware(datetime(2024, 3, 16, 18))
+        carrito = Carrito.objects.create(prestatario=self.user, materia=self.materia, inicio=inicio, final=final)
+        self.articulo.crear_unidad("num_control", "num_serie")
+
+        carrito.agregar(articulo=self.articulo, unidades=1)
+        carrito.apartar(self.articulo, 1)
+        carrito.apartados.update(expira=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.articulo.disponible(inicio, final).count(), 1)
+
+        self.assertEqual(UnidadReserva.liberar_expirados(), 1)
+        self.assertFalse(carrito.apartados.exists())
+
+    def test_eliminar_articulo_libera_apartados(self):
+        carrito = Carrito.objects.create(prestatario=self.user, materia=self.materia,
+                                         inicio=make_aware(datetime(2024, 3, 16, 12)),
+                                         final=make_aware(datetime(2024, 3, 16, 18)))
+        for i in range(3):
+            self.articulo.crear_unidad(f"control-{i}", f"serie-{i}")
+
+        carrito.agregar(articulo=self.articulo, unidades=3)
+        carrito.apartar(self.articulo, 3)
+
+        carrito.eliminar_articulo(self.articulo, 2)
+        self.assertEqual(carrito.apartados.count(), 1)
+
+        carrito.eliminar_articulo(self.articulo)
+        self.assertEqual(carrito.apartados.count(), 0)
+
+    def test_verificar(self):
+        inicio, final = make_aware(datetime(2024, 3, 16, 12)), make_aware(datetime(2024, 3, 16, 18))
+        carrito = Carrito.objects.create(prestatario=self.user, materia=self.materia, inicio=inicio, final=final)
+        otro_articulo = Articulo.objects.create(nombre="Otro artículo de prueba", codigo="0000-0001")
+        sin_unidades = Articulo.objects.create(nombre="Sin unidades", codigo="0000-0002")
+        for i in range(3):
+            self.articulo.crear_unidad(f"control-{i}", f"serie-{i}")
+        otro_articulo.crear_unidad("control", "serie")
+
+        carrito.agregar(articulo=self.articulo, unidades=2)
+        carrito.apartar(self.articulo, 2)
+        carrito.agregar(articulo=otro_articulo, unidades=2)
+        carrito.agregar(articulo=sin_unidades, unidades=1)
+
+        with self.assertNumQueries(1):
+            verificacion = carrito.verificar()
+
+        # las unidades apartadas por el carrito cuentan como disponibles para él
+        self.assertEqual([(linea.articulo, linea.disponibles, linea.faltantes) for linea in verificacion.lineas],
+                         [(self.articulo, 3, 0), (otro_articulo, 1, 1), (sin_unidades, 0, 1)])
+        self.assertEqual([linea.articulo for linea in verificacion.faltantes()], [otro_articulo, sin_unidades])
+        self.assertEqual([linea.articulo for linea in verificacion.no_disponibles()], [sin_unidades])
+        self.assertEqual(verificacion.numero_unidades(), 5)
+
+        self.assertFalse(carrito.ordenar())
+        self.assertFalse(Orden.objects.exists())
+
+    def test_ordenar_notifica_al_confirmar(self):
+        self.user.email = "test_user@uabc.edu.mx"
+        self.user.save()
+        carrito = Carrito.objects.create(prestatario=self.user, materia=self.materia,
+                                         inicio=make_aware(datetime(2024, 3, 16, 12)),
+                                         final=make_aware(datetime(2024, 3, 16, 18)))
+        carrito.agregar(articulo=self.articulo, unidades=1)
+        mail.outbox.clear()
+
+        # un carrito sin unidades no crea la orden ni envía correos
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.assertFalse(carrito.ordenar())
+        self.assertEqual(callbacks, [])
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.articulo.crear_unidad("num_control", "num_serie")
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertTrue(carrito.ordenar())
+        # el correo se envía solo cuando se confirma la transacción
+        self.assertEqual(len(mail.outbox), 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual([correo.to for correo in mail.outbox], [["test_user@uabc.edu.mx"]])
+
+    @override_settings(CARRITO_TTL=60 * 60)
+    def test_cambios_renuevan_expiracion(self):
+        carrito = Carrito.objects.create(prestatario=self.user, materia=self.materia,
+                                         inicio=make_aware(datetime(2024, 3, 16, 12)),
+                                         final=make_aware(datetime(2024, 3, 16, 18)))
+        self.articulo.crear_unidad("num_control", "num_serie")
+        otro = Prestatario.objects.create(username="otro")
+
+        cambios = [
+            lambda: carrito.agregar(self.articulo, 2),
+            lambda: carrito.apartar(self.articulo, 1),
+            lambda: carrito.esperar(self.articulo),
+            lambda: carrito.eliminar_articulo(self.articulo, 1),
+            lambda: carrito.agregar_corresponsable(otro),
+            lambda: carrito.establecer_corresponsables([]),
+        ]
+        for cambio in cambios:
+            Carrito.objects.filter(id=carrito.id).update(actualizado=timezone.now() - timedelta(hours=2))
+            self.assertTrue(Carrito.objects.expirados().exists())
+
+            cambio()
+            self.assertFalse(Carrito.objects.expirados().exists())
+
+    @override_settings(CARRITO_TTL=60 * 60)
+    def test_eliminar_expirados(self):
+        inicio, final = make_aware(datetime(2024, 3, 16, 12)), make_aware(datetime(2024, 3, 16, 18))
+        for i in range(2):
+            self.articulo.crear_unidad(f"control-{i}", f"serie-{i}")
+        otro = Prestatario.objects.create(username="otro")
+
+        abandonado = Carrito.objects.create(prestatario=self.user, materia=self.materia, inicio=inicio, final=final)
+        abandonado.agregar(self.articulo, 1)
+        abandonado.apartar(self.articulo, 1)
+        abandonado.agregar_corresponsable(otro)
+        activo = Carrito.objects.create(prestatario=otro, materia=self.materia, inicio=inicio, final=final)
+        activo.agregar(self.articulo, 1)
+        Carrito.objects.filter(id=abandonado.id).update(actualizado=timezone.now() - timedelta(hours=2))
+
+        salida = StringIO()
+        call_command('limpiar_carritos', stdout=salida)
+
+        self.assertIn('Se eliminaron 1 carritos, 1 artículos, 1 corresponsables y 1 apartados', salida.getvalue())
+        self.assertEqual(list(Carrito.objects.all()), [activo])
+        self.assertEqual(activo.articulos_carrito().count(), 1)
+        self.assertFalse(UnidadReserva.objects.exists())
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.timezone import make_aware
+
+from PEMA.models import Prestatario, Materia, Articulo, Carrito, Kit, Orden, UnidadReserva
+
+
+class TestKit(TestCase):
+    INICIO = make_aware(datetime(2030, 3, 4, 10))
+    FINAL = make_aware(datetime(2030, 3, 4, 14))
+
+    def setUp(self):
+        self.materia = Materia.objects.create(nombre="Fotografia", year=2022, semestre=1)
+        self.camara = Articulo.objects.create(nombre="Camara", codigo="100")
+        self.bateria = Articulo.objects.create(nombre="Bateria", codigo="200")
+        for i in range(3):
+            self.camara.crear_unidad(num_control=f"{i}", num_serie=f"{i}")
+        for i in range(5):
+            self.bateria.crear_unidad(num_control=f"{i}", num_serie=f"{i}")
+        self.materia.agregar_articulo(self.camara)
+        self.materia.agregar_articulo(self.bateria)
+
+        self.kit = Kit.objects.create(nombre="Kit de fotografia")
+        self.kit.agregar(self.camara, 1)
+        self.kit.agregar(self.bateria, 2)
+
+        self.prestatario = Prestatario.crear_usuario(username="prestatario", password="password")
+        self.carrito = Carrito.objects.create(prestatario=self.prestatario, materia=self.materia,
+                                              inicio=self.INICIO, final=self.FINAL)
+
+    def test_componente_sin_unidades(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.kit.agregar(self.bateria, 0)
+        self.assertEqual(self.kit.disponible(self.INICIO, self.FINAL), 2)
+
+    def test_disponibilidad_es_el_minimo(self):
+        # 3 cámaras, 5 baterías / 2 por kit
+        self.assertEqual(self.kit.disponible(self.INICIO, self.FINAL), 2)
+
+        orden = Orden.objects.create(prestatario=self.prestatario, materia=self.materia,
+                                     inicio=self.INICIO, final=self.FINAL)
+        for unidad in self.camara.unidades()[:2]:
+            orden.agregar_unidad(unidad)
+        self.assertEqual(self.kit.disponible(self.INICIO, self.FINAL), 1)
+
+    def test_disponibilidad_en_lote(self):
+        otro = Kit.objects.create(nombre="Solo baterias")
+        otro.agregar(self.bateria, 5)
+        vacio = Kit.objects.create(nombre="Vacio")
+
+        with self.assertNumQueries(3):
+            disponibles = Kit.objects.all().disponibilidad(self.INICIO, self.FINAL)
+
+        self.assertEqual(disponibles, {self.kit.id: 2, otro.id: 1, vacio.id: 0})
+
+    def test_para_materia(self):
+        otro_articulo = Articulo.objects.create(nombre="Microfono", codigo="300")
+        otro = Kit.objects.create(nombre="Audio")
+        otro.agregar(otro_articulo, 1)
+        otro.agregar(self.camara, 1)
+        Kit.objects.create(nombre="Vacio")
+
+        self.assertEqual(list(Kit.objects.para_materia(self.materia)), [self.kit])
+
+    def test_agregar_kit(self):
+        self.assertTrue(self.carrito.agregar_kit(self.kit))
+
+        self.assertEqual(dict(self.carrito.articulos_carrito().values_list('articulo_id', 'unidades')),
+                         {self.camara.id: 1, self.bateria.id: 2})
+        self.assertEqual(self.carrito.apartados.count(), 3)
+
+    def test_agregar_kit_es_atomico(self):
+        self.assertFalse(self.carrito.agregar_kit(self.kit, 3))
+
+        self.assertTrue(self.carrito.vacio())
+        self.assertFalse(UnidadReserva.objects.exists())
+
+    def test_agregar_kit_aparta_toda_la_linea(self):
+        # la cámara ya estaba en el carrito sin unidades apartadas
+        self.carrito.agregar(self.camara, 1)
+        antes = timezone.now() - timedelta(days=1)
+        Carrito.objects.filter(pk=self.carrito.pk).update(actualizado=antes)
+
+        self.assertTrue(self.carrito.agregar_kit(self.kit))
+
+        self.assertEqual(self.carrito.apartados.filter(unidad__articulo=self.camara).count(), 2)
+        self.assertEqual(self.carrito.apartados.filter(unidad__articulo=self.bateria).count(), 2)
+        self.carrito.refresh_from_db()
+        self.assertGreater(self.carrito.actualizado, antes)
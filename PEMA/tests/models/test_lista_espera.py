@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.utils.timezone import make_aware
+
+from PEMA.models import Prestatario, Materia, Articulo, Carrito, Orden, ListaEspera, UnidadReserva
+
+
+class TestListaEspera(TestCase):
+    INICIO = make_aware(datetime(2030, 3, 4, 10))
+    FINAL = make_aware(datetime(2030, 3, 4, 14))
+
+    def setUp(self):
+        self.materia = Materia.objects.create(nombre="Fotografia", year=2022, semestre=1)
+        self.articulo = Articulo.objects.create(nombre="Camara", codigo="100")
+        self.unidad, _ = self.articulo.crear_unidad(num_control="1", num_serie="1")
+
+        self.dueno = Prestatario.crear_usuario(username="dueno", password="password", email="dueno@uabc.edu.mx")
+        self.primero = Prestatario.crear_usuario(username="primero", password="password", email="primero@uabc.edu.mx")
+        self.segundo = Prestatario.crear_usuario(username="segundo", password="password", email="segundo@uabc.edu.mx")
+
+        self.orden = Orden.objects.create(prestatario=self.dueno, materia=self.materia,
+                                          inicio=self.INICIO, final=self.FINAL)
+        self.orden.agregar_unidad(self.unidad)
+
+    def esperar(self, prestatario, inicio=INICIO, final=FINAL):
+        return ListaEspera.objects.create(prestatario=prestatario, articulo=self.articulo,
+                                          inicio=inicio, final=final)
+
+    def test_ofrecer_en_orden(self):
+        primera = self.esperar(self.primero)
+        segunda = self.esperar(self.segundo)
+        mail.outbox.clear()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orden.cancelar()
+
+        primera.refresh_from_db()
+        segunda.refresh_from_db()
+        self.assertEqual(primera.estado, ListaEspera.Estado.OFRECIDA)
+        self.assertEqual(segunda.estado, ListaEspera.Estado.ESPERANDO)
+        self.assertEqual(primera.apartados.get().unidad, self.unidad)
+        self.assertEqual([correo.to for correo in mail.outbox], [["primero@uabc.edu.mx"]])
+
+        # la unidad ofrecida no está disponible para nadie más
+        self.assertEqual(self.articulo.disponible(self.INICIO, self.FINAL).count(), 0)
+
+    @override_settings(EMAIL_BACKEND='PEMA.tests.no_existe.EmailBackend')
+    def test_correo_fallido(self):
+        primera = self.esperar(self.primero)
+
+        with self.assertLogs('django.test', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            self.orden.cancelar()
+
+        primera.refresh_from_db()
+        self.assertEqual(primera.estado, ListaEspera.Estado.OFRECIDA)
+
+    def test_solo_al_liberar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orden.cancelar()
+
+        segunda = self.esperar(self.segundo)
+        self.articulo.crear_unidad(num_control="2", num_serie="2")
+        self.orden.nombre = "Otra"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orden.save()
+
+        segunda.refresh_from_db()
+        self.assertEqual(segunda.estado, ListaEspera.Estado.ESPERANDO)
+
+    def test_solo_entradas_traslapadas(self):
+        otro_dia = self.esperar(self.primero, self.INICIO + timedelta(days=1), self.FINAL + timedelta(days=1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orden._unidades.remove(self.unidad)
+
+        otro_dia.refresh_from_db()
+        self.assertEqual(otro_dia.estado, ListaEspera.Estado.ESPERANDO)
+
+    def test_oferta_expirada(self):
+        primera = self.esperar(self.primero)
+        segunda = self.esperar(self.segundo)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orden.delete()
+
+        UnidadReserva.objects.filter(espera=primera).update(expira=timezone.now() - timedelta(seconds=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            UnidadReserva.liberar_expirados()
+
+        primera.refresh_from_db()
+        segunda.refresh_from_db()
+        self.assertEqual(primera.estado, ListaEspera.Estado.EXPIRADA)
+        self.assertEqual(segunda.estado, ListaEspera.Estado.OFRECIDA)
+
+    def test_carrito_usa_oferta(self):
+        primera = self.esperar(self.primero)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orden.cancelar()
+
+        carrito = Carrito.objects.create(prestatario=self.primero, materia=self.materia,
+                                         inicio=self.INICIO, final=self.FINAL)
+        carrito.agregar(self.articulo, 1)
+        self.assertEqual(carrito.apartar(self.articulo, 1), 1)
+
+        primera.refresh_from_db()
+        self.assertEqual(primera.estado, ListaEspera.Estado.ATENDIDA)
+        self.assertTrue(carrito.ordenar())
+
+    def test_carrito_esperar(self):
+        carrito = Carrito.objects.create(prestatario=self.primero, materia=self.materia,
+                                         inicio=self.INICIO, final=self.FINAL)
+        carrito.agregar(self.articulo, 1)
+
+        entrada = carrito.esperar(self.articulo)
+        self.assertEqual(carrito.esperar(self.articulo), entrada)
+        self.assertEqual((entrada.inicio, entrada.final, entrada.unidades), (self.INICIO, self.FINAL, 1))
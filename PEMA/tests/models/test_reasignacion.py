@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+from django.core import mail
+from django.test import TestCase
+from django.utils.timezone import make_aware
+
+from PEMA.models import Prestatario, Coordinador, Materia, Articulo, Orden, Unidad, UnidadReserva
+
+
+class TestReasignacion(TestCase):
+    INICIO = make_aware(datetime(2030, 3, 4, 10))
+    FINAL = make_aware(datetime(2030, 3, 4, 14))
+
+    def setUp(self):
+        self.materia = Materia.objects.create(nombre="Fotografia", year=2022, semestre=1)
+        self.articulo = Articulo.objects.create(nombre="Camara", codigo="100")
+        self.unidades = [self.articulo.crear_unidad(num_control=f"{i}", num_serie=f"{i}")[0] for i in range(3)]
+
+        self.prestatario = Prestatario.crear_usuario(username="prestatario", password="password")
+        Coordinador.crear_usuario(username="coordinador", password="password", email="coordinador@uabc.edu.mx")
+
+    def crear_orden(self, *unidades, inicio=INICIO, final=FINAL):
+        orden = Orden.objects.create(prestatario=self.prestatario, materia=self.materia, inicio=inicio, final=final)
+        for unidad in unidades:
+            orden.agregar_unidad(unidad)
+        return orden
+
+    def desactivar(self, unidad):
+        unidad.estado = Unidad.Estado.INACTIVO
+        with self.captureOnCommitCallbacks(execute=True):
+            unidad.save()
+
+    def test_sustituye_unidad_libre(self):
+        rota, ocupada, libre = self.unidades
+        orden = self.crear_orden(rota)
+        self.crear_orden(ocupada)
+
+        self.desactivar(rota)
+
+        self.assertEqual(list(orden.unidades()), [libre])
+        self.assertEqual(UnidadReserva.objects.get(orden=orden).unidad, libre)
+
+    def test_no_repite_unidad(self):
+        rota, primera, segunda = self.unidades
+        a = self.crear_orden(rota)
+        b = self.crear_orden(rota, inicio=self.INICIO + timedelta(hours=1))
+        Unidad.objects.filter(id=rota.id).update(estado=Unidad.Estado.INACTIVO)
+
+        reasignadas, pendientes = Unidad.reasignar_ordenes()
+
+        self.assertEqual(pendientes, [])
+        self.assertEqual({nueva for _, _, nueva in reasignadas}, {primera.id, segunda.id})
+        self.assertNotEqual(set(a.unidades()), set(b.unidades()))
+
+    def test_reporta_pendientes(self):
+        rota, primera, segunda = self.unidades
+        orden = self.crear_orden(rota)
+        self.crear_orden(primera, segunda)
+        mail.outbox.clear()
+
+        self.desactivar(rota)
+
+        self.assertEqual(list(orden.unidades()), [rota])
+        self.assertEqual([correo.to for correo in mail.outbox], [["coordinador@uabc.edu.mx"]])
+
+    def test_solo_al_desactivar(self):
+        rota, primera, segunda = self.unidades
+        self.crear_orden(rota)
+        self.crear_orden(primera, segunda)
+        mail.outbox.clear()
+
+        self.desactivar(rota)
+        rota.num_serie = "10"
+        with self.captureOnCommitCallbacks(execute=True):
+            rota.save()
+
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_ignora_ordenes_pasadas(self):
+        rota = self.unidades[0]
+        self.crear_orden(rota, inicio=make_aware(datetime(2020, 3, 4, 10)), final=make_aware(datetime(2020, 3, 4, 14)))
+        Unidad.objects.filter(id=rota.id).update(estado=Unidad.Estado.INACTIVO)
+
+        self.assertEqual(Unidad.reasignar_ordenes(), ([], []))
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+from django.core import mail
+from django.test import TestCase
+from django.utils.timezone import make_aware
+
+from PEMA.models import Prestatario, Materia, Articulo, Carrito, Orden, CorresponsableOrden, SerieOrden, \
+    UnidadReserva
+
+
+class TestSerieOrden(TestCase):
+    INICIO = make_aware(datetime(2030, 3, 4, 10))
+    FINAL = make_aware(datetime(2030, 3, 4, 12))
+
+    def setUp(self):
+        self.materia = Materia.objects.create(nombre="Fotografia", year=2022, semestre=1)
+        self.camara = Articulo.objects.create(nombre="Camara", codigo="100")
+        self.tripie = Articulo.objects.create(nombre="Tripie", codigo="200")
+        self.camaras = [self.camara.crear_unidad(num_control=f"{i}", num_serie=f"{i}")[0] for i in range(2)]
+        self.tripie.crear_unidad(num_control="1", num_serie="1")
+
+        self.maestro = Prestatario.crear_usuario(username="maestro", password="password", email="maestro@uabc.edu.mx")
+        self.otro = Prestatario.crear_usuario(username="otro", password="password")
+        self.carrito = Carrito.objects.create(prestatario=self.maestro, materia=self.materia,
+                                              inicio=self.INICIO, final=self.FINAL)
+        self.carrito.agregar(self.camara, 1)
+        self.carrito.agregar(self.tripie, 1)
+
+    def ocupar(self, unidad, semana):
+        orden = Orden.objects.create(prestatario=self.otro, materia=self.materia,
+                                     inicio=self.INICIO + timedelta(weeks=semana),
+                                     final=self.FINAL + timedelta(weeks=semana))
+        orden.agregar_unidad(unidad)
+        return orden
+
+    def test_ocurrencias(self):
+        self.assertEqual(self.carrito.ocurrencias(3, semanas=2), [
+            (self.INICIO, self.FINAL),
+            (self.INICIO + timedelta(weeks=2), self.FINAL + timedelta(weeks=2)),
+            (self.INICIO + timedelta(weeks=4), self.FINAL + timedelta(weeks=4)),
+        ])
+
+    def test_ordenar_serie(self):
+        mail.outbox.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.carrito.ordenar_serie(4))
+
+        serie = SerieOrden.objects.get()
+        ordenes = list(serie.ordenes.order_by('inicio'))
+        self.assertEqual([orden.inicio for orden in ordenes], [inicio for inicio, _ in self.carrito.ocurrencias(4)])
+        self.assertEqual(UnidadReserva.objects.filter(orden__serie=serie).count(), 8)
+        self.assertEqual(CorresponsableOrden.objects.filter(orden__serie=serie, autorizador=self.maestro).count(), 4)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertFalse(Carrito.objects.filter(id=self.carrito.id).exists())
+
+        # la serie bloquea las unidades en cada ocurrencia
+        self.assertEqual(self.tripie.disponible(ordenes[2].inicio, ordenes[2].final).count(), 0)
+
+    def test_misma_unidad_cada_semana(self):
+        ocupada, libre = self.camaras
+        self.ocupar(ocupada, semana=2)
+
+        self.assertTrue(self.carrito.ordenar_serie(4))
+
+        camaras = UnidadReserva.objects.filter(orden__serie__isnull=False, unidad__articulo=self.camara)
+        self.assertEqual(set(camaras.values_list('unidad_id', flat=True)), {libre.id})
+
+    def test_conflicto_cancela_la_serie(self):
+        self.ocupar(self.tripie.unidades().get(), semana=3)
+
+        self.assertEqual(self.carrito.conflictos_serie(4), [(self.INICIO + timedelta(weeks=3), self.tripie.id)])
+        self.assertFalse(self.carrito.ordenar_serie(4))
+        self.assertFalse(SerieOrden.objects.exists())
+        self.assertEqual(Orden.objects.count(), 1)
+
+    def test_cancelar(self):
+        self.assertTrue(self.carrito.ordenar_serie(3))
+        serie = SerieOrden.objects.get()
+
+        serie.cancelar()
+
+        self.assertFalse(UnidadReserva.objects.filter(orden__serie=serie, bloqueante=True).exists())
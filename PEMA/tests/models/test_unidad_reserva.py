@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.timezone import make_aware
+
+from PEMA.checks import revisar_indice_de_reservas
+from PEMA.models import Prestatario, Articulo, Orden, Materia, EstadoOrden, UnidadReserva
+
+
+class TestUnidadReserva(TestCase):
+    @staticmethod
+    def generar_fechas(hora):
+        return make_aware(datetime(2024, 5, 24, 12 + hora))
+
+    def setUp(self):
+        self.prestatario = Prestatario.crear_usuario(id=0, username="<NAME>", password="<PASSWORD>")
+        self.materia = Materia.objects.create(nombre="Fotografia", year=2022, semestre=1)
+
+        self.articulo = Articulo.objects.create(nombre="Articulo 1", codigo="100")
+        self.unidad1, _ = self.articulo.crear_unidad(num_control="1", num_serie="1")
+        self.unidad2, _ = self.articulo.crear_unidad(num_control="2", num_serie="2")
+
+        self.orden = Orden.objects.create(prestatario=self.prestatario, materia=self.materia,
+                                          inicio=self.generar_fechas(0), final=self.generar_fechas(2))
+
+    def test_agregar_unidad(self):
+        self.orden.agregar_unidad(self.unidad1)
+
+        reserva = UnidadReserva.objects.get(orden=self.orden)
+        self.assertEqual(reserva.unidad, self.unidad1)
+        self.assertEqual(reserva.inicio, self.orden.inicio)
+        self.assertEqual(reserva.final, self.orden.final)
+        self.assertTrue(reserva.bloqueante)
+
+    def test_revisar_indice(self):
+        self.orden.agregar_unidad(self.unidad1)
+        self.assertEqual(revisar_indice_de_reservas(None, databases=['default']), [])
+
+        UnidadReserva.objects.all().delete()
+        self.assertEqual([error.id for error in revisar_indice_de_reservas(None, databases=['default'])],
+                         ['PEMA.W001'])
+        self.assertEqual(revisar_indice_de_reservas(None), [])
+
+    def test_agregar_desde_unidad(self):
+        self.unidad2.orden_set.add(self.orden)
+        self.assertTrue(UnidadReserva.objects.filter(orden=self.orden, unidad=self.unidad2).exists())
+
+    def test_quitar_unidad(self):
+        self.orden._unidades.add(self.unidad1, self.unidad2)
+        self.orden._unidades.remove(self.unidad1)
+        self.assertQuerysetEqual(UnidadReserva.objects.values_list('unidad', flat=True), [self.unidad2.id])
+
+        self.orden._unidades.clear()
+        self.assertFalse(UnidadReserva.objects.exists())
+
+    def test_cambio_orden(self):
+        self.orden.agregar_unidad(self.unidad1)
+
+        self.orden.final = self.generar_fechas(4)
+        self.orden.cancelar()
+
+        reserva = UnidadReserva.objects.get(orden=self.orden)
+        self.assertEqual(reserva.final, self.generar_fechas(4))
+        self.assertFalse(reserva.bloqueante)
+        self.assertIn(self.unidad1, self.articulo.disponible(self.generar_fechas(0), self.generar_fechas(2)))
+
+    def test_colisiones(self):
+        self.orden.agregar_unidad(self.unidad1)
+
+        self.assertTrue(UnidadReserva.objects.colisiones(self.generar_fechas(1), self.generar_fechas(3)).exists())
+        self.assertTrue(UnidadReserva.objects.colisiones(self.generar_fechas(-1), self.generar_fechas(3)).exists())
+        self.assertFalse(UnidadReserva.objects.colisiones(self.generar_fechas(2), self.generar_fechas(3)).exists())
+        self.assertFalse(UnidadReserva.objects.colisiones(self.generar_fechas(-2), self.generar_fechas(0)).exists())
+
+    def test_reconstruir_reservas(self):
+        self.orden._unidades.add(self.unidad1, self.unidad2)
+        Orden.objects.filter(pk=self.orden.pk).update(estado=EstadoOrden.DEVUELTA)
+        UnidadReserva.objects.all().delete()
+
+        call_command('reconstruir_reservas', lote=1, stdout=StringIO())
+
+        self.assertEqual(UnidadReserva.objects.filter(orden=self.orden, bloqueante=False).count(), 2)
+
+    def test_margen(self):
+        self.articulo.margen_posterior = timedelta(minutes=30)
+        self.articulo.margen_previo = timedelta(minutes=30)
+        self.articulo.save()
+        self.orden.agregar_unidad(self.unidad1)
+
+        # un préstamo inmediatamente después ya no es compatible
+        self.assertTrue(UnidadReserva.objects.colisiones(self.generar_fechas(2), self.generar_fechas(3)).exists())
+        self.assertFalse(UnidadReserva.objects.colisiones(self.generar_fechas(3), self.generar_fechas(4)).exists())
+        self.assertFalse(UnidadReserva.objects.colisiones(self.generar_fechas(-2), self.generar_fechas(-1)).exists())
+        self.assertEqual(self.articulo.disponible(self.generar_fechas(2), self.generar_fechas(3)).count(), 1)
+
+        # el margen se conserva al cambiar las fechas de la orden
+        self.orden.final = self.generar_fechas(3)
+        self.orden.save()
+        reserva = UnidadReserva.objects.get(orden=self.orden)
+        self.assertEqual(reserva.final_con_margen, self.generar_fechas(4))
+
+    def test_cambio_margen(self):
+        self.orden.agregar_unidad(self.unidad1)
+        self.assertFalse(UnidadReserva.objects.colisiones(self.generar_fechas(2), self.generar_fechas(3)).exists())
+
+        self.articulo.margen_posterior = timedelta(hours=1)
+        self.articulo.save()
+
+        reserva = UnidadReserva.objects.get(orden=self.orden)
+        self.assertEqual((reserva.inicio_con_margen, reserva.final_con_margen),
+                         (self.generar_fechas(-1), self.generar_fechas(3)))
+        self.assertTrue(UnidadReserva.objects.colisiones(self.generar_fechas(2), self.generar_fechas(3)).exists())
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from django.test import TestCase
+from django.utils.timezone import make_aware
+
+from PEMA.asignacion import elegir_unidades
+from PEMA.models import Prestatario, Materia, Articulo, Orden, EstadoOrden
+
+
+class TestEstrategiasAsignacion(TestCase):
+    def setUp(self):
+        self.user = Prestatario.crear_usuario(username="1234567", password="password")
+        self.materia = Materia.objects.create(nombre="fotografia", year=2022, semestre=1)
+        self.articulo = Articulo.objects.create(nombre="Camara", codigo="100")
+        self.unidades = [self.articulo.crear_unidad(f"{i}", f"{i}")[0] for i in range(3)]
+
+        # La unidad 0 se prestó mucho tiempo hace poco; la unidad 1, poco tiempo hace más.
+        self.prestar(self.unidades[0], datetime(2024, 3, 10, 9), datetime(2024, 3, 14, 9))
+        self.prestar(self.unidades[1], datetime(2024, 3, 4, 9), datetime(2024, 3, 4, 12))
+
+        # Las órdenes canceladas no cuentan como préstamo.
+        self.prestar(self.unidades[2], datetime(2024, 3, 1, 9), datetime(2024, 3, 30, 9), EstadoOrden.CANCELADA)
+
+    def prestar(self, unidad, inicio, final, estado=EstadoOrden.DEVUELTA):
+        orden = Orden.objects.create(prestatario=self.user, materia=self.materia, estado=estado,
+                                     inicio=make_aware(inicio), final=make_aware(final))
+        orden.agregar_unidad(unidad)
+
+    def ids(self, *indices):
+        return [self.unidades[i].id for i in indices]
+
+    def test_menos_reciente(self):
+        self.assertEqual(elegir_unidades(self.articulo.unidades(), 3, 'menos_reciente'), self.ids(2, 1, 0))
+
+    def test_menor_uso(self):
+        self.prestar(self.unidades[1], datetime(2024, 3, 20, 9), datetime(2024, 3, 20, 12))
+        self.assertEqual(elegir_unidades(self.articulo.unidades(), 3, 'menor_uso'), self.ids(2, 1, 0))
+
+    def test_aleatoria(self):
+        elegidas = elegir_unidades(self.articulo.unidades(), 2, 'aleatoria')
+        self.assertEqual(len(elegidas), 2)
+        self.assertTrue(set(elegidas) <= set(self.ids(0, 1, 2)))
@@ -0,0 +1,541 @@
+import csv
+import random
+from datetime import date, datetime, time, timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.timezone import make_aware
+
+from PEMA.availability import IndiceArticulo, buscar_ventanas, cache_disponibilidad, horarios_permitidos, motor, \
+    reporte_capacidad, traslapes_por_unidad
+from PEMA.models import Prestatario, Articulo, Carrito, Orden, Materia, EstadoOrden, ListaEspera, Unidad, UnidadReserva
+
+
+@override_settings(DISPONIBILIDAD_EN_MEMORIA=True)
+class TestMotorDisponibilidad(TestCase):
+    INICIO = make_aware(datetime(2024, 5, 20, 9))
+
+    def setUp(self):
+        motor.invalidar()
+
+        self.prestatario = Prestatario.crear_usuario(id=0, username="<NAME>", password="<PASSWORD>")
+        self.materia = Materia.objects.create(nombre="Fotografia", year=2022, semestre=1)
+
+        self.articulo = Articulo.objects.create(nombre="Articulo 1", codigo="100")
+        self.unidades = [self.articulo.crear_unidad(num_control=str(i), num_serie=str(i))[0] for i in range(6)]
+
+    def tearDown(self):
+        motor.invalidar()
+
+    def crear_orden(self, inicio, horas, estado=EstadoOrden.RESERVADA):
+        return Orden.objects.create(prestatario=self.prestatario, materia=self.materia, estado=estado,
+                                    inicio=self.INICIO + timedelta(hours=inicio),
+                                    final=self.INICIO + timedelta(hours=inicio + horas))
+
+    def assertIgualSql(self, inicio, final):
+        memoria = set(self.articulo.disponible(inicio, final).values_list('id', flat=True))
+        sql = set(self.articulo.disponible_sql(inicio, final).values_list('id', flat=True))
+        self.assertEqual(memoria, sql, msg=f"{inicio} - {final}")
+
+    def test_igual_que_sql(self):
+        aleatorio = random.Random(7)
+        estados = [EstadoOrden.RESERVADA, EstadoOrden.APROBADA, EstadoOrden.CANCELADA, EstadoOrden.DEVUELTA]
+        for _ in range(40):
+            orden = self.crear_orden(aleatorio.randrange(0, 200), aleatorio.choice([1, 2, 4, 24, 96]),
+                                     aleatorio.choice(estados))
+            orden._unidades.add(*aleatorio.sample(self.unidades, aleatorio.randint(1, 3)))
+
+        for _ in range(100):
+            inicio = self.INICIO + timedelta(hours=aleatorio.randrange(-10, 220))
+            self.assertIgualSql(inicio, inicio + timedelta(hours=aleatorio.choice([1, 3, 8, 48])))
+
+    def test_igual_que_sql_con_margen(self):
+        self.articulo.margen_previo = timedelta(minutes=30)
+        self.articulo.margen_posterior = timedelta(hours=1)
+        self.articulo.save()
+        self.test_igual_que_sql()
+
+    def test_actualizacion_incremental(self):
+        inicio, final = self.INICIO, self.INICIO + timedelta(hours=2)
+        self.assertEqual(self.articulo.disponible(inicio, final).count(), 6)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            orden = self.crear_orden(0, 2)
+            orden._unidades.add(self.unidades[0], self.unidades[1])
+        self.assertEqual(self.articulo.disponible(inicio, final).count(), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            orden._unidades.remove(self.unidades[0])
+        self.assertEqual(self.articulo.disponible(inicio, final).count(), 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            orden.cancelar()
+        self.assertEqual(self.articulo.disponible(inicio, final).count(), 6)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.unidades[2].estado = Unidad.Estado.INACTIVO
+            self.unidades[2].save()
+        self.assertEqual(self.articulo.disponible(inicio, final).count(), 5)
+        self.assertIgualSql(inicio, final)
+
+    def test_quitar_orden(self):
+        horas = [self.INICIO + timedelta(hours=i) for i in range(6)]
+        indice = IndiceArticulo([1, 2, 3], [(horas[0], horas[2], 1, 10), (horas[1], horas[3], 2, 20)])
+        indice.agregar(horas[1], horas[2], 3, 10)
+        indice.agregar(horas[4], horas[5], 1, 30)
+
+        indice.quitar_orden(10)
+        indice.quitar_orden(40)
+
+        self.assertEqual(indice.intervalos, [(horas[1], horas[3], 2, 20), (horas[4], horas[5], 1, 30)])
+        self.assertEqual(indice.disponibles(horas[0], horas[2]), {1, 3})
+
+    def test_sin_confirmar(self):
+        inicio, final = self.INICIO, self.INICIO + timedelta(hours=2)
+        self.assertEqual(self.articulo.disponible(inicio, final).count(), 6)
+
+        # los cambios de una transacción que no se confirma no llegan al motor
+        with self.captureOnCommitCallbacks(execute=False):
+            orden = self.crear_orden(0, 2)
+            orden._unidades.add(self.unidades[0])
+        self.assertEqual(self.articulo.disponible(inicio, final).count(), 6)
+
+    def test_apartado_expirado(self):
+        inicio, final = self.INICIO, self.INICIO + timedelta(hours=2)
+        carrito = Carrito.objects.create(prestatario=self.prestatario, materia=self.materia, inicio=inicio, final=final)
+        carrito.apartar(self.articulo, 1)
+        self.assertEqual(self.articulo.disponible(inicio, final).count(), 5)
+
+        # el apartado expira sin que liberar_expirados lo elimine
+        with mock.patch('django.utils.timezone.now', return_value=carrito.apartados.get().expira):
+            self.assertEqual(self.articulo.disponible(inicio, final).count(), 6)
+
+
+
+@override_settings(DISPONIBILIDAD_CACHE=True, CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-disponibilidad'}
+})
+class TestCacheDisponibilidad(TestCase):
+    INICIO = make_aware(datetime(2024, 5, 20, 9))
+    FINAL = make_aware(datetime(2024, 5, 20, 11))
+
+    def setUp(self):
+        cache_disponibilidad._cache().clear()
+
+        self.prestatario = Prestatario.crear_usuario(id=0, username="<NAME>", password="<PASSWORD>")
+        self.materia = Materia.objects.create(nombre="Fotografia", year=2022, semestre=1)
+
+        self.articulo = Articulo.objects.create(nombre="Articulo 1", codigo="100")
+        self.otro = Articulo.objects.create(nombre="Articulo 2", codigo="200")
+        self.unidades = [self.articulo.crear_unidad(num_control=str(i), num_serie=str(i))[0] for i in range(2)]
+        self.otro.crear_unidad(num_control="otro", num_serie="otro")
+
+    def disponibles(self, articulo=None):
+        return (articulo or self.articulo).disponible(self.INICIO, self.FINAL).count()
+
+    def test_aciertos_y_fallos(self):
+        self.assertEqual(self.disponibles(), 2)
+        self.assertEqual(self.disponibles(), 2)
+        self.assertEqual(cache_disponibilidad.estadisticas(), {'aciertos': 1, 'fallos': 1})
+
+        articulos = Articulo.objects.filter(id__in=[self.articulo.id, self.otro.id])
+        self.assertEqual(articulos.disponibilidad(self.INICIO, self.FINAL), {self.articulo.id: 2, self.otro.id: 1})
+        self.assertEqual(cache_disponibilidad.estadisticas(), {'aciertos': 2, 'fallos': 2})
+
+        cache_disponibilidad.reiniciar_estadisticas()
+        self.assertEqual(cache_disponibilidad.estadisticas(), {'aciertos': 0, 'fallos': 0})
+
+    def test_invalidacion_por_orden(self):
+        self.assertEqual(self.disponibles(), 2)
+        self.assertEqual(self.disponibles(self.otro), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            orden = Orden.objects.create(prestatario=self.prestatario, materia=self.materia,
+                                         inicio=self.INICIO, final=self.FINAL)
+            orden.agregar_unidad(self.unidades[0])
+        self.assertEqual(self.disponibles(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            orden.estado = EstadoOrden.CANCELADA
+            orden.save()
+        self.assertEqual(self.disponibles(), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            orden.estado = EstadoOrden.RESERVADA
+            orden.save()
+        self.assertEqual(self.disponibles(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            orden.delete()
+        self.assertEqual(self.disponibles(), 2)
+
+        # el otro artículo nunca se invalidó
+        cache_disponibilidad.reiniciar_estadisticas()
+        self.assertEqual(self.disponibles(self.otro), 1)
+        self.assertEqual(cache_disponibilidad.estadisticas(), {'aciertos': 1, 'fallos': 0})
+
+    def test_invalidacion_por_unidad(self):
+        self.assertEqual(self.disponibles(), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.unidades[1].estado = Unidad.Estado.INACTIVO
+            self.unidades[1].save()
+        self.assertEqual(self.disponibles(), 1)
+
+    def test_cambios_revertidos(self):
+        self.assertEqual(self.disponibles(), 2)
+
+        with self.captureOnCommitCallbacks(execute=False):
+            orden = Orden.objects.create(prestatario=self.prestatario, materia=self.materia,
+                                         inicio=self.INICIO, final=self.FINAL)
+            orden._unidades.add(*self.unidades)
+            orden._unidades.clear()
+
+        cache_disponibilidad.reiniciar_estadisticas()
+        self.assertEqual(self.disponibles(), 2)
+        self.assertEqual(cache_disponibilidad.estadisticas(), {'aciertos': 1, 'fallos': 0})
+
+    def test_apartado_expirado(self):
+        carrito = Carrito.objects.create(prestatario=self.prestatario, materia=self.materia,
+                                         inicio=self.INICIO, final=self.FINAL)
+        carrito.apartar(self.articulo, 1)
+        carrito.apartados.update(expira=timezone.now() + timedelta(minutes=1))
+        duracion = cache_disponibilidad._duraciones([self.articulo.id], self.INICIO, self.FINAL)[self.articulo.id]
+        self.assertTrue(0 < duracion <= 60)
+
+        # un apartado a punto de expirar no deja guardar el resultado
+        carrito.apartados.update(expira=timezone.now() + timedelta(milliseconds=500))
+        self.assertEqual(self.disponibles(), 1)
+        carrito.apartados.update(expira=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.disponibles(), 2)
+
+    def test_catalogo_usa_el_cache(self):
+        self.materia.agregar_articulo(self.articulo)
+        self.materia.agregar_articulo(self.otro)
+        Carrito.objects.create(prestatario=self.prestatario, materia=self.materia, inicio=self.INICIO, final=self.FINAL)
+        self.client.login(username="<NAME>", password="<PASSWORD>")
+
+        self.client.get(reverse('catalogo'))
+        cache_disponibilidad.reiniciar_estadisticas()
+        response = self.client.get(reverse('catalogo'))
+
+        self.assertEqual([(articulo, articulo.num_unidades) for articulo in response.context['articulos']],
+                         [(self.articulo, 2), (self.otro, 1)])
+        self.assertEqual(cache_disponibilidad.estadisticas(), {'aciertos': 2, 'fallos': 0})
+
+@override_settings(DISPONIBILIDAD_EN_MEMORIA=True)
+class TestMatrizDisponibilidad(TestCase):
+
+    def setUp(self):
+        motor.invalidar()
+        self.inicio = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=3)
+
+        self.prestatario = Prestatario.crear_usuario(id=0, username="<NAME>", password="<PASSWORD>")
+        self.materia = Materia.objects.create(nombre="Fotografia", year=2022, semestre=1)
+
+        self.articulos = [Articulo.objects.create(nombre=f"Articulo {i}", codigo=str(i)) for i in range(3)]
+        self.unidades = [
+            articulo.crear_unidad(num_control=f"{articulo.id}-{i}", num_serie=str(i))[0]
+            for articulo in self.articulos for i in range(4)
+        ]
+
+    def tearDown(self):
+        motor.invalidar()
+
+    def crear_orden(self, bloque, bloques, *unidades):
+        orden = Orden.objects.create(prestatario=self.prestatario, materia=self.materia,
+                                     inicio=self.inicio + timedelta(minutes=30 * bloque),
+                                     final=self.inicio + timedelta(minutes=30 * (bloque + bloques)))
+        orden._unidades.add(*unidades)
+        return orden
+
+    def test_igual_que_sql(self):
+        aleatorio = random.Random(11)
+        for _ in range(30):
+            self.crear_orden(aleatorio.randrange(0, 300), aleatorio.choice([2, 4, 8, 16, 48]),
+                             *aleatorio.sample(self.unidades, 2))
+
+        ids = [articulo.id for articulo in self.articulos]
+        motor.matriz()
+        for _ in range(100):
+            inicio = self.inicio + timedelta(minutes=30 * aleatorio.randrange(-4, 320))
+            final = inicio + timedelta(minutes=30 * aleatorio.choice([2, 6, 16, 48]))
+
+            with self.assertNumQueries(0):
+                conteo = motor.contar(ids, inicio, final)
+            for articulo in self.articulos:
+                self.assertEqual(conteo[articulo.id], articulo.disponible_sql(inicio, final).count())
+
+    def test_recalcula_solo_filas_afectadas(self):
+        articulo = self.articulos[0]
+        inicio, final = self.inicio, self.inicio + timedelta(hours=2)
+        matriz = motor.matriz()
+        self.assertEqual(matriz.libres(articulo.id, inicio, final), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            orden = self.crear_orden(1, 2, self.unidades[0], self.unidades[1])
+        self.assertIs(motor.matriz(), matriz)
+        self.assertEqual(matriz.libres(articulo.id, inicio, final), 2)
+        self.assertEqual(list(matriz.libres_por_bloque(articulo.id, inicio, final)), [4, 2, 2, 4])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            orden._unidades.remove(self.unidades[0])
+        self.assertEqual(matriz.libres(articulo.id, inicio, final), 3)
+        self.assertEqual(matriz.ordenes[orden.id], {self.unidades[1].id})
+        self.assertNotIn(self.unidades[0].id, matriz.ordenes_unidad)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            orden.cancelar()
+        self.assertEqual(matriz.libres(articulo.id, inicio, final), 4)
+        self.assertEqual(Articulo.objects.filter(id=articulo.id).disponibilidad(inicio, final), {articulo.id: 4})
+
+
+    def test_apartado_expirado(self):
+        articulo = self.articulos[0]
+        inicio, final = self.inicio, self.inicio + timedelta(hours=2)
+        carrito = Carrito.objects.create(prestatario=self.prestatario, materia=self.materia, inicio=inicio, final=final)
+        carrito.apartar(articulo, 1)
+        carrito.apartados.update(expira=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(motor.contar([articulo.id], inicio, final), {articulo.id: 3})
+
+        # el apartado expira sin que liberar_expirados lo elimine
+        with mock.patch('django.utils.timezone.now', return_value=carrito.apartados.get().expira):
+            self.assertEqual(motor.contar([articulo.id], inicio, final), {articulo.id: 4})
+        self.assertEqual(motor.matriz().expiraciones, [])
+
+    def test_buscar_ventanas_en_matriz(self):
+        aleatorio = random.Random(5)
+        for _ in range(30):
+            self.crear_orden(aleatorio.randrange(0, 300), aleatorio.choice([2, 4, 8, 16, 48]),
+                             *aleatorio.sample(self.unidades, 3))
+
+        solicitud = {self.articulos[0].id: 3, self.articulos[1].id: 2}
+        desde = timezone.localdate()
+        motor.matriz()
+        for horas in [1, 3, 8]:
+            duracion = timedelta(hours=horas)
+            esperadas = [
+                (inicio, final) for inicio, final in horarios_permitidos(duracion, desde, 10)
+                if self.articulos[0].disponible_sql(inicio, final).count() >= 3
+                and self.articulos[1].disponible_sql(inicio, final).count() >= 2
+            ][:10]
+
+            with self.assertNumQueries(0):
+                ventanas = buscar_ventanas(solicitud, duracion, cantidad=10, desde=desde, dias=10)
+            self.assertTrue(esperadas)
+            self.assertEqual(ventanas, esperadas, msg=f"{horas} horas")
+
+
+    def test_buscar_ventanas_sin_apartados_del_carrito(self):
+        aleatorio = random.Random(7)
+        for _ in range(20):
+            self.crear_orden(aleatorio.randrange(0, 300), aleatorio.choice([2, 4, 8, 16]),
+                             *aleatorio.sample(self.unidades[4:], 2))
+
+        carrito = Carrito.objects.create(prestatario=self.prestatario, materia=self.materia,
+                                         inicio=self.inicio, final=self.inicio + timedelta(days=5))
+        carrito.agregar(self.articulos[0], 4)
+        self.assertEqual(carrito.apartar(self.articulos[0], 4), 4)
+
+        solicitud = {self.articulos[0].id: 2, self.articulos[1].id: 1}
+        desde = timezone.localdate()
+        duracion = timedelta(hours=2)
+        motor.matriz()
+        ventanas = buscar_ventanas(solicitud, duracion, cantidad=10, desde=desde, dias=10, carrito=carrito)
+        with self.settings(DISPONIBILIDAD_EN_MEMORIA=False):
+            esperadas = buscar_ventanas(solicitud, duracion, cantidad=10, desde=desde, dias=10, carrito=carrito)
+
+        self.assertTrue(esperadas)
+        self.assertEqual(ventanas, esperadas)
+        self.assertLess(ventanas[0], buscar_ventanas(solicitud, duracion, cantidad=1, desde=desde, dias=10)[0])
+
+
+class TestBuscarVentanas(TestCase):
+    # lunes
+    DESDE = date(2030, 3, 4)
+
+    def setUp(self):
+        self.prestatario = Prestatario.crear_usuario(id=0, username="<NAME>", password="<PASSWORD>")
+        self.materia = Materia.objects.create(nombre="Fotografia", year=2022, semestre=1)
+
+        self.camara = Articulo.objects.create(nombre="Camara", codigo="100")
+        self.tripie = Articulo.objects.create(nombre="Tripie", codigo="200")
+        self.camaras = [self.camara.crear_unidad(num_control=f"c{i}", num_serie=str(i))[0] for i in range(2)]
+        self.tripies = [self.tripie.crear_unidad(num_control=f"t{i}", num_serie=str(i))[0] for i in range(3)]
+
+    def fecha(self, dia, hora, minuto=0):
+        return make_aware(datetime.combine(self.DESDE + timedelta(days=dia), time(hora, minuto)))
+
+    def crear_orden(self, inicio, final, *unidades):
+        orden = Orden.objects.create(prestatario=self.prestatario, materia=self.materia, inicio=inicio, final=final)
+        orden._unidades.add(*unidades)
+        return orden
+
+    def test_primer_horario_libre(self):
+        self.crear_orden(self.fecha(0, 9), self.fecha(0, 12), *self.camaras)
+        self.crear_orden(self.fecha(0, 11), self.fecha(0, 13), *self.tripies[:2])
+
+        ventanas = buscar_ventanas({self.camara.id: 2, self.tripie.id: 2}, timedelta(hours=2), cantidad=3,
+                                   desde=self.DESDE, dias=5)
+
+        self.assertEqual(ventanas, [
+            (self.fecha(0, 13), self.fecha(0, 15)),
+            (self.fecha(0, 13, 30), self.fecha(0, 15, 30)),
+            (self.fecha(0, 14), self.fecha(0, 16)),
+        ])
+
+    def test_reglas_de_horario(self):
+        # préstamo de 24 horas iniciando en viernes termina en sábado
+        ventanas = buscar_ventanas({self.camara.id: 1}, timedelta(hours=24), cantidad=50,
+                                   desde=self.DESDE + timedelta(days=4), dias=3)
+        self.assertEqual(ventanas, [])
+
+        # el mismo día de hoy no cumple los tres días de anticipación
+        hoy = timezone.localdate()
+        ventanas = buscar_ventanas({self.camara.id: 1}, timedelta(hours=1), cantidad=50, desde=hoy, dias=3)
+        self.assertEqual(ventanas, [])
+
+    def test_sin_unidades_suficientes(self):
+        self.assertEqual(buscar_ventanas({self.camara.id: 3}, timedelta(hours=1), desde=self.DESDE, dias=5), [])
+
+    def test_apartados_del_carrito(self):
+        carrito = Carrito.objects.create(prestatario=self.prestatario, materia=self.materia,
+                                         inicio=self.fecha(0, 10), final=self.fecha(0, 12))
+        carrito.agregar(self.camara, 2)
+        self.assertEqual(carrito.apartar(self.camara, 2), 2)
+        self.crear_orden(self.fecha(0, 0), self.fecha(0, 10), *self.camaras)
+        self.crear_orden(self.fecha(0, 12), self.fecha(1, 0), *self.camaras)
+
+        solicitud = {self.camara.id: 2}
+        self.assertEqual(buscar_ventanas(solicitud, timedelta(hours=2), desde=self.DESDE, dias=1), [])
+        self.assertEqual(buscar_ventanas(solicitud, timedelta(hours=2), desde=self.DESDE, dias=1, carrito=carrito),
+                         [(self.fecha(0, 10), self.fecha(0, 12))])
+
+    def test_igual_que_consultar_cada_horario(self):
+        aleatorio = random.Random(3)
+        for _ in range(25):
+            inicio = self.fecha(aleatorio.randrange(0, 5), aleatorio.randrange(9, 20), aleatorio.choice([0, 30]))
+            final = inicio + timedelta(hours=aleatorio.choice([1, 2, 4, 8, 24]))
+            self.crear_orden(inicio, final, *aleatorio.sample(self.camaras + self.tripies, 2))
+
+        solicitud = {self.camara.id: 1, self.tripie.id: 2}
+        for horas in [1, 3, 8, 24]:
+            duracion = timedelta(hours=horas)
+            esperadas = [
+                (inicio, final) for inicio, final in horarios_permitidos(duracion, self.DESDE, 7)
+                if self.camara.disponible_sql(inicio, final).count() >= 1
+                and self.tripie.disponible_sql(inicio, final).count() >= 2
+            ][:10]
+
+            ventanas = buscar_ventanas(solicitud, duracion, cantidad=10, desde=self.DESDE, dias=7)
+            self.assertEqual(ventanas, esperadas, msg=f"{horas} horas")
+
+
+class TestReporteCapacidad(TestCase):
+    DESDE = make_aware(datetime(2030, 3, 4))
+
+    def setUp(self):
+        self.prestatario = Prestatario.crear_usuario(id=0, username="<NAME>", password="<PASSWORD>")
+        self.materia = Materia.objects.create(nombre="Fotografia", year=2022, semestre=1)
+
+        self.articulo = Articulo.objects.create(nombre="Camara", codigo="100")
+        self.unidades = [self.articulo.crear_unidad(num_control=str(i), num_serie=str(i))[0] for i in range(3)]
+
+    def crear_orden(self, inicio, horas, *unidades):
+        orden = Orden.objects.create(prestatario=self.prestatario, materia=self.materia,
+                                     inicio=self.DESDE + timedelta(hours=inicio),
+                                     final=self.DESDE + timedelta(hours=inicio + horas))
+        orden._unidades.add(*unidades)
+        return orden
+
+    def test_por_dia(self):
+        self.crear_orden(9, 2, self.unidades[0])
+        self.crear_orden(12, 2, self.unidades[0])
+        self.crear_orden(10, 30, self.unidades[1])
+        ListaEspera.objects.create(prestatario=self.prestatario, articulo=self.articulo, unidades=2,
+                                   inicio=self.DESDE + timedelta(hours=10), final=self.DESDE + timedelta(hours=11))
+        self.unidades[2].estado = Unidad.Estado.INACTIVO
+        self.unidades[2].save()
+
+        reporte = reporte_capacidad([self.articulo.id], self.DESDE, self.DESDE + timedelta(days=3))
+
+        self.assertEqual(reporte[self.articulo.id], [
+            (self.DESDE, 2, 2, 4),
+            (self.DESDE + timedelta(days=1), 2, 1, 1),
+            (self.DESDE + timedelta(days=2), 2, 0, 0),
+        ])
+
+    def test_igual_que_consultar_cada_bloque(self):
+        aleatorio = random.Random(5)
+        for _ in range(30):
+            self.crear_orden(aleatorio.randrange(0, 96), aleatorio.choice([1, 2, 5, 26]),
+                             aleatorio.choice(self.unidades))
+
+        bloque = timedelta(hours=1)
+        reporte = reporte_capacidad([self.articulo.id], self.DESDE, self.DESDE + timedelta(days=4), bloque)
+
+        reservas = list(UnidadReserva.objects.values_list('inicio_con_margen', 'final_con_margen'))
+        for inicio, activas, reservadas, demanda in reporte[self.articulo.id]:
+            final = inicio + bloque
+            instantes = [inicio] + [r_inicio for r_inicio, _ in reservas if inicio < r_inicio < final]
+            self.assertEqual(activas, 3)
+            self.assertEqual(reservadas, self.articulo.unidades().count() - self.articulo.disponible_sql(inicio, final).count())
+            self.assertEqual(demanda, max(sum(1 for r_inicio, r_final in reservas if r_inicio <= t < r_final)
+                                          for t in instantes), msg=str(inicio))
+
+
+
+class TestAuditarReservas(TestCase):
+    INICIO = make_aware(datetime(2024, 5, 20, 9))
+
+    def setUp(self):
+        self.prestatario = Prestatario.crear_usuario(id=0, username="<NAME>", password="<PASSWORD>")
+        self.materia = Materia.objects.create(nombre="Fotografia", year=2022, semestre=1)
+
+        self.articulo = Articulo.objects.create(nombre="Articulo 1", codigo="100")
+        self.unidad1, _ = self.articulo.crear_unidad(num_control="1", num_serie="1")
+        self.unidad2, _ = self.articulo.crear_unidad(num_control="2", num_serie="2")
+
+    def horas(self, horas):
+        return self.INICIO + timedelta(hours=horas)
+
+    def crear_orden(self, inicio, final, unidad, estado=EstadoOrden.RESERVADA):
+        orden = Orden.objects.create(prestatario=self.prestatario, materia=self.materia,
+                                     inicio=self.horas(inicio), final=self.horas(final), estado=estado)
+        # sin señales, como los datos editados antes de validar colisiones
+        Orden._unidades.through.objects.create(orden=orden, unidad=unidad)
+        return orden
+
+    def test_traslapes_por_unidad(self):
+        intervalos = [
+            (1, 10, self.horas(0), self.horas(4)),
+            (1, 11, self.horas(1), self.horas(2)),
+            (1, 12, self.horas(3), self.horas(5)),
+            (1, 13, self.horas(5), self.horas(6)),
+            (2, 14, self.horas(1), self.horas(2)),
+        ]
+
+        self.assertEqual(list(traslapes_por_unidad(intervalos)), [
+            (1, 10, 11, self.horas(1), self.horas(2)),
+            (1, 10, 12, self.horas(3), self.horas(4)),
+        ])
+
+    def test_comando(self):
+        primera = self.crear_orden(0, 3, self.unidad1)
+        segunda = self.crear_orden(2, 4, self.unidad1, estado=EstadoOrden.ENTREGADA)
+        self.crear_orden(1, 2, self.unidad1, estado=EstadoOrden.CANCELADA)
+        self.crear_orden(4, 5, self.unidad1)
+        self.crear_orden(0, 3, self.unidad2)
+
+        salida = StringIO()
+        call_command('auditar_reservas', csv='-', lote=2, stdout=salida, stderr=StringIO())
+
+        filas = list(csv.reader(StringIO(salida.getvalue())))
+        self.assertEqual(filas[1:], [
+            [str(self.unidad1.id), str(primera.id), str(segunda.id),
+             self.horas(2).isoformat(), self.horas(3).isoformat()],
+        ])
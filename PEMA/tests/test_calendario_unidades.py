@@ -0,0 +1,88 @@
+from datetime import date, datetime, timedelta
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.timezone import make_aware
+
+from PEMA.models import Prestatario, Almacen, Materia, Articulo, Orden, EstadoOrden
+
+
+class CalendarioUnidadesViewTestCase(TestCase):
+    PASSWORD = 'password'
+    # lunes
+    LUNES = date(2030, 3, 4)
+
+    def setUp(self):
+        self.prestatario = Prestatario.crear_usuario(username='1234567', password=self.PASSWORD)
+        self.almacen = Almacen.crear_usuario(username='almacen', password=self.PASSWORD)
+        self.materia = Materia.objects.create(nombre='Cinematografia', year=2022, semestre=1)
+
+        self.camara = Articulo.objects.create(nombre="Camara", codigo="100")
+        self.tripie = Articulo.objects.create(nombre="Tripie", codigo="200")
+        self.unidad, _ = self.camara.crear_unidad(num_control="A1", num_serie="1")
+        self.camara.crear_unidad(num_control="A2", num_serie="2")
+        self.tripie.crear_unidad(num_control="A1", num_serie="9")
+
+        self.url = reverse('calendario_unidades_json')
+        self.client.login(username='almacen', password=self.PASSWORD)
+
+    def crear_orden(self, dia, hora, horas, estado=EstadoOrden.RESERVADA, nombre='Practica'):
+        inicio = make_aware(datetime.combine(self.LUNES + timedelta(days=dia), datetime.min.time())) \
+                 + timedelta(hours=hora)
+        orden = Orden.objects.create(prestatario=self.prestatario, materia=self.materia, nombre=nombre,
+                                     inicio=inicio, final=inicio + timedelta(hours=horas), estado=estado)
+        orden.agregar_unidad(self.unidad)
+        return orden
+
+    def test_semana(self):
+        semana = self.crear_orden(2, 10, 4, nombre='Semana')
+        self.crear_orden(6, 22, 4, nombre='Cruza a la siguiente')
+        self.crear_orden(3, 10, 2, estado=EstadoOrden.CANCELADA)
+        self.crear_orden(9, 10, 2)
+        self.crear_orden(-400, 10, 2, estado=EstadoOrden.DEVUELTA)
+
+        response = self.client.get(self.url, {'articulo': self.camara.id, 'desde': '2030-03-06'})
+        self.assertEqual(response.status_code, 200)
+
+        datos = response.json()
+        self.assertEqual(datos['anterior'], '2030-02-25')
+        self.assertEqual(datos['siguiente'], '2030-03-11')
+        self.assertEqual([unidad['num_control'] for unidad in datos['unidades']], ['A1', 'A2'])
+
+        reservas = datos['unidades'][0]['reservas']
+        self.assertEqual([reserva['nombre'] for reserva in reservas], ['Semana', 'Cruza a la siguiente'])
+        self.assertEqual(reservas[0]['orden'], semana.id)
+        self.assertEqual(datos['unidades'][1]['reservas'], [])
+
+    def test_dia_por_num_control(self):
+        self.crear_orden(0, 10, 2, nombre='Lunes')
+        self.crear_orden(1, 10, 2, nombre='Martes')
+
+        with self.assertNumQueries(5):
+            # sesión, usuario, grupos y dos consultas del calendario
+            response = self.client.get(self.url, {'num_control': 'A1', 'desde': '2030-03-05', 'vista': 'dia'})
+
+        datos = response.json()
+        self.assertEqual(datos['siguiente'], '2030-03-06')
+        self.assertEqual([unidad['articulo'] for unidad in datos['unidades']], ['Camara', 'Tripie'])
+        self.assertEqual([reserva['nombre'] for reserva in datos['unidades'][0]['reservas']], ['Martes'])
+
+    def test_requiere_unidades(self):
+        response = self.client.get(self.url, {'desde': '2030-03-05'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_solo_almacen(self):
+        self.client.login(username='1234567', password=self.PASSWORD)
+        response = self.client.get(self.url, {'articulo': self.camara.id})
+        self.assertEqual(response.status_code, 403)
+
+    def test_cuadricula(self):
+        self.crear_orden(2, 10, 4, nombre='Semana')
+
+        response = self.client.get(reverse('calendario_unidades'), {'articulo': self.camara.id, 'desde': '2030-03-04'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['columnas']), 7)
+        _, celdas = response.context['filas'][0]
+        self.assertEqual([len(reservas) for reservas in celdas], [0, 0, 1, 0, 0, 0, 0])
+        self.assertContains(response, 'Semana')
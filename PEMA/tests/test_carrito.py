@@ -0,0 +1,189 @@
+from datetime import date, datetime, time, timedelta
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.timezone import make_aware
+
+from PEMA.models import Prestatario, Materia, Articulo, Carrito, Orden, Categoria, Kit, ListaEspera
+
+
+class CarritoViewTestCase(TestCase):
+    USERNAME = '1234567'
+    PASSWORD = 'password'
+
+    # lunes
+    DIA = date(2030, 3, 4)
+
+    def setUp(self):
+        self.user = Prestatario.crear_usuario(username=self.USERNAME, password=self.PASSWORD)
+        self.materia = Materia.objects.create(nombre='Cinematografia', year=2022, semestre=1)
+
+        self.articulo = Articulo.objects.create(nombre="Camara", codigo="100")
+        self.unidad, _ = self.articulo.crear_unidad(num_control="1", num_serie="1")
+        self.materia.agregar_articulo(self.articulo)
+
+        self.carrito = Carrito.objects.create(prestatario=self.user, materia=self.materia,
+                                              inicio=self.fecha(10), final=self.fecha(12))
+        self.carrito.agregar(self.articulo, 1)
+
+        self.client.login(username=self.USERNAME, password=self.PASSWORD)
+
+    def fecha(self, hora, minuto=0):
+        return make_aware(datetime.combine(self.DIA, time(hora, minuto)))
+
+    def test_sugerir_horarios(self):
+        response = self.client.get(reverse('carrito'))
+        self.assertEqual(response.context['ventanas'], [])
+
+        orden = Orden.objects.create(prestatario=self.user, materia=self.materia,
+                                     inicio=self.fecha(9), final=self.fecha(13))
+        orden.agregar_unidad(self.unidad)
+
+        response = self.client.get(reverse('carrito'))
+        self.assertEqual(response.context['ventanas'][0], (self.fecha(13), self.fecha(15)))
+
+    def test_reprogramar(self):
+        response = self.client.post(reverse('carrito_accion', kwargs={'accion': 'reprogramar'}),
+                                    {'inicio': self.fecha(13).isoformat()})
+        self.assertRedirects(response, reverse('carrito'))
+
+        self.carrito.refresh_from_db()
+        self.assertEqual(self.carrito.inicio, self.fecha(13))
+        self.assertEqual(self.carrito.final, self.fecha(15))
+
+    def test_reprogramar_horario_invalido(self):
+        sabado = make_aware(datetime.combine(self.DIA + timedelta(days=5), time(10)))
+        self.client.post(reverse('carrito_accion', kwargs={'accion': 'reprogramar'}), {'inicio': sabado.isoformat()})
+
+        self.carrito.refresh_from_db()
+        self.assertEqual(self.carrito.inicio, self.fecha(10))
+
+    def test_sustituir_articulo(self):
+        camaras = Categoria.objects.create(nombre='Camaras')
+        camaras.agregar(self.articulo)
+        sustituto = Articulo.objects.create(nombre="Camara 2", codigo="101")
+        sustituto.crear_unidad(num_control="2", num_serie="2")
+        camaras.agregar(sustituto)
+        self.materia.agregar_articulo(sustituto)
+
+        orden = Orden.objects.create(prestatario=self.user, materia=self.materia,
+                                     inicio=self.fecha(9), final=self.fecha(13))
+        orden.agregar_unidad(self.unidad)
+
+        response = self.client.get(reverse('carrito'))
+        self.assertEqual(response.context['articulos_carrito'][0].sustitutos, [sustituto])
+
+        response = self.client.get(reverse('catalogo'))
+        self.assertEqual(response.context['sustitutos'], [(self.articulo, [sustituto])])
+
+        response = self.client.post(reverse('agregar_al_carrito', kwargs={'articulo_id': sustituto.id}),
+                                    {'cantidad': 1, 'reemplaza': self.articulo.id})
+        self.assertRedirects(response, reverse('carrito'))
+        self.assertEqual(list(self.carrito.articulos()), [sustituto])
+
+    def test_agregar_aparta_unidades(self):
+        otro = Articulo.objects.create(nombre="Tripie", codigo="200")
+        unidad, _ = otro.crear_unidad(num_control="3", num_serie="3")
+        self.materia.agregar_articulo(otro)
+
+        self.client.post(reverse('agregar_al_carrito', kwargs={'articulo_id': otro.id}), {'cantidad': 1})
+
+        apartado = self.carrito.apartados.get()
+        self.assertEqual(apartado.unidad, unidad)
+        self.assertEqual((apartado.inicio, apartado.final), (self.carrito.inicio, self.carrito.final))
+        self.assertIsNotNone(apartado.expira)
+
+        self.client.get(reverse('eliminar_del_carrito', kwargs={'articulo_id': otro.id}))
+        self.assertFalse(self.carrito.apartados.exists())
+
+    def test_catalogo_muestra_oferta(self):
+        otro = Prestatario.crear_usuario(username='7654321', password=self.PASSWORD)
+        orden = Orden.objects.create(prestatario=otro, materia=self.materia,
+                                     inicio=self.fecha(9), final=self.fecha(13))
+        orden.agregar_unidad(self.unidad)
+        entrada = self.carrito.esperar(self.articulo)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            orden.cancelar()
+        entrada.refresh_from_db()
+        self.assertEqual(entrada.estado, ListaEspera.Estado.OFRECIDA)
+
+        response = self.client.get(reverse('catalogo'))
+        self.assertEqual(response.context['articulos'], [self.articulo])
+
+        self.client.post(reverse('agregar_al_carrito', kwargs={'articulo_id': self.articulo.id}), {'cantidad': 1})
+        self.assertEqual(self.carrito.apartados.get().unidad, self.unidad)
+
+        entrada.refresh_from_db()
+        self.assertEqual(entrada.estado, ListaEspera.Estado.ATENDIDA)
+
+    def test_articulo_json(self):
+        otro = Articulo.objects.create(nombre="Tripie", codigo="200")
+        otro.crear_unidad(num_control="3", num_serie="3")
+        otro.crear_unidad(num_control="4", num_serie="4")
+        otro.crear_unidad(num_control="5", num_serie="5")
+        self.materia.agregar_articulo(otro)
+
+        url = reverse('carrito_articulo', kwargs={'articulo_id': otro.id, 'accion': 'agregar'})
+        self.client.post(url)
+        datos = self.client.post(url, {'cantidad': 1}).json()
+        self.assertEqual(datos['linea'], {'articulo': otro.id, 'nombre': 'Tripie', 'unidades': 2, 'apartadas': 2})
+        self.assertEqual(datos['carrito'], {'articulos': 2, 'unidades': 3})
+        self.assertEqual(datos['disponibles'], 1)
+
+        url = reverse('carrito_articulo', kwargs={'articulo_id': otro.id, 'accion': 'actualizar'})
+        datos = self.client.post(url, {'cantidad': 5}).json()
+        self.assertEqual(datos['linea']['apartadas'], 3)
+        self.assertIn('aviso', datos)
+        self.assertEqual(datos['disponibles'], 0)
+
+        url = reverse('carrito_articulo', kwargs={'articulo_id': otro.id, 'accion': 'eliminar'})
+        datos = self.client.post(url).json()
+        self.assertIsNone(datos['linea'])
+        self.assertEqual(datos['carrito'], {'articulos': 1, 'unidades': 1})
+        self.assertEqual(datos['disponibles'], 3)
+        self.assertFalse(self.carrito.apartados.filter(unidad__articulo=otro).exists())
+
+    def test_cambiar_cantidad_conserva_apartados(self):
+        self.carrito.apartar(self.articulo, 1)
+        url = reverse('carrito_articulo', kwargs={'articulo_id': self.articulo.id, 'accion': 'actualizar'})
+
+        # si no se puede apartar de nuevo, la unidad sigue apartada para el carrito
+        with mock.patch('PEMA.models.elegir_unidades', side_effect=OperationalError):
+            self.client.post(url, {'cantidad': 2})
+
+        self.assertEqual(self.carrito.apartados.get().unidad, self.unidad)
+        self.assertEqual(self.carrito.solicitud(), {self.articulo.id: 2})
+
+    def test_articulo_json_cantidad_invalida(self):
+        url = reverse('carrito_articulo', kwargs={'articulo_id': self.articulo.id, 'accion': 'actualizar'})
+
+        self.assertEqual(self.client.post(url, {'cantidad': 'x'}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'cantidad': -1}).status_code, 400)
+        self.assertEqual(dict(self.carrito.articulos_carrito().values_list('articulo_id', 'unidades')),
+                         {self.articulo.id: 1})
+
+    def test_agregar_kit_cantidad_invalida(self):
+        kit = Kit.objects.create(nombre="Kit de camara")
+        kit.agregar(self.articulo, 1)
+        url = reverse('agregar_kit_al_carrito', kwargs={'kit_id': kit.id})
+
+        self.assertEqual(self.client.post(url, {'cantidad': 'x'}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'cantidad': 0}).status_code, 400)
+        self.assertEqual(dict(self.carrito.articulos_carrito().values_list('articulo_id', 'unidades')),
+                         {self.articulo.id: 1})
+
+        self.client.logout()
+        response = self.client.post(url, {'cantidad': 1})
+        self.assertRedirects(response, f"{reverse('login')}?next={url}", fetch_redirect_response=False)
+
+    def test_unidades_faltantes(self):
+        self.carrito.agregar(self.articulo, 1)
+
+        response = self.client.get(reverse('carrito'))
+
+        self.assertEqual([str(mensaje) for mensaje in response.context['messages']],
+                         ['Solo hay 1 de 2 unidades disponibles de Camara.'])
+        self.assertEqual(response.context['numero_unidades'], 2)
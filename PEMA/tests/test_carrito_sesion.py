@@ -0,0 +1,155 @@
+from datetime import date, datetime, time
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import make_aware
+
+from PEMA.checks import revisar_carrito_en_sesion
+from PEMA.models import Prestatario, Materia, Articulo, ArticuloCarrito, Carrito, ListaEspera, Orden, UnidadReserva
+
+
+@override_settings(CARRITO_EN_SESION=True, SESSION_ENGINE='django.contrib.sessions.backends.cache')
+class CarritoSesionViewTestCase(TestCase):
+    USERNAME = '1234567'
+    PASSWORD = 'password'
+
+    # lunes
+    DIA = date(2030, 3, 4)
+
+    def setUp(self):
+        self.user = Prestatario.crear_usuario(username=self.USERNAME, password=self.PASSWORD)
+        self.companero = Prestatario.crear_usuario(username='7654321', password=self.PASSWORD)
+        self.materia = Materia.objects.create(nombre='Cinematografia', year=2022, semestre=1)
+        self.materia.agregar_alumno(self.user)
+        self.materia.agregar_alumno(self.companero)
+
+        self.camara = Articulo.objects.create(nombre="Camara", codigo="100")
+        self.tripie = Articulo.objects.create(nombre="Tripie", codigo="200")
+        self.camara.crear_unidad(num_control="1", num_serie="1")
+        self.camara.crear_unidad(num_control="2", num_serie="2")
+        self.tripie.crear_unidad(num_control="1", num_serie="1")
+        self.materia.agregar_articulo(self.camara)
+        self.materia.agregar_articulo(self.tripie)
+
+        self.client.login(username=self.USERNAME, password=self.PASSWORD)
+        session = self.client.session
+        session['carrito'] = {
+            'nombre': 'Practica', 'lugar': 'CA', 'descripcion_lugar': 'Estudio', 'descripcion': 'Entrevista',
+            'materia': self.materia.pk, 'inicio': self.fecha(10).isoformat(), 'final': self.fecha(12).isoformat(),
+            'articulos': [], 'corresponsables': [],
+        }
+        session.save()
+
+    def fecha(self, hora):
+        return make_aware(datetime.combine(self.DIA, time(hora)))
+
+    def agregar(self, articulo, cantidad):
+        return self.client.post(reverse('agregar_al_carrito', kwargs={'articulo_id': articulo.id}),
+                                {'cantidad': cantidad})
+
+    def test_armar_sin_escribir_en_la_base_de_datos(self):
+        self.assertRedirects(self.agregar(self.camara, 2), reverse('catalogo'))
+        self.agregar(self.tripie, 1)
+        self.client.get(reverse('eliminar_del_carrito', kwargs={'articulo_id': self.tripie.id}))
+
+        self.assertEqual(self.client.session['carrito']['articulos'], [[self.camara.id, 2]])
+        self.assertFalse(Carrito.objects.exists())
+        self.assertFalse(ArticuloCarrito.objects.exists())
+        self.assertFalse(UnidadReserva.objects.exists())
+
+        response = self.client.get(reverse('carrito'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(linea.articulo, linea.unidades) for linea in response.context['articulos_carrito']],
+                         [(self.camara, 2)])
+        self.assertEqual(response.context['numero_unidades'], 2)
+
+    def test_catalogo(self):
+        self.agregar(self.camara, 1)
+
+        response = self.client.get(reverse('catalogo'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['carrito'].numero_total_unidades(), 1)
+
+    def test_ordenar(self):
+        self.agregar(self.camara, 2)
+        self.client.post(reverse('corresponsables'), {'corresponsables': [self.companero.id]})
+        self.assertEqual(self.client.session['carrito']['corresponsables'], [self.companero.id])
+
+        response = self.client.get(reverse('carrito_accion', kwargs={'accion': 'ordenar'}))
+
+        self.assertRedirects(response, reverse('historial_solicitudes'), fetch_redirect_response=False)
+        orden = Orden.objects.get()
+        self.assertEqual((orden.nombre, orden.inicio, orden.final), ('Practica', self.fecha(10), self.fecha(12)))
+        self.assertEqual(orden.unidades().count(), 2)
+        self.assertIn(self.companero, orden.corresponsables())
+        self.assertFalse(Carrito.objects.exists())
+        self.assertNotIn('carrito', self.client.session)
+
+    def test_ordenar_con_carrito_en_base_de_datos(self):
+        # carrito de antes de activar CARRITO_EN_SESION, con una cámara apartada
+        anterior = Carrito.objects.create(prestatario=self.user, materia=self.materia,
+                                          inicio=self.fecha(10), final=self.fecha(12))
+        anterior.agregar(self.camara, 1)
+        anterior.apartar(self.camara, 1)
+        self.agregar(self.camara, 2)
+
+        response = self.client.get(reverse('carrito_accion', kwargs={'accion': 'ordenar'}))
+
+        self.assertRedirects(response, reverse('historial_solicitudes'), fetch_redirect_response=False)
+        self.assertEqual(Orden.objects.get().unidades().count(), 2)
+        self.assertFalse(Carrito.objects.exists())
+        self.assertFalse(UnidadReserva.objects.filter(carrito__isnull=False).exists())
+
+    def test_ordenar_oferta(self):
+        orden = Orden.objects.create(prestatario=self.companero, materia=self.materia,
+                                     inicio=self.fecha(9), final=self.fecha(13))
+        orden.agregar_unidad(self.tripie.unidades().get())
+        entrada = ListaEspera.objects.create(prestatario=self.user, articulo=self.tripie,
+                                             inicio=self.fecha(10), final=self.fecha(12))
+        with self.captureOnCommitCallbacks(execute=True):
+            orden.cancelar()
+
+        self.assertIn(self.tripie, self.client.get(reverse('catalogo')).context['articulos'])
+        self.agregar(self.tripie, 1)
+        response = self.client.get(reverse('carrito_accion', kwargs={'accion': 'ordenar'}))
+
+        self.assertRedirects(response, reverse('historial_solicitudes'), fetch_redirect_response=False)
+        self.assertEqual(Orden.objects.get(prestatario=self.user).unidades().count(), 1)
+        entrada.refresh_from_db()
+        self.assertEqual(entrada.estado, ListaEspera.Estado.ATENDIDA)
+
+    def test_ordenar_sin_unidades(self):
+        self.agregar(self.tripie, 2)
+
+        response = self.client.get(reverse('carrito_accion', kwargs={'accion': 'ordenar'}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Orden.objects.exists())
+        self.assertFalse(Carrito.objects.exists())
+        self.assertIn('carrito', self.client.session)
+
+    def test_articulo_json(self):
+        url = reverse('carrito_articulo', kwargs={'articulo_id': self.camara.id, 'accion': 'agregar'})
+
+        datos = self.client.post(url).json()
+
+        self.assertEqual(datos['linea']['unidades'], 1)
+        self.assertEqual(datos['disponibles'], 2)
+        self.assertEqual(self.client.session['carrito']['articulos'], [[self.camara.id, 1]])
+        self.assertFalse(Carrito.objects.exists())
+
+
+class RevisarCarritoEnSesionTestCase(SimpleTestCase):
+
+    @override_settings(CARRITO_EN_SESION=True, SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_sesiones_en_base_de_datos(self):
+        self.assertEqual([error.id for error in revisar_carrito_en_sesion(None)], ['PEMA.E001'])
+
+    @override_settings(CARRITO_EN_SESION=True, SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_sesiones_en_cookies(self):
+        self.assertEqual(revisar_carrito_en_sesion(None), [])
+
+    @override_settings(CARRITO_EN_SESION=False, SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_carrito_en_base_de_datos(self):
+        self.assertEqual(revisar_carrito_en_sesion(None), [])
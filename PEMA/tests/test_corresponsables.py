@@ -0,0 +1,64 @@
+from datetime import datetime
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.timezone import make_aware
+
+from PEMA.models import Prestatario, Materia, Carrito
+
+
+class CorresponsablesViewTestCase(TestCase):
+    PASSWORD = 'password'
+
+    def setUp(self):
+        self.user = Prestatario.crear_usuario(username='1200001', password=self.PASSWORD, first_name='Ana')
+        self.materia = Materia.objects.create(nombre='Cinematografia', year=2022, semestre=1)
+        self.materia.agregar_alumno(self.user)
+
+        self.alumnos = [
+            Prestatario.crear_usuario(username=f'12{i:05d}', password=self.PASSWORD,
+                                      first_name=nombre, last_name=apellido)
+            for i, (nombre, apellido) in enumerate([('Andres', 'Lopez'), ('Beatriz', 'Anaya'), ('Carlos', 'Ruiz')],
+                                                   start=2)
+        ]
+        for alumno in self.alumnos:
+            self.materia.agregar_alumno(alumno)
+        Prestatario.crear_usuario(username='1200009', password=self.PASSWORD, first_name='Andrea')
+
+        self.carrito = Carrito.objects.create(prestatario=self.user, materia=self.materia,
+                                              inicio=make_aware(datetime(2030, 3, 4, 10)),
+                                              final=make_aware(datetime(2030, 3, 4, 12)))
+        self.client.login(username='1200001', password=self.PASSWORD)
+
+    def buscar(self, texto):
+        response = self.client.get(reverse('buscar_corresponsables'), {'q': texto})
+        return [resultado['username'] for resultado in response.json()['resultados']]
+
+    def test_buscar(self):
+        andres, beatriz, carlos = self.alumnos
+
+        # nombre o apellido, sin contar al dueño del carrito ni a alumnos de otras materias
+        self.assertEqual(self.buscar('an'), [andres.username, beatriz.username])
+        self.assertEqual(self.buscar('1200003'), [beatriz.username])
+        self.assertEqual(self.buscar('ruiz'), [carlos.username])
+        self.assertEqual(self.buscar(''), [])
+
+    def test_guardar(self):
+        andres, beatriz, carlos = self.alumnos
+        self.carrito.agregar_corresponsable(andres)
+        self.carrito.agregar_corresponsable(beatriz)
+
+        response = self.client.post(reverse('corresponsables'), {'corresponsables': [beatriz.id, carlos.id]})
+
+        self.assertRedirects(response, reverse('carrito'), fetch_redirect_response=False)
+        self.assertEqual(set(self.carrito.corresponsables()), {beatriz, carlos})
+
+    def test_formulario_solo_muestra_seleccionados(self):
+        andres, beatriz, carlos = self.alumnos
+        self.carrito.agregar_corresponsable(beatriz)
+
+        response = self.client.get(reverse('corresponsables'))
+
+        self.assertContains(response, beatriz.username)
+        self.assertNotContains(response, andres.username)
+        self.assertNotContains(response, carlos.username)
@@ -0,0 +1,71 @@
+import json
+from datetime import datetime, timedelta
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import make_aware
+
+from PEMA.availability import canal_disponibilidad
+from PEMA.models import Prestatario, Materia, Articulo, Carrito, Orden
+
+
+@override_settings(DISPONIBILIDAD_SSE_ESPERA=0.01)
+class DisponibilidadCatalogoViewTestCase(TestCase):
+    USERNAME = '1234567'
+    PASSWORD = 'password'
+    INICIO = make_aware(datetime(2030, 3, 4, 10))
+    FINAL = make_aware(datetime(2030, 3, 4, 12))
+
+    def setUp(self):
+        self.user = Prestatario.crear_usuario(username=self.USERNAME, password=self.PASSWORD)
+        self.materia = Materia.objects.create(nombre='Cinematografia', year=2022, semestre=1)
+
+        self.camara = Articulo.objects.create(nombre="Camara", codigo="100")
+        self.tripie = Articulo.objects.create(nombre="Tripie", codigo="200")
+        self.unidad, _ = self.camara.crear_unidad(num_control="1", num_serie="1")
+        self.camara.crear_unidad(num_control="2", num_serie="2")
+        self.tripie.crear_unidad(num_control="1", num_serie="1")
+        self.materia.agregar_articulo(self.camara)
+        self.materia.agregar_articulo(self.tripie)
+
+        Carrito.objects.create(prestatario=self.user, materia=self.materia, inicio=self.INICIO, final=self.FINAL)
+        self.client.login(username=self.USERNAME, password=self.PASSWORD)
+
+    def abrir(self):
+        response = self.client.get(reverse('catalogo_disponibilidad'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.addCleanup(response.close)
+
+        flujo = iter(response.streaming_content)
+        self.assertTrue(next(flujo).startswith(b'retry:'))
+        return response, flujo
+
+    def ordenar(self, inicio, final):
+        orden = Orden.objects.create(prestatario=self.user, materia=self.materia, inicio=inicio, final=final)
+        with self.captureOnCommitCallbacks(execute=True):
+            orden.agregar_unidad(self.unidad)
+        return orden
+
+    def test_envia_solo_conteos_cambiados(self):
+        _, flujo = self.abrir()
+
+        self.ordenar(self.INICIO, self.FINAL)
+
+        evento = next(flujo).decode()
+        self.assertTrue(evento.startswith('event: disponibilidad\n'))
+        self.assertEqual(json.loads(evento.split('data: ')[1]), {str(self.camara.id): 1})
+
+    def test_ignora_otros_horarios(self):
+        _, flujo = self.abrir()
+
+        self.ordenar(self.INICIO + timedelta(days=1), self.FINAL + timedelta(days=1))
+
+        self.assertEqual(next(flujo), b': keep-alive\n\n')
+
+    def test_cancela_suscripcion(self):
+        response, _ = self.abrir()
+        self.assertTrue(canal_disponibilidad.hay_suscripciones())
+
+        response.close()
+
+        self.assertFalse(canal_disponibilidad.hay_suscripciones())
@@ -0,0 +1,39 @@
+from datetime import date, datetime, time, timedelta
+
+from django.test import TestCase
+from django.utils.timezone import make_aware
+
+from PEMA.forms import FiltrosForm
+from PEMA.models import Materia, Ubicacion
+
+
+class FiltrosFormTestCase(TestCase):
+
+    def setUp(self):
+        self.materia = Materia.objects.create(nombre='Cinematografia', year=2022, semestre=1)
+        hoy = date.today()
+        # un lunes con al menos tres días de anticipación
+        self.lunes = hoy + timedelta(days=14 - hoy.weekday())
+
+    def form(self, inicio: date, hora: time, duracion: int) -> FiltrosForm:
+        return FiltrosForm({
+            'nombre': 'Practica', 'materia': self.materia.pk, 'lugar': Ubicacion.CAMPUS,
+            'descripcion': 'Entrevista', 'descripcion_lugar': 'Estudio',
+            'inicio': inicio.isoformat(), 'hora_inicio': str(hora), 'duracion': duracion,
+        })
+
+    def test_igual_que_reglas_de_horario(self):
+        for dia in [self.lunes, self.lunes + timedelta(days=4), self.lunes + timedelta(days=5), date.today()]:
+            for hora in [time(9), time(14, 30), time(20)]:
+                for duracion in [1, 8, 24, 72]:
+                    final = make_aware(datetime.combine(dia, hora) + timedelta(hours=duracion))
+                    permitido = FiltrosForm.inicio_permitido(dia) and FiltrosForm.final_permitido(final)
+                    self.assertEqual(self.form(dia, hora, duracion).is_valid(), permitido,
+                                     msg=f"{dia} {hora} {duracion}h")
+
+    def test_mensajes(self):
+        sabado = self.lunes + timedelta(days=5)
+        self.assertEqual(self.form(sabado, time(9), 1).errors['inicio'],
+                         ["Elige fecha de inicio de préstamo entre semana."])
+        self.assertEqual(self.form(self.lunes, time(20), 1).errors['__all__'],
+                         ["La fecha final del préstamo es fuera del horario de atención. Intente de nuevo."])
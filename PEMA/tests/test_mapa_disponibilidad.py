@@ -0,0 +1,93 @@
+from datetime import datetime, time, timedelta
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.timezone import make_aware
+
+from PEMA.models import Prestatario, Materia, Articulo, Carrito, Orden, UnidadReserva
+
+
+class MapaDisponibilidadViewTestCase(TestCase):
+    USERNAME = '1234567'
+    PASSWORD = 'password'
+
+    def setUp(self):
+        self.user = Prestatario.crear_usuario(username=self.USERNAME, password=self.PASSWORD)
+        self.materia = Materia.objects.create(nombre='Cinematografia', year=2022, semestre=1)
+        self.materia._alumnos.add(self.user)
+
+        self.articulo = Articulo.objects.create(nombre="Camara", codigo="100")
+        self.unidad, _ = self.articulo.crear_unidad(num_control="1", num_serie="1")
+        self.articulo.crear_unidad(num_control="2", num_serie="2")
+        self.materia.agregar_articulo(self.articulo)
+
+        self.url = f"{reverse('mapa_disponibilidad')}?materia={self.materia.pk}"
+        self.client.login(username=self.USERNAME, password=self.PASSWORD)
+
+    def fecha(self, dias, hora):
+        dia = timezone.localdate() + timedelta(days=dias)
+        return make_aware(datetime.combine(dia, time(hora)))
+
+    def test_mapa(self):
+        orden = Orden.objects.create(prestatario=self.user, materia=self.materia,
+                                     inicio=self.fecha(1, 10), final=self.fecha(1, 12))
+        orden.agregar_unidad(self.unidad)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+
+        datos = response.json()
+        self.assertEqual(datos['minutos_bloque'], 30)
+
+        articulo = datos['articulos'][0]
+        self.assertEqual(articulo['unidades'], 2)
+        self.assertEqual(len(articulo['libres']), 14 * 48)
+
+        bloque = 48 + 10 * 2
+        self.assertEqual(articulo['libres'][bloque - 1], 2)
+        self.assertEqual(articulo['libres'][bloque:bloque + 4], [1, 1, 1, 1])
+        self.assertEqual(articulo['libres'][bloque + 4], 2)
+
+    def test_get_condicional(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        orden = Orden.objects.create(prestatario=self.user, materia=self.materia,
+                                     inicio=self.fecha(1, 10), final=self.fecha(1, 12))
+        orden.agregar_unidad(self.unidad)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_get_condicional_articulos_de_la_materia(self):
+        etag = self.client.get(self.url)['ETag']
+
+        tripie = Articulo.objects.create(nombre="Tripie", codigo="200")
+        self.materia.agregar_articulo(tripie)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([articulo['nombre'] for articulo in response.json()['articulos']], ["Camara", "Tripie"])
+
+    def test_get_condicional_apartado_expirado(self):
+        carrito = Carrito.objects.create(prestatario=self.user, materia=self.materia,
+                                         inicio=self.fecha(1, 10), final=self.fecha(1, 12))
+        carrito.agregar(self.articulo, 1)
+        carrito.apartar(self.articulo, 1)
+        etag = self.client.get(self.url)['ETag']
+
+        # el apartado expira sin que se modifique ninguna fila
+        UnidadReserva.objects.filter(carrito=carrito).update(expira=timezone.now() - timedelta(seconds=1))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_materia_ajena(self):
+        self.materia._alumnos.remove(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,66 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.utils.timezone import make_aware
+
+from PEMA.models import Prestatario, Materia, Articulo, Carrito, Orden, UnidadReserva
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class OrdenarConcurrenteTestCase(TransactionTestCase):
+    """
+    Lanza cientos de compras simultáneas sobre artículos escasos y verifica que
+    ninguna unidad quede reservada dos veces en horarios que se traslapan.
+    """
+
+    COMPRAS = 200
+    HILOS = 16
+
+    def setUp(self):
+        self.materia = Materia.objects.create(nombre='Cinematografia', year=2022, semestre=1)
+
+        self.articulos = []
+        for i in range(3):
+            articulo = Articulo.objects.create(nombre=f"Articulo {i}", codigo=f"{i}")
+            for j in range(2):
+                articulo.crear_unidad(num_control=f"{i}-{j}", num_serie=f"{i}-{j}")
+            self.articulos.append(articulo)
+
+        dia = make_aware(datetime.combine(datetime(2030, 3, 4), time(9)))
+        self.carritos = []
+        for i in range(self.COMPRAS):
+            prestatario = Prestatario.crear_usuario(username=f"{i}", password='password')
+            inicio = dia + timedelta(hours=i % 4)
+            carrito = Carrito.objects.create(prestatario=prestatario, materia=self.materia,
+                                             inicio=inicio, final=inicio + timedelta(hours=2))
+            carrito.agregar(self.articulos[i % 3], 1)
+            carrito.agregar(self.articulos[(i + 1) % 3], 1)
+            self.carritos.append(carrito.id)
+
+    @staticmethod
+    def ordenar(carrito_id):
+        try:
+            return Carrito.objects.get(id=carrito_id).ordenar()
+        finally:
+            connection.close()
+
+    def test_sin_reservas_dobles(self):
+        with ThreadPoolExecutor(max_workers=self.HILOS) as executor:
+            resultados = list(executor.map(self.ordenar, self.carritos))
+
+        exitosas = resultados.count(True)
+        self.assertGreater(exitosas, 0)
+        self.assertEqual(Orden.objects.count(), exitosas)
+        self.assertEqual(Carrito.objects.count(), self.COMPRAS - exitosas)
+
+        reservas = list(UnidadReserva.objects.filter(bloqueante=True).order_by('unidad_id', 'inicio'))
+        for anterior, siguiente in zip(reservas, reservas[1:]):
+            if anterior.unidad_id == siguiente.unidad_id:
+                self.assertLessEqual(anterior.final, siguiente.inicio)
+
+        # Cada orden exitosa recibió exactamente una unidad de cada artículo del carrito.
+        por_orden = Counter(reserva.orden_id for reserva in reservas)
+        self.assertTrue(all(unidades == 2 for unidades in por_orden.values()))
@@ -6,15 +6,22 @@ from django.urls import path
 from .forms import UserLoginForm
 from .views import AgregarAlCarritoView
 from .views import AgregarCorresponsablesView
+from .views import AgregarKitAlCarritoView
+from .views import ArticuloCarritoJsonView
 from .views import AutorizacionSolicitudView
+from .views import BuscarCorresponsablesView
 from .views import CambiarEstadoOrdenView
+from .views import CalendarioUnidadesJsonView
+from .views import CalendarioUnidadesView
 from .views import CarritoView
 from .views import CatalogoView
+from .views import DisponibilidadCatalogoView
 from .views import DetallesArticuloView
 from .views import DetallesOrdenView
 from .views import EliminarDelCarritoView
 from .views import FiltrosView
 from .views import HistorialSolicitudesView
+from .views import MapaDisponibilidadView
 from .views import MenuView, ActualizarPerfilView
 from .views import SolicitudView
 from django.shortcuts import render
@@ -71,24 +78,54 @@ urlpatterns = [
         name='carrito_accion'
     ),
 
+    path(
+        route='carrito/articulos/<int:articulo_id>/<str:accion>',
+        view=ArticuloCarritoJsonView.as_view(),
+        name='carrito_articulo'
+    ),
+
     path(
         route='filtros',
         view=FiltrosView.as_view(),
         name='filtros'
     ),
 
+    path(
+        route='filtros/disponibilidad',
+        view=MapaDisponibilidadView.as_view(),
+        name='mapa_disponibilidad'
+    ),
+
     path(
         route='solicitud',
         view=SolicitudView.as_view(),
         name='solicitud'
     ),
 
+    path(
+        route='calendario_unidades',
+        view=CalendarioUnidadesView.as_view(),
+        name='calendario_unidades'
+    ),
+
+    path(
+        route='calendario_unidades/reservas',
+        view=CalendarioUnidadesJsonView.as_view(),
+        name='calendario_unidades_json'
+    ),
+
     path(
         route='catalogo',
         view=CatalogoView.as_view(),
         name='catalogo'
     ),
 
+    path(
+        route='catalogo/disponibilidad',
+        view=DisponibilidadCatalogoView.as_view(),
+        name='catalogo_disponibilidad'
+    ),
+
     path(
         route="historial_solicitudes",
         view=HistorialSolicitudesView.as_view(),
@@ -113,6 +150,12 @@ urlpatterns = [
         name='agregar_al_carrito'
     ),
 
+    path(
+        route='agregar_kit_al_carrito/<int:kit_id>/',
+        view=AgregarKitAlCarritoView.as_view(),
+        name='agregar_kit_al_carrito'
+    ),
+
     path(
         route='autorizacion_solicitudes/<int:id>/',
         view=AutorizacionSolicitudView.as_view(),
@@ -142,6 +185,12 @@ urlpatterns = [
         view=AgregarCorresponsablesView.as_view(),
         name='corresponsables'
     ),
+
+    path(
+        route='corresponsables/buscar',
+        view=BuscarCorresponsablesView.as_view(),
+        name='buscar_corresponsables'
+    ),
 ]
 
 handler403 = custom_403
@@ -1,20 +1,32 @@
+import hashlib
+import json
+import time
 from datetime import datetime, timedelta
 
 from django.contrib import messages
 from django.contrib.auth.mixins import UserPassesTestMixin, LoginRequiredMixin
+from django.db.models import Count, Max, Min, Q, Sum
+from django.conf import settings
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.shortcuts import redirect
 from django.shortcuts import render
 from django.urls import reverse_lazy
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.utils.dateparse import parse_datetime
 from django.utils.timezone import make_aware
 from django.views import View
+from django.views.decorators.http import condition
 from django.views.generic.edit import UpdateView
 from django.contrib.auth import update_session_auth_hash
+from .availability import MINUTOS_BLOQUE, canal_disponibilidad, horarios_permitidos, mapa_disponibilidad
+from .carrito_sesion import CarritoSesion, carrito_en_sesion, obtener_carrito, obtener_carrito_o_404
 from .forms import CorresponsableForm, CambiarEstadoOrdenForm, CambiarEstadoCorresponsableOrdenForm,CambiarContrasenaForm
-from .forms import FiltrosForm, ActualizarPerfil, UpdateUserForm
-from .models import Articulo, Categoria, CorresponsableOrden, Coordinador, Maestro, Ubicacion
+from .forms import FiltrosForm, ActualizarPerfil, UpdateUserForm, CalendarioUnidadesForm
+from .models import Articulo, Categoria, CorresponsableOrden, Coordinador, Kit, Maestro, Materia, Ubicacion
 from .models import Carrito, Prestatario
-from .models import Orden, EstadoOrden, Perfil
+from .models import Orden, EstadoOrden, Perfil, Unidad, UnidadReserva
 
 
 class IndexView(View):
@@ -33,27 +45,52 @@ class AgregarCorresponsablesView(UpdateView):
     success_url = reverse_lazy('carrito')
 
     def get_object(self, queryset=None):
-        user = self.request.user
-        return get_object_or_404(Carrito, prestatario=user)
+        return obtener_carrito_o_404(self.request)
 
     def get_form_kwargs(self):
+        # get() y post() ya guardaron el carrito en self.object
         kwargs = super().get_form_kwargs()
-        carrito = self.get_object()
-        kwargs['instance'] = carrito
+        carrito = self.object
+        kwargs['instance'] = carrito.instancia() if isinstance(carrito, CarritoSesion) else carrito
         kwargs['materia'] = carrito.materia
+        kwargs['initial'] = {'corresponsables': carrito.corresponsables()}
         return kwargs
 
     def form_valid(self, form):
-        response = super().form_valid(form)
-        form.instance._corresponsables.clear()
-        for corresponsable in form.cleaned_data['corresponsables']:
-            form.instance._corresponsables.add(corresponsable)
-        return response
+        self.object.establecer_corresponsables(form.cleaned_data['corresponsables'])
+        self.object.save()
+        return redirect(self.get_success_url())
 
     def get_success_url(self):
         return reverse_lazy('carrito')
 
 
+class BuscarCorresponsablesView(LoginRequiredMixin, View):
+    """
+    Busca, mientras se escribe, alumnos de la materia del carrito cuya matrícula,
+    nombre o apellido empieza con el texto ``q``, para agregarlos como corresponsables
+    sin mostrar a todo el grupo.
+    """
+    LIMITE = 20
+
+    def get(self, request):
+        carrito = obtener_carrito(request)
+        if carrito is None:
+            return JsonResponse({'error': 'No hay un carrito activo.'}, status=404)
+
+        texto = request.GET.get('q', '').strip()
+        alumnos = carrito.materia.buscar_alumnos(texto, self.LIMITE + 1) if texto else []
+
+        return JsonResponse({'resultados': [
+            {
+                'id': alumno.id,
+                'username': alumno.username,
+                'nombre': f"{alumno.first_name} {alumno.last_name}".strip(),
+            }
+            for alumno in alumnos if alumno.id != request.user.id
+        ][:self.LIMITE]})
+
+
 class ActualizarPerfilView(LoginRequiredMixin, View):
 
     def get(self, request):
@@ -116,40 +153,90 @@ class MenuView(View, LoginRequiredMixin):
 class CarritoView(LoginRequiredMixin, UserPassesTestMixin, View):
 
     def test_func(self):
-
-        prestatario = Prestatario.get_user(self.request.user)
-        return prestatario.tiene_carrito()
+        return obtener_carrito(self.request) is not None
 
     def get(self, request, accion=None):
-        prestatario = Prestatario.get_user(request.user)
-        carrito = prestatario.carrito()
-        articulos_no_disponibles = []
+        carrito = obtener_carrito(request)
 
         if accion == 'ordenar':
-            carrito = Prestatario.get_user(request.user).carrito()
             ordenado = carrito.ordenar()
 
             if ordenado:
                 return redirect("historial_solicitudes")
 
-        for articulo_carrito in carrito.articulos_carrito():
-            if not articulo_carrito.articulo.disponible(carrito.inicio, carrito.final).exists():
-                articulos_no_disponibles.append(articulo_carrito)
+        verificacion = carrito.verificar()
+        articulos_no_disponibles = verificacion.no_disponibles()
+        for articulo_carrito in verificacion.faltantes():
+            if articulo_carrito.disponibles == 0:
                 messages.add_message(request, messages.WARNING,
                                      f'El artículo {articulo_carrito.articulo.nombre} no está disponible.')
+            else:
+                messages.add_message(request, messages.WARNING,
+                                     f'Solo hay {articulo_carrito.disponibles} de {articulo_carrito.unidades} '
+                                     f'unidades disponibles de {articulo_carrito.articulo.nombre}.')
+
+        sustitutos = carrito.sustitutos([articulo_carrito.articulo for articulo_carrito in articulos_no_disponibles])
+        for articulo_carrito in verificacion.lineas:
+            articulo_carrito.sustitutos = sustitutos.get(articulo_carrito.articulo_id, [])
+            articulo_carrito.no_disponible = articulo_carrito.articulo_id in sustitutos
 
         return render(
             request=request,
             template_name="carrito.html",
             context={
-                "articulos_carrito": carrito.articulos_carrito(),
+                "articulos_carrito": verificacion.lineas,
                 "carrito": carrito,
-                "numero_unidades": carrito.numero_unidades()
+                "numero_unidades": verificacion.numero_unidades(),
+                "ventanas": carrito.ventanas_disponibles() if verificacion.faltantes() else [],
             }
         )
 
     def post(self, request, accion):
-        pass
+        carrito = obtener_carrito(request)
+
+        if accion == 'esperar':
+            articulo = get_object_or_404(Articulo, id=request.POST.get('articulo'))
+            if carrito.existe(articulo):
+                carrito.esperar(articulo)
+                messages.info(request, f"Te avisaremos por correo cuando {articulo.nombre} esté disponible.")
+
+        if accion == 'serie':
+            try:
+                repeticiones = int(request.POST.get('repeticiones', ''))
+            except ValueError:
+                repeticiones = 0
+
+            if repeticiones < 1:
+                messages.error(request, "El número de semanas no es válido.")
+                return redirect("carrito")
+
+            conflictos = carrito.conflictos_serie(repeticiones)
+            articulos = Articulo.objects.in_bulk({articulo_id for _, articulo_id in conflictos})
+            for inicio, articulo_id in conflictos:
+                messages.warning(request,
+                                 f'El artículo {articulos[articulo_id].nombre} no está disponible el {inicio:%d/%m/%Y}.')
+
+            if not conflictos and carrito.ordenar_serie(repeticiones):
+                return redirect("historial_solicitudes")
+
+        if accion == 'reprogramar':
+            inicio = parse_datetime(request.POST.get('inicio', ''))
+            duracion = carrito.final - carrito.inicio
+
+            if inicio is None or (inicio, inicio + duracion) not in horarios_permitidos(duracion, inicio.date(), 1):
+                messages.error(request, "El horario seleccionado no es válido.")
+                return redirect("carrito")
+
+            carrito.inicio = inicio
+            carrito.final = inicio + duracion
+            carrito.save()
+
+            # Los apartados del horario anterior ya no sirven
+            carrito.liberar_apartados()
+            for articulo_carrito in carrito.lineas():
+                carrito.apartar(articulo_carrito.articulo, articulo_carrito.unidades)
+
+        return redirect("carrito")
 
 
 class FiltrosView(LoginRequiredMixin, View):
@@ -171,8 +258,9 @@ class FiltrosView(LoginRequiredMixin, View):
                 messages.add_message(request, messages.WARNING,
                                      "Órdenes extraordinarias no disponibles. El coordinador debe registrar sus datos de contacto.")
 
-        if prestatario.tiene_carrito():
-            prestatario.carrito().eliminar()
+        carrito = obtener_carrito(request)
+        if carrito is not None:
+            carrito.eliminar()
 
         for materia in prestatario.materias():
             if materia.son_correos_vacios():
@@ -199,8 +287,9 @@ class FiltrosView(LoginRequiredMixin, View):
 
         form = FiltrosForm(request.POST)
 
-        if prestatario.tiene_carrito():
-            prestatario.carrito().eliminar()
+        carrito = obtener_carrito(request)
+        if carrito is not None:
+            carrito.eliminar()
 
         if request.user.groups.filter(name='maestro'):
             maestro = Maestro.get_user(request.user)
@@ -230,7 +319,10 @@ class FiltrosView(LoginRequiredMixin, View):
             carrito_nuevo.inicio = make_aware(fecha_inicio)
             carrito_nuevo.final = make_aware(fecha_inicio + timedelta(hours=tiempo_duracion))
 
-            carrito_nuevo.save()
+            if carrito_en_sesion():
+                CarritoSesion.desde_carrito(request, carrito_nuevo).save()
+            else:
+                carrito_nuevo.save()
             return redirect("catalogo")
 
         return render(
@@ -244,6 +336,202 @@ class FiltrosView(LoginRequiredMixin, View):
         )
 
 
+def _mapa_periodo():
+    """
+    Periodo que cubre el mapa de disponibilidad: las dos semanas a partir de hoy.
+    """
+    origen = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    return origen, MapaDisponibilidadView.DIAS
+
+
+def _mapa_etag(request, *args, **kwargs):
+    """
+    Huella del mapa de disponibilidad de una materia. Solo consulta los artículos de
+    la materia y agregados de sus reservas y unidades, por lo que responder 304 es
+    casi gratis.
+
+    Las reservas son las mismas que usa el mapa (``colisiones``, que excluye los
+    apartados expirados): cuando un apartado expira cambian su número y la siguiente
+    expiración aunque ninguna fila se haya modificado.
+    """
+    materia = request.GET.get('materia')
+    origen, dias = _mapa_periodo()
+    articulos = list(Articulo.objects.filter(materia=materia).order_by('id').values_list('id', 'nombre'))
+    ids = [articulo_id for articulo_id, _ in articulos]
+
+    reservas = UnidadReserva.objects.colisiones(origen, origen + timedelta(days=dias)).filter(
+        unidad__articulo__in=ids
+    ).aggregate(total=Count('id'), ultima=Max('id'), actualizado=Max('actualizado'), expira=Min('expira'))
+    unidades = Unidad.objects.filter(articulo__in=ids, estado=Unidad.Estado.ACTIVO).aggregate(
+        total=Count('id'), suma=Sum('id')
+    )
+    huella = f"{materia}|{origen.isoformat()}|{articulos}|{sorted(reservas.items())}|{sorted(unidades.items())}"
+    return hashlib.md5(huella.encode()).hexdigest()
+
+
+class MapaDisponibilidadView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Devuelve en JSON las unidades libres de cada artículo de una materia en cada
+    bloque de 30 minutos de las próximas dos semanas. Soporta GET condicional (ETag).
+    """
+
+    DIAS = 14
+
+    def test_func(self):
+        materia = get_object_or_404(Materia, pk=self.request.GET.get('materia'))
+        return materia._alumnos.filter(pk=self.request.user.pk).exists() or \
+            materia._maestros.filter(pk=self.request.user.pk).exists()
+
+    @method_decorator(condition(etag_func=_mapa_etag))
+    def get(self, request):
+        materia = get_object_or_404(Materia, pk=request.GET.get('materia'))
+        articulos = list(materia.articulos().annotate(
+            total=Count('unidad', filter=Q(unidad__estado=Unidad.Estado.ACTIVO))
+        ).order_by('nombre'))
+
+        origen, dias = _mapa_periodo()
+        libres = mapa_disponibilidad([articulo.id for articulo in articulos], origen, dias)
+
+        response = JsonResponse({
+            'materia': materia.nombre,
+            'inicio': origen.isoformat(),
+            'minutos_bloque': MINUTOS_BLOQUE,
+            'articulos': [
+                {
+                    'id': articulo.id,
+                    'nombre': articulo.nombre,
+                    'unidades': articulo.total,
+                    'libres': libres[articulo.id],
+                }
+                for articulo in articulos
+            ],
+        })
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class CalendarioUnidadesMixin(LoginRequiredMixin, UserPassesTestMixin):
+    """
+    Obtiene las reservas de las unidades elegidas en la ventana de tiempo del
+    calendario, con una consulta por rango sobre ``UnidadReserva``. Solo el personal
+    de almacén y los administradores pueden consultarlo.
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff or self.request.user.groups.filter(name='almacen').exists()
+
+    def calendario(self, form: CalendarioUnidadesForm) -> dict:
+        """
+        :param form: Formulario válido con las unidades y la ventana.
+        :returns: Diccionario con la ventana, las ventanas anterior y siguiente y la
+            lista de unidades, cada una con sus reservas ordenadas por inicio.
+        """
+        primer_dia, ultimo_dia = form.periodo()
+        desde = make_aware(datetime.combine(primer_dia, datetime.min.time()))
+        hasta = make_aware(datetime.combine(ultimo_dia, datetime.min.time()))
+
+        unidades = list(form.unidades())
+        for unidad in unidades:
+            unidad.reservas_calendario = []
+
+        por_id = {unidad.id: unidad for unidad in unidades}
+        reservas = UnidadReserva.objects.vigentes().en_rango(desde, hasta).filter(unidad__in=por_id) \
+            .exclude(orden__estado=EstadoOrden.CANCELADA).select_related('orden').order_by('inicio')
+        for reserva in reservas:
+            por_id[reserva.unidad_id].reservas_calendario.append(reserva)
+
+        return {
+            'desde': desde,
+            'hasta': hasta,
+            'vista': form.cleaned_data['vista'],
+            'anterior': primer_dia - (ultimo_dia - primer_dia),
+            'siguiente': ultimo_dia,
+            'unidades': unidades,
+        }
+
+
+class CalendarioUnidadesView(CalendarioUnidadesMixin, View):
+    """
+    Calendario de ocupación de unidades en una cuadrícula por día (columnas de una
+    hora) o por semana (columnas de un día).
+    """
+
+    def get(self, request):
+        form = CalendarioUnidadesForm(request.GET or None)
+        contexto = {'form': form}
+
+        if form.is_valid():
+            calendario = self.calendario(form)
+            paso = timedelta(hours=1) if calendario['vista'] == 'dia' else timedelta(days=1)
+
+            columnas = []
+            inicio = calendario['desde']
+            while inicio < calendario['hasta']:
+                columnas.append(inicio)
+                inicio += paso
+
+            filas = [
+                (unidad, [
+                    [reserva for reserva in unidad.reservas_calendario
+                     if reserva.inicio < columna + paso and reserva.final > columna]
+                    for columna in columnas
+                ])
+                for unidad in calendario['unidades']
+            ]
+
+            parametros = request.GET.copy()
+            parametros['desde'] = calendario['anterior'].isoformat()
+            anterior = parametros.urlencode()
+            parametros['desde'] = calendario['siguiente'].isoformat()
+            siguiente = parametros.urlencode()
+
+            contexto.update(calendario, columnas=columnas, filas=filas, url_anterior=anterior, url_siguiente=siguiente)
+
+        return render(request, "calendario_unidades.html", contexto)
+
+
+class CalendarioUnidadesJsonView(CalendarioUnidadesMixin, View):
+    """
+    Devuelve en JSON las reservas de las unidades elegidas en la ventana del
+    calendario, con las fechas de las ventanas anterior y siguiente para paginar.
+    """
+
+    def get(self, request):
+        form = CalendarioUnidadesForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'errores': form.errors}, status=400)
+
+        calendario = self.calendario(form)
+        return JsonResponse({
+            'desde': calendario['desde'].isoformat(),
+            'hasta': calendario['hasta'].isoformat(),
+            'vista': calendario['vista'],
+            'anterior': calendario['anterior'].isoformat(),
+            'siguiente': calendario['siguiente'].isoformat(),
+            'unidades': [
+                {
+                    'id': unidad.id,
+                    'articulo': unidad.articulo.nombre,
+                    'num_control': unidad.num_control,
+                    'num_serie': unidad.num_serie,
+                    'estado': unidad.estado,
+                    'reservas': [
+                        {
+                            'inicio': reserva.inicio.isoformat(),
+                            'final': reserva.final.isoformat(),
+                            'orden': reserva.orden_id,
+                            'nombre': reserva.orden.nombre if reserva.orden else None,
+                            'estado': reserva.orden.estado if reserva.orden else None,
+                            'apartado': reserva.orden_id is None,
+                        }
+                        for reserva in unidad.reservas_calendario
+                    ],
+                }
+                for unidad in calendario['unidades']
+            ],
+        })
+
+
 class SolicitudView(View):
 
     def get(self, request):
@@ -298,41 +586,55 @@ class DetallesOrdenView(LoginRequiredMixin, UserPassesTestMixin, View):
         return redirect("historial_solicitudes")
 
 
+def _sustitutos_carrito(carrito):
+    """
+    Lista de tuplas ``(articulo, sugerencias)`` con los artículos no disponibles
+    del carrito que tienen algún sustituto disponible.
+    """
+    articulos = [articulo_carrito.articulo for articulo_carrito in carrito.articulos_no_disponibles()]
+    sustitutos = carrito.sustitutos(articulos)
+    return [(articulo, sustitutos[articulo.id]) for articulo in articulos if sustitutos[articulo.id]]
+
+
+def _kits_disponibles(carrito):
+    """
+    Kits de la materia del carrito que se pueden prestar completos en su horario,
+    anotados con ``num_disponibles``.
+    """
+    kits = list(Kit.objects.para_materia(carrito.materia))
+    disponibles = Kit.objects.filter(id__in=[kit.id for kit in kits]).disponibilidad(carrito.inicio, carrito.final)
+    for kit in kits:
+        kit.num_disponibles = disponibles[kit.id]
+    return [kit for kit in kits if kit.num_disponibles > 0]
+
+
 class CatalogoView(View, LoginRequiredMixin, UserPassesTestMixin):
 
     def test_func(self):
-        prestatario = Prestatario.get_user(self.request.user)
-        carrito = get_object_or_404(Carrito, prestatario=prestatario)
-        return prestatario == carrito.prestatario
+        return obtener_carrito(self.request) is not None
 
     def get(self, request):
-        prestatario = Prestatario.get_user(request.user)
-        carrito = prestatario.carrito()
+        carrito = obtener_carrito(request)
 
         # Filtrar las unidades disponibles para cada artículo
-        articulos_disponibles = []
-        for articulo in carrito.materia.articulos():
-            cantidad_disponible = articulo.disponible(carrito.inicio, carrito.final).count()
-
-            if cantidad_disponible > 0:
-                articulos_disponibles.append(articulo)
-                articulo.num_unidades = cantidad_disponible
-            else:
-                articulo.num_unidades = 0
+        articulos = carrito.materia.articulos().anotar_disponibles(carrito.inicio, carrito.final,
+                                                                   prestatario=request.user)
+        articulos_disponibles = [articulo for articulo in articulos if articulo.num_unidades > 0]
 
         return render(
             request=request,
             template_name="catalogo.html",
             context={
                 "articulos": articulos_disponibles,
-                "carrito": prestatario.carrito(),
-                "categorias": Categoria.objects.all()
+                "carrito": carrito,
+                "categorias": Categoria.objects.all(),
+                "sustitutos": _sustitutos_carrito(carrito),
+                "kits": _kits_disponibles(carrito),
             },
         )
 
     def post(self, request):
-        prestatario = Prestatario.get_user(request.user)
-        carrito = prestatario.carrito()
+        carrito = obtener_carrito(request)
         categoria = request.POST["categoria"]
         articulos = carrito.materia.articulos()
 
@@ -341,35 +643,89 @@ class CatalogoView(View, LoginRequiredMixin, UserPassesTestMixin):
             articulos = articulos.filter(id__in=categoria_instance.articulos())
 
         # Filtrar las unidades disponibles para cada artículo
-        articulos_disponibles = []
-        for articulo in articulos:
-            cantidad_disponible = articulo.disponible(carrito.inicio, carrito.final).count()
-
-            if cantidad_disponible > 0:
-                articulos_disponibles.append(articulo)
-                articulo.num_unidades = cantidad_disponible
-            else:
-                articulo.num_unidades = 0
+        articulos = articulos.anotar_disponibles(carrito.inicio, carrito.final, prestatario=request.user)
+        articulos_disponibles = [articulo for articulo in articulos if articulo.num_unidades > 0]
 
         return render(
             request=request,
             template_name="catalogo.html",
             context={
                 "articulos": articulos_disponibles,
-                "carrito": prestatario.carrito(),
-                "categorias": Categoria.objects.all()
+                "carrito": carrito,
+                "categorias": Categoria.objects.all(),
+                "sustitutos": _sustitutos_carrito(carrito),
+                "kits": _kits_disponibles(carrito),
             },
         )
 
 
+def _eventos_disponibilidad(suscripcion, inicio, final, conteos: dict[int, int], duracion: float):
+    """
+    Genera los eventos del flujo de disponibilidad de un catálogo: cada vez que la
+    suscripción recibe artículos modificados se recalculan solo esos y se envían los
+    conteos que cambiaron. La suscripción se cancela al terminar el flujo.
+
+    :param suscripcion: Suscripción en ``canal_disponibilidad``.
+    :param inicio: Inicio del horario del catálogo.
+    :param final: Final del horario del catálogo.
+    :param conteos: Unidades disponibles que ya conoce el cliente, por id de artículo.
+    :param duracion: Segundos que dura el flujo antes de que el cliente se reconecte.
+    """
+    espera = getattr(settings, 'DISPONIBILIDAD_SSE_ESPERA', 15)
+    limite = time.monotonic() + duracion
+    try:
+        yield f"retry: {espera * 1000}\n\n"
+        while time.monotonic() < limite:
+            cambiados = suscripcion.esperar(min(espera, limite - time.monotonic()))
+            if not cambiados:
+                yield ": keep-alive\n\n"
+                continue
+
+            nuevos = Articulo.objects.filter(id__in=cambiados).disponibilidad(inicio, final)
+            delta = {articulo_id: n for articulo_id, n in nuevos.items() if conteos.get(articulo_id) != n}
+            if delta:
+                conteos.update(delta)
+                yield f"event: disponibilidad\ndata: {json.dumps(delta)}\n\n"
+    finally:
+        canal_disponibilidad.cancelar(suscripcion)
+
+
+class DisponibilidadCatalogoView(LoginRequiredMixin, View):
+    """
+    Flujo de eventos (server-sent events) con los cambios en las unidades disponibles
+    de los artículos del catálogo del carrito, en el horario del carrito. Cada evento
+    contiene solo los conteos que cambiaron, como un objeto JSON ``{id: unidades}``.
+    """
+
+    def get(self, request):
+        carrito = obtener_carrito(request)
+        if carrito is None:
+            return JsonResponse({'error': 'No hay un carrito activo.'}, status=404)
+
+        articulos = carrito.materia.articulos()
+        conteos = articulos.disponibilidad(carrito.inicio, carrito.final)
+
+        # una reserva afecta al horario si se traslapa con él incluyendo el margen entre préstamos
+        margen = max((previo + posterior for previo, posterior in
+                      articulos.values_list('margen_previo', 'margen_posterior')), default=timedelta(0))
+        suscripcion = canal_disponibilidad.suscribir(conteos, carrito.inicio - margen, carrito.final + margen)
+
+        response = StreamingHttpResponse(
+            _eventos_disponibilidad(suscripcion, carrito.inicio, carrito.final, conteos,
+                                    getattr(settings, 'DISPONIBILIDAD_SSE_DURACION', 300)),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
 class DetallesArticuloView(View):
 
     def get(self, request, id):
-        prestatario = Prestatario.get_user(request.user)
-        carrito = prestatario.carrito()
+        carrito = obtener_carrito(request)
         articulo = get_object_or_404(Articulo, id=id)
-
-        articulo.num_unidades = articulo.disponible(carrito.inicio, carrito.final).count()
+        articulo.num_unidades = Articulo.objects.filter(id=id).disponibilidad(carrito.inicio, carrito.final)[id]
 
         return render(
             request=request,
@@ -378,22 +734,134 @@ class DetallesArticuloView(View):
         )
 
 
+def _cambiar_cantidad(carrito, articulo, cantidad: int) -> int:
+    """
+    Cambia las unidades de un artículo del carrito y aparta las nuevas unidades. La
+    línea se ajusta en su lugar para no soltar los apartados que ya tiene antes de
+    que ``apartar`` los renueve en su transacción.
+
+    :param carrito: El carrito del usuario.
+    :param articulo: El artículo que se agrega o cambia.
+    :param cantidad: Unidades que tendrá el artículo en el carrito.
+    :returns: Número de unidades apartadas.
+    """
+    actual = carrito.solicitud().get(articulo.id, 0)
+    if cantidad > actual:
+        carrito.agregar(articulo, cantidad - actual)
+    elif cantidad < actual:
+        carrito.eliminar_articulo(articulo, actual - cantidad)
+    carrito.save()
+
+    return carrito.apartar(articulo, cantidad)
+
+
 class AgregarAlCarritoView(View, UserPassesTestMixin, LoginRequiredMixin):
 
     def test_func(self):
-        prestatario = Prestatario.get_user(self.request.user)
-        return prestatario.tiene_carrito()
+        return obtener_carrito(self.request) is not None
 
     def post(self, request, articulo_id):
-        carrito = get_object_or_404(Carrito, prestatario=request.user)
+        carrito = obtener_carrito_o_404(request)
         articulo = get_object_or_404(Articulo, id=articulo_id)
         cantidad = int(request.POST.get('cantidad', 1))
 
-        if carrito.existe(articulo):
+        apartadas = _cambiar_cantidad(carrito, articulo, cantidad)
+        if apartadas < cantidad:
+            messages.warning(request, f"Solo se pudieron apartar {apartadas} de {cantidad} unidades de "
+                                      f"{articulo.nombre}. Se intentará asignar el resto al ordenar.")
+
+        # Sustituir un artículo no disponible por el artículo agregado
+        reemplaza = request.POST.get('reemplaza')
+        if reemplaza:
+            reemplazado = get_object_or_404(Articulo, id=reemplaza)
+            if carrito.existe(reemplazado):
+                carrito.eliminar_articulo(reemplazado)
+            return redirect("carrito")
+
+        return redirect("catalogo")
+
+
+class ArticuloCarritoJsonView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Agrega, cambia o elimina un artículo del carrito sin volver a generar el catálogo
+    ni el carrito. La respuesta JSON contiene solo la línea del artículo, los totales
+    del carrito y las unidades disponibles del artículo en el horario del carrito.
+
+    Acciones: ``agregar`` suma ``cantidad`` (1 por omisión) a las unidades del
+    artículo, ``actualizar`` las cambia a ``cantidad`` y ``eliminar`` quita el artículo.
+    """
+    ACCIONES = ('agregar', 'actualizar', 'eliminar')
+
+    def test_func(self):
+        return obtener_carrito(self.request) is not None
+
+    def post(self, request, articulo_id, accion):
+        if accion not in self.ACCIONES:
+            return JsonResponse({'error': 'Acción no válida.'}, status=404)
+
+        carrito = obtener_carrito(request)
+        articulo = get_object_or_404(Articulo, id=articulo_id)
+        actual = carrito.solicitud().get(articulo.id, 0)
+
+        try:
+            cantidad = int(request.POST.get('cantidad', 1))
+        except ValueError:
+            return JsonResponse({'error': 'La cantidad no es válida.'}, status=400)
+
+        if accion == 'agregar':
+            cantidad += actual
+        elif accion == 'eliminar':
+            cantidad = 0
+
+        if cantidad < 0:
+            return JsonResponse({'error': 'La cantidad no es válida.'}, status=400)
+
+        apartadas = 0
+        if cantidad > 0:
+            apartadas = _cambiar_cantidad(carrito, articulo, cantidad)
+        elif actual > 0:
             carrito.eliminar_articulo(articulo)
+            carrito.save()
+
+        solicitud = carrito.solicitud()
+        disponibles = Articulo.objects.filter(id=articulo.id).disponibilidad(carrito.inicio, carrito.final)
+        datos = {
+            'linea': {
+                'articulo': articulo.id,
+                'nombre': articulo.nombre,
+                'unidades': cantidad,
+                'apartadas': apartadas,
+            } if cantidad > 0 else None,
+            'carrito': {
+                'articulos': len(solicitud),
+                'unidades': sum(solicitud.values()),
+            },
+            'disponibles': disponibles.get(articulo.id, 0),
+        }
+        if apartadas < cantidad:
+            datos['aviso'] = f"Solo se pudieron apartar {apartadas} de {cantidad} unidades de {articulo.nombre}. " \
+                             f"Se intentará asignar el resto al ordenar."
+        return JsonResponse(datos)
 
-        carrito.agregar(articulo, cantidad)
-        carrito.save()
+
+class AgregarKitAlCarritoView(LoginRequiredMixin, UserPassesTestMixin, View):
+
+    def test_func(self):
+        return obtener_carrito(self.request) is not None
+
+    def post(self, request, kit_id):
+        carrito = obtener_carrito_o_404(request)
+        kit = get_object_or_404(Kit, id=kit_id)
+
+        try:
+            cantidad = int(request.POST.get('cantidad', 1))
+        except ValueError:
+            return HttpResponseBadRequest("La cantidad no es válida.")
+        if cantidad < 1:
+            return HttpResponseBadRequest("La cantidad no es válida.")
+
+        if not carrito.agregar_kit(kit, cantidad):
+            messages.warning(request, f"No hay unidades suficientes para apartar el kit {kit.nombre}.")
 
         return redirect("catalogo")
 
@@ -462,11 +930,10 @@ class CambiarEstadoOrdenView(LoginRequiredMixin, UserPassesTestMixin, View):
 class EliminarDelCarritoView(View, UserPassesTestMixin, LoginRequiredMixin):
 
     def test_func(self):
-        prestatario = Prestatario.get_user(self.request.user)
-        return prestatario.tiene_carrito()
+        return obtener_carrito(self.request) is not None
 
     def get(self, request, articulo_id):
-        carrito = get_object_or_404(Carrito, prestatario=request.user)
+        carrito = obtener_carrito_o_404(request)
         articulo = get_object_or_404(Articulo, id=articulo_id)
 
         carrito.eliminar_articulo(articulo)
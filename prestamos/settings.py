@@ -145,4 +145,36 @@ X_FRAME_OPTIONS = "SAMEORIGIN"
 SILENCED_SYSTEM_CHECKS = ["security.W019"]
 
 # para enviar las urls en los emails
-URL_BASE_PARA_EMAILS = "http://127.0.0.1:8000"
\ No newline at end of file
+URL_BASE_PARA_EMAILS = "http://127.0.0.1:8000"
+# Disponibilidad
+# usar el motor de intervalos en memoria (PEMA/availability.py) en lugar de consultar la base de datos
+DISPONIBILIDAD_EN_MEMORIA = False
+# segundos que un índice en memoria es válido antes de reconstruirse
+DISPONIBILIDAD_EN_MEMORIA_TTL = 60
+# días (a partir de hoy) que cubre la matriz de ocupación del motor en memoria
+DISPONIBILIDAD_MATRIZ_DIAS = 180
+# días que revisa la búsqueda de horarios disponibles para un carrito
+DISPONIBILIDAD_BUSQUEDA_DIAS = 60
+# guardar los resultados de disponibilidad en el caché de Django (PEMA/availability.py)
+DISPONIBILIDAD_CACHE = False
+# alias de CACHES que usa el caché de disponibilidad
+DISPONIBILIDAD_CACHE_ALIAS = 'default'
+# segundos que se conserva una entrada del caché de disponibilidad
+DISPONIBILIDAD_CACHE_TTL = 300
+# segundos entre comentarios de keep-alive del flujo de disponibilidad del catálogo
+DISPONIBILIDAD_SSE_ESPERA = 15
+# segundos que dura una conexión del flujo de disponibilidad antes de que el navegador se reconecte
+DISPONIBILIDAD_SSE_DURACION = 300
+# guardar el carrito como borrador en la sesión y crearlo en la base de datos solo al ordenar
+# (PEMA/carrito_sesion.py); requiere SESSION_ENGINE de cookies firmadas o caché (PEMA/checks.py)
+CARRITO_EN_SESION = False
+# segundos sin cambios después de los que un carrito se considera abandonado
+# (manage.py limpiar_carritos)
+CARRITO_TTL = 24 * 60 * 60
+# segundos que un carrito aparta las unidades de sus artículos
+APARTADOS_TTL = 600
+# segundos que se apartan para una entrada de la lista de espera las unidades que se liberan
+LISTA_ESPERA_TTL = 24 * 60 * 60
+# estrategia para elegir las unidades de una orden (PEMA/asignacion.py):
+# 'aleatoria', 'menos_reciente' o 'menor_uso'
+ASIGNACION_ESTRATEGIA = 'aleatoria'